@@ -2,6 +2,8 @@
 set -ex
 pip install keystonemiddleware
 pip install python-keystoneclient
+# For the token cache tests (see tests/integration/keystone.py):
+pip install python-memcached
 # The exact commit we use here is somewhat arbitrary, but we want
 # something that (a) won't change out from under our feet, and (b)
 # works with our existing tests.
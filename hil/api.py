@@ -16,37 +16,78 @@
 
 TODO: Spec out and document what sanitization is required.
 """
+import base64
+import itertools
 import json
+from datetime import datetime
 
-from schema import Schema, Optional
+import flask
+from schema import Schema, SchemaError, Optional, Use, And
 
 from hil import model
 from hil.model import db
 from hil.auth import get_auth_backend
+from hil.cache import cached
 from hil.config import cfg
-from hil.rest import rest_call
+from hil.rest import rest_call, run_batch, json_array, json_object
 from hil.class_resolver import concrete_class_for
 from hil.network_allocator import get_network_allocator
 from hil.errors import *
 
 
+# The number of rows to fetch at a time, for queries whose results are
+# streamed to the client:
+_YIELD_PER = 1000
+
+# The most values to put in a single SQL ``IN`` clause:
+_MAX_IN_VALUES = 500
+
+
+def _list_schema(args):
+    """Return the schema for a list call taking the arguments `args`.
+
+    As well as `args`, the call accepts the optional arguments ``limit``,
+    ``cursor`` and ``fields``; see `_paginate` and `_select_fields`.
+    """
+    schema = {
+        Optional('limit'): And(Use(int), lambda n: n > 0),
+        Optional('cursor'): basestring,
+        Optional('fields'): basestring,
+    }
+    schema.update(args)
+    return Schema(schema)
+
+
 # Project Code #
 ################
-@rest_call('GET', '/projects', Schema({}))
-def list_projects():
+_PROJECT_FIELDS = {
+    'name': lambda project: project.label,
+}
+
+
+@rest_call('GET', '/projects', _list_schema({}))
+@cached(model.Project)
+def list_projects(limit=None, cursor=None, fields=None):
     """List all projects.
 
-    Returns a JSON array of strings representing a list of projects.
+    Returns a JSON array of strings representing a list of projects, or,
+    if `fields` is given, of objects with those fields.
 
     Example:  '["project1", "project2", "project3"]'
     """
     get_auth_backend().require_admin()
-    projects = model.Project.query.all()
-    projects = sorted([p.label for p in projects])
-    return json.dumps(projects)
+    fields = _select_fields(fields, _PROJECT_FIELDS)
+    projects, next_cursor = _paginate(model.Project.query,
+                                      model.Project.label, limit, cursor)
+    if fields is None:
+        body = [p.label for p in projects]
+    else:
+        body = _field_dicts(projects, fields, _PROJECT_FIELDS)
+    return _page_response(body, next_cursor)
 
 
-@rest_call('PUT', '/project/<project>', Schema({'project': basestring}))
+@rest_call('PUT', '/project/<project>', Schema({'project': basestring}),
+           batch=True)
 def project_create(project):
     """Create a project.
 
@@ -59,7 +100,8 @@ def project_create(project):
     db.session.commit()
 
 
-@rest_call('DELETE', '/project/<project>', Schema({'project': basestring}))
+@rest_call('DELETE', '/project/<project>', Schema({'project': basestring}),
+           batch=True)
 def project_delete(project):
     """Delete project.
 
@@ -67,11 +109,12 @@ def project_delete(project):
     """
     get_auth_backend().require_admin()
     project = _must_find(model.Project, project)
-    if project.nodes:
+    if _any(model.Node.query.filter_by(project=project)):
         raise BlockedError("Project has nodes still")
-    if project.networks_created:
+    if _any(model.Network.query.filter_by(owner=project)):
         raise BlockedError("Project still has networks")
-    if project.networks_access:
+    if _any(model.Network.query
+            .filter(model.Network.access.contains(project))):
         # FIXME: This is not the user's fault, and they cannot fix it.  The
         # only reason we need to error here is that, with how network access
         # is done, the following bad thing happens.  If there's a network
@@ -82,7 +125,7 @@ def project_delete(project):
         # will not be an issue---instead, the network will be accessible by
         # NO projects.
         raise BlockedError("Project can still access networks")
-    if project.headnodes:
+    if _any(model.Headnode.query.filter_by(project=project)):
         raise BlockedError("Project still has a headnode")
     db.session.delete(project)
     db.session.commit()
@@ -90,7 +133,7 @@ def project_delete(project):
 
 @rest_call('POST', '/project/<project>/connect_node', Schema({
     'project': basestring, 'node': basestring,
-}))
+}), batch=True)
 def project_connect_node(project, node):
     """Add a node to a project.
 
@@ -103,7 +146,7 @@ def project_connect_node(project, node):
     node = _must_find(model.Node, node)
     if node.project is not None:
         raise BlockedError("Node is already owned by a project.")
-    project.nodes.append(node)
+    node.project = project
     db.session.commit()
 
 
@@ -120,26 +163,24 @@ def project_detach_node(project, node):
     """
     project = _must_find(model.Project, project)
     get_auth_backend().require_project_access(project)
-    node = _must_find(model.Node, node)
-    if node not in project.nodes:
+    node = _must_find(model.Node, node, _joinedload_obm())
+    if node.project is not project:
         raise NotFoundError("Node not in project")
-    num_attachments = model.NetworkAttachment.query \
-        .filter(model.Nic.owner == node,
-                model.NetworkAttachment.nic_id == model.Nic.id).count()
-    if num_attachments != 0:
+    if _any(model.NetworkAttachment.query.join(model.Nic)
+            .filter(model.Nic.owner == node)):
         raise BlockedError("Node attached to a network")
-    for nic in node.nics:
-        if nic.current_action is not None:
-            raise BlockedError("Node has pending network actions")
+    if _any(model.NetworkingAction.query.join(model.Nic)
+            .filter(model.Nic.owner == node)):
+        raise BlockedError("Node has pending network actions")
     node.obm.stop_console()
     node.obm.delete_console()
-    project.nodes.remove(node)
+    node.project = None
     db.session.commit()
 
 
 @rest_call('PUT', '/network/<network>/access/<project>', Schema({
     'project': basestring, 'network': basestring,
-}))
+}), batch=True)
 def network_grant_project_access(project, network):
     """Add access to <network> to <project>.
 
@@ -167,7 +208,7 @@ def network_grant_project_access(project, network):
 
 @rest_call('DELETE', '/network/<network>/access/<project>', Schema({
     'project': basestring, 'network': basestring,
-}))
+}), batch=True)
 def network_revoke_project_access(project, network):
     """Remove access to <network> from <project>.
 
@@ -198,16 +239,18 @@ def network_revoke_project_access(project, network):
                            "its access cannot be removed" %
                            (project.label, network.label))
 
-    # TODO: Make this and the next loop more SQLAlchemy-friendly
-    for attachment in network.attachments:
-        if attachment.nic.owner.project.label == project.label:
-            raise BlockedError(
-                "Project still has node(s) attached to the network")
+    if _any(model.NetworkAttachment.query
+            .join(model.Nic).join(model.Node)
+            .filter(model.NetworkAttachment.network == network,
+                    model.Node.project == project)):
+        raise BlockedError(
+            "Project still has node(s) attached to the network")
 
-    for hnic in network.hnics:
-        if hnic.owner.project.label == project.label:
-            raise BlockedError(
-                "Project still has headnode(s) attached to the network")
+    if _any(model.Hnic.query.join(model.Headnode)
+            .filter(model.Hnic.network == network,
+                    model.Headnode.project == project)):
+        raise BlockedError(
+            "Project still has headnode(s) attached to the network")
 
     network.access.remove(project)
     db.session.commit()
@@ -222,7 +265,7 @@ def network_revoke_project_access(project, network):
         Optional(object): object,
     },
     Optional('metadata'): object,
-}))
+}), batch=True)
 def node_register(node, **kwargs):
     """Create node.
 
@@ -246,26 +289,100 @@ def node_register(node, **kwargs):
     db.session.commit()
 
 
+@rest_call('POST', '/nodes', Schema({
+    'nodes': [{
+        'name': basestring,
+        'obm': {
+            'type': basestring,
+            Optional(object): object,
+        },
+        Optional('nics'): [{
+            'label': basestring,
+            'macaddr': basestring,
+        }],
+        Optional('metadata'): {Optional(basestring): object},
+    }],
+}), dont_log=('nodes',))
+def node_register_many(nodes):
+    """Register many nodes at once, along with their nics and metadata.
+
+    `nodes` is a list of objects with the keys ``name``, ``obm`` and
+    (optionally) ``metadata``, as for `node_register`, and (optionally)
+    ``nics``: a list of objects with the keys ``label`` and ``macaddr``, as
+    for `node_register_nic`.
+
+    Every node is validated before any is registered. If any are invalid,
+    none are, and a BulkError reports what is wrong with each of those.
+    Otherwise, they are all registered in one transaction; their nics and
+    metadata are inserted with a statement per table, however many there
+    are.
+    """
+    get_auth_backend().require_admin()
+    names = [node['name'] for node in nodes]
+    taken = set()
+    for i in range(0, len(names), _MAX_IN_VALUES):
+        chunk = names[i:i + _MAX_IN_VALUES]
+        taken.update(label for (label,) in
+                     db.session.query(model.Node.label)
+                     .filter(model.Node.label.in_(chunk)))
+
+    node_objs = []
+    errors = []
+    for node in nodes:
+        try:
+            obm = _new_node_obm(node, taken)
+        except APIError as e:
+            errors.append((node['name'], e))
+        else:
+            node_objs.append(model.Node(label=node['name'], obm=obm))
+        taken.add(node['name'])
+    if errors:
+        raise BulkError('%d of %d nodes are invalid; the first, %s: %s' %
+                        (len(errors), len(nodes), errors[0][0],
+                         errors[0][1].message), errors)
+
+    db.session.add_all(node_objs)
+    # Assigns the nodes their ids:
+    db.session.flush()
+    nics = []
+    metadata = []
+    for node, node_obj in zip(nodes, node_objs):
+        for nic in node.get('nics', []):
+            nics.append({'owner_id': node_obj.id,
+                         'label': nic['label'],
+                         'mac_addr': nic['macaddr']})
+        for label, value in node.get('metadata', {}).items():
+            metadata.append({'owner_id': node_obj.id,
+                             'label': label,
+                             'value': json.dumps(value)})
+    _bulk_insert(model.Nic, nics)
+    _bulk_insert(model.Metadata, metadata)
+    db.session.commit()
+
+
 @rest_call('POST', '/node/<node>/power_cycle', Schema({'node': basestring}))
 def node_power_cycle(node):
     auth_backend = get_auth_backend()
-    node = _must_find(model.Node, node)
+    node = _must_find(model.Node, node, _joinedload_obm())
     if node.project is None:
         auth_backend.require_admin()
     else:
         auth_backend.require_project_access(node.project)
     node.obm.power_cycle()
+    # Drivers may record what they did (e.g. the mock obm's power state):
+    db.session.commit()
 
 
 @rest_call('POST', '/node/<node>/power_off', Schema({'node': basestring}))
 def node_power_off(node):
     auth_backend = get_auth_backend()
-    node = _must_find(model.Node, node)
+    node = _must_find(model.Node, node, _joinedload_obm())
     if node.project is None:
         auth_backend.require_admin()
     else:
         auth_backend.require_project_access(node.project)
     node.obm.power_off()
+    db.session.commit()
 
 
 @rest_call('PUT', '/node/<node>/boot_device', Schema({
@@ -273,7 +390,7 @@ def node_power_off(node):
 }))
 def node_set_bootdev(node, bootdev):
     auth_backend = get_auth_backend()
-    node = _must_find(model.Node, node)
+    node = _must_find(model.Node, node, _joinedload_obm())
     if node.project is None:
         auth_backend.require_admin()
     else:
@@ -284,6 +401,178 @@ def node_set_bootdev(node, bootdev):
     node.obm.set_bootdev(bootdev)
 
 
+@rest_call('POST', '/obm_jobs', Schema({
+    'type': basestring,
+    Optional('bootdev'): basestring,
+    Optional('project'): basestring,
+    Optional('nodes'): [basestring],
+}), batch=True)
+def obm_jobs_create(type, bootdev=None, project=None, nodes=None):
+    """Queue an obm operation on many nodes at once.
+
+    `type` is the operation, one of 'power_cycle', 'power_off' or
+    'set_bootdev'; `bootdev` must be supplied (only) for 'set_bootdev'.
+
+    The operation applies to either every node in `project`, or each of the
+    nodes named in `nodes`; exactly one of the two must be given. The
+    caller needs the same access as for the corresponding single-node call
+    (e.g. `node_power_cycle`) on each node.
+
+    The operations are carried out asynchronously by the obm daemon. Returns
+    a JSON array of the new jobs, in the format returned by `show_obm_job`,
+    with the status code 202.
+
+    Raises BadArgumentError if the arguments are invalid (including an
+    invalid boot device for any of the nodes), and NotFoundError if the
+    project or any of the nodes does not exist.
+    """
+    if type not in model.ObmJob.legal_types:
+        raise BadArgumentError('Invalid obm operation %r' % type)
+    if (bootdev is None) != (type != 'set_bootdev'):
+        raise BadArgumentError("bootdev must be given exactly when type is "
+                               "'set_bootdev'")
+    if (project is None) == (nodes is None):
+        raise BadArgumentError('Exactly one of project or nodes must be '
+                               'given')
+
+    auth_backend = get_auth_backend()
+    if project is not None:
+        project = _must_find(model.Project, project)
+        auth_backend.require_project_access(project)
+        nodes = model.Node.query.filter_by(project=project) \
+            .options(_joinedload_obm()) \
+            .order_by(model.Node.label).all()
+    else:
+        found = {}
+        for i in range(0, len(nodes), _MAX_IN_VALUES):
+            chunk = nodes[i:i + _MAX_IN_VALUES]
+            for node in model.Node.query \
+                    .filter(model.Node.label.in_(chunk)) \
+                    .options(db.joinedload('project'), _joinedload_obm()):
+                found[node.label] = node
+        missing = sorted(set(nodes) - set(found))
+        if missing:
+            raise NotFoundError("Node(s) %s do not exist." %
+                                ', '.join(missing))
+        nodes = [found[name] for name in nodes]
+        for node in nodes:
+            if node.project is None:
+                auth_backend.require_admin()
+            else:
+                auth_backend.require_project_access(node.project)
+
+    jobs = []
+    for node in nodes:
+        if bootdev is not None:
+            node.obm.require_legal_bootdev(bootdev)
+        job = model.ObmJob(node=node, type=type, bootdev=bootdev,
+                           status='pending')
+        db.session.add(job)
+        jobs.append(job)
+    # Render the jobs before committing, which would expire them (and their
+    # nodes), costing a query apiece to reload:
+    db.session.flush()
+    result = json.dumps([_obm_job_dict(obm_job) for obm_job in jobs])
+    db.session.commit()
+    return result, 202
+
+
+@rest_call('GET', '/obm_job/<job>', Schema({'job': Use(int)}))
+def show_obm_job(job):
+    """Show the status of an obm job, as created by `obm_jobs_create`.
+
+    Returns a JSON object of the form:
+
+        {"id": 7,
+         "node": "node-1",
+         "type": "set_bootdev",
+         "bootdev": "pxe",
+         "status": "failed",
+         "error": "Could not set boot device"}
+
+    `status` is one of "pending", "running", "done" or "failed". `bootdev`
+    is null unless `type` is "set_bootdev", and `error` is null unless
+    `status` is "failed".
+
+    Raises NotFoundError if the job does not exist.
+    """
+    job_obj = model.ObmJob.query.get(job)
+    if job_obj is None:
+        raise NotFoundError('ObmJob %d does not exist.' % job)
+    node = job_obj.node
+    auth_backend = get_auth_backend()
+    if node.project is None:
+        auth_backend.require_admin()
+    else:
+        auth_backend.require_project_access(node.project)
+    return json.dumps(_obm_job_dict(job_obj), sort_keys=True)
+
+
+@rest_call('GET', '/node/<node>/power_status', Schema({'node': basestring}))
+def node_power_status(node):
+    """Show the power state of a node.
+
+    Returns a JSON object of the form:
+
+        {"state": "on",
+         "updated": "2017-07-17T14:21:09.583213",
+         "error": null}
+
+    `state` is "on", "off", or null if it couldn't be read, in which case
+    `error` describes why. `updated` is when (in UTC) the state was read;
+    `state` and `updated` are both null if it has never been read.
+
+    The state is served from a cache. If the cached state is missing or
+    older than the configured TTL, it is returned anyway, and a job is
+    queued (unless one already is) for the obm daemon to refresh it; the
+    API server never talks to the obm itself.
+    """
+    auth_backend = get_auth_backend()
+    node = _must_find(model.Node, node, db.joinedload('power_state'))
+    if node.project is None:
+        auth_backend.require_admin()
+    else:
+        auth_backend.require_project_access(node.project)
+    power_state = node.power_state
+    if power_state is None or \
+            power_state.updated < datetime.utcnow() - model.PowerState.ttl():
+        queued = model.ObmJob.query \
+            .filter_by(node=node, type='refresh_power_state') \
+            .filter(model.ObmJob.status.in_(('pending', 'running')))
+        if not _any(queued):
+            db.session.add(model.ObmJob(node=node,
+                                        type='refresh_power_state',
+                                        status='pending'))
+            db.session.commit()
+    return json.dumps(_power_state_dict(power_state), sort_keys=True)
+
+
+@rest_call('GET', '/power_status', Schema({Optional('project'): basestring}))
+def list_power_status(project=None):
+    """Show the cached power states of many nodes at once.
+
+    Covers every node in `project`, or every node if `project` is not
+    given (which requires administrative access). Returns a JSON object
+    mapping node names to their power states, in the format returned by
+    `node_power_status`; nodes whose state has never been read have
+    `state` and `updated` both null.
+
+    Unlike `node_power_status`, this never reads the states from the obms,
+    so some may be stale; the obm daemon keeps them up to date.
+    """
+    auth_backend = get_auth_backend()
+    query = model.Node.query.options(db.joinedload('power_state'))
+    if project is None:
+        auth_backend.require_admin()
+    else:
+        project = _must_find(model.Project, project)
+        auth_backend.require_project_access(project)
+        query = query.filter_by(project=project)
+    query = query.order_by(model.Node.label).yield_per(_YIELD_PER)
+    return json_object((node.label, _power_state_dict(node.power_state))
+                       for node in query)
+
+
 @rest_call('DELETE', '/node/<node>', Schema({'node': basestring}))
 def node_delete(node):
     """Delete node.
@@ -291,12 +580,12 @@ def node_delete(node):
     If the node does not exist, a NotFoundError will be raised.
     """
     get_auth_backend().require_admin()
-    node = _must_find(model.Node, node)
+    node = _must_find(model.Node, node, _joinedload_obm())
     if node.project:
         raise BlockedError("Node %r is part of project %r; remove from "
                            "project before deleting"
                            % (node.label, node.project.label))
-    if node.nics != []:
+    if _any(model.Nic.query.filter_by(owner=node)):
         raise BlockedError("Node %r has nics; remove them before deleting %r."
                            % (node.label, node.label))
     node.obm.stop_console()
@@ -307,7 +596,7 @@ def node_delete(node):
 
 @rest_call('PUT', '/node/<node>/nic/<nic>', Schema({
     'node': basestring, 'nic': basestring, 'macaddr': basestring,
-}))
+}), batch=True)
 def node_register_nic(node, nic, macaddr):
     """Register existence of nic attached to given node.
 
@@ -325,7 +614,7 @@ def node_register_nic(node, nic, macaddr):
 
 @rest_call('DELETE', '/node/<node>/nic/<nic>', Schema({
     'node': basestring, 'nic': basestring,
-}))
+}), batch=True)
 def node_delete_nic(node, nic):
     """Delete nic with given name from it's node.
 
@@ -342,7 +631,7 @@ def node_delete_nic(node, nic):
     'nic': basestring,
     'network': basestring,
     Optional('channel'): basestring,
-}))
+}), batch=True)
 def node_connect_network(node, nic, network, channel=None):
     """Connect a physical NIC to a network, on channel.
 
@@ -362,10 +651,10 @@ def node_connect_network(node, nic, network, channel=None):
 
         ``query`` should an argument suitable to pass to db.query(...).filter
         """
-        return model.NetworkAttachment.query.filter(
+        return _any(model.NetworkAttachment.query.filter(
             model.NetworkAttachment.nic == nic,
             query,
-        ).count() != 0
+        ))
 
     auth_backend = get_auth_backend()
 
@@ -415,7 +704,7 @@ def node_connect_network(node, nic, network, channel=None):
 
 @rest_call('POST', '/node/<node>/nic/<nic>/detach_network', Schema({
     'node': basestring, 'nic': basestring, 'network': basestring,
-}))
+}), batch=True)
 def node_detach_network(node, nic, network):
     """Detach network ``network`` from physical nic ``nic``.
 
@@ -452,7 +741,7 @@ def node_detach_network(node, nic, network):
 
 @rest_call('PUT', '/node/<node>/metadata/<label>', Schema({
     'node': basestring, 'label': basestring, 'value': object,
-}))
+}), batch=True)
 def node_set_metadata(node, label, value):
     """Register metadata on a node.
 
@@ -472,7 +761,7 @@ def node_set_metadata(node, label, value):
 
 @rest_call('DELETE', '/node/<node>/metadata/<label>', Schema({
     'node': basestring, 'label': basestring,
-}))
+}), batch=True)
 def node_delete_metadata(node, label):
     """Delete a metadata from a node.
 
@@ -676,23 +965,55 @@ def headnode_detach_network(headnode, hnic):
 # Network Code #
 ################
 
-@rest_call('GET', '/networks', Schema({}))
-def list_networks():
-    """Lists all networks"""
+def _network_projects(network):
+    """Return the labels of the projects which can access `network`.
 
-    get_auth_backend().require_admin()
+    Returns None if `network` is public.
+    """
+    if not network.access:
+        return None
+    return sorted([p.label for p in network.access])
 
-    networks = db.session.query(model.Network).all()
-    result = {}
-    for n in networks:
-        if n.access:
-            net = {'network_id': n.network_id,
-                   'projects': sorted([p.label for p in n.access])}
-        else:
-            net = {'network_id': n.network_id, 'projects': None}
-        result[n.label] = net
 
-    return json.dumps(result, sort_keys=True)
+_NETWORK_FIELDS = {
+    'name': lambda network: network.label,
+    'network_id': lambda network: network.network_id,
+    'owner': lambda network:
+        None if network.owner is None else network.owner.label,
+    'projects': _network_projects,
+}
+
+
+@rest_call('GET', '/networks', _list_schema({Optional('project'): basestring}))
+@cached(model.Network, model.Project, model.network_projects)
+def list_networks(project=None, limit=None, cursor=None, fields=None):
+    """Lists all networks, or those `project` has access to.
+
+    Returns a JSON object mapping the networks' names to their ids and the
+    projects with access to them, or, if `fields` is given, an array of
+    objects with those fields.
+    """
+
+    get_auth_backend().require_admin()
+    fields = _select_fields(fields, _NETWORK_FIELDS)
+
+    query = model.Network.query.options(db.subqueryload('access'))
+    if project is not None:
+        project = _must_find(model.Project, project)
+        query = query.filter(model.Network.access.contains(project))
+    if fields is not None and 'owner' in fields:
+        query = query.options(db.joinedload('owner'))
+    networks, next_cursor = _paginate(query, model.Network.label,
+                                      limit, cursor)
+
+    if fields is not None:
+        body = _field_dicts(networks, fields, _NETWORK_FIELDS)
+    else:
+        body = {}
+        for n in networks:
+            body[n.label] = {'network_id': n.network_id,
+                             'projects': _network_projects(n)}
+    return _page_response(body, next_cursor)
 
 
 @rest_call('GET', '/network/<network>/attachments', schema=Schema({
@@ -731,18 +1052,29 @@ def list_network_attachments(network, project=None):
                 raise AuthorizationError(
                     "You do not have access to this project.")
 
-    attachments = network.attachments
-    nodes = {}
-    for attachment in attachments:
-        if project is None or project is attachment.nic.owner.project:
-            node = {
-                'nic': attachment.nic.label,
-                'channel': attachment.channel,
-                'project': attachment.nic.owner.project.label
+    query = db.session.query(model.Node.label,
+                             model.Nic.label,
+                             model.NetworkAttachment.channel,
+                             model.Project.label) \
+        .join(model.Nic, model.Node.nics) \
+        .join(model.NetworkAttachment, model.Nic.attachments) \
+        .outerjoin(model.Project, model.Node.project) \
+        .filter(model.NetworkAttachment.network == network)
+    if project is not None:
+        query = query.filter(model.Node.project == project)
+    query = query.order_by(model.Node.label, model.Nic.label) \
+        .yield_per(_YIELD_PER)
+
+    def pairs():
+        # A node may be attached by more than one nic; the last one wins.
+        for node, rows in itertools.groupby(query, lambda row: row[0]):
+            _, nic, channel, project_label = list(rows)[-1]
+            yield node, {
+                'nic': nic,
+                'channel': channel,
+                'project': project_label,
             }
-            nodes[attachment.nic.owner.label] = node
-
-    return json.dumps(nodes, sort_keys=True)
+    return json_object(pairs())
 
 
 @rest_call('PUT', '/network/<network>', Schema({
@@ -750,7 +1082,7 @@ def list_network_attachments(network, project=None):
     'owner': basestring,
     'access': basestring,
     'net_id': basestring,
-}))
+}), batch=True)
 def network_create(network, owner, access, net_id):
     """Create a network.
 
@@ -811,7 +1143,8 @@ def network_create(network, owner, access, net_id):
     db.session.commit()
 
 
-@rest_call('DELETE', '/network/<network>', Schema({'network': basestring}))
+@rest_call('DELETE', '/network/<network>', Schema({'network': basestring}),
+           batch=True)
 def network_delete(network):
     """Delete network.
 
@@ -829,11 +1162,11 @@ def network_delete(network):
     else:
         auth_backend.require_project_access(network.owner)
 
-    if len(network.attachments) != 0:
+    if _any(model.NetworkAttachment.query.filter_by(network=network)):
         raise BlockedError("Network still connected to nodes")
-    if network.hnics:
+    if _any(model.Hnic.query.filter_by(network=network)):
         raise BlockedError("Network still connected to headnodes")
-    if len(network.scheduled_nics) != 0:
+    if _any(model.NetworkingAction.query.filter_by(new_network=network)):
         raise BlockedError("There are pending actions on this network")
     if network.allocated:
         get_network_allocator().free_network_id(network.network_id)
@@ -843,6 +1176,7 @@ def network_delete(network):
 
 
 @rest_call('GET', '/network/<network>', Schema({'network': basestring}))
+@cached(model.Network, model.Project, model.network_projects)
 def show_network(network):
     """Show details of a network.
 
@@ -883,7 +1217,7 @@ def show_network(network):
     'switch': basestring,
     'type': basestring,
     Optional(object): object,
-}))
+}), batch=True)
 def switch_register(switch, type, **kwargs):
     get_auth_backend().require_admin()
     _assert_absent(model.Switch, switch)
@@ -900,12 +1234,13 @@ def switch_register(switch, type, **kwargs):
     db.session.commit()
 
 
-@rest_call('DELETE', '/switch/<switch>', Schema({'switch': basestring}))
+@rest_call('DELETE', '/switch/<switch>', Schema({'switch': basestring}),
+           batch=True)
 def switch_delete(switch):
     get_auth_backend().require_admin()
     switch = _must_find(model.Switch, switch)
 
-    if switch.ports != []:
+    if _any(model.Port.query.filter_by(owner=switch)):
         raise BlockedError("Switch %r has ports; delete them first." %
                            switch.label)
 
@@ -915,7 +1250,7 @@ def switch_delete(switch):
 
 @rest_call('PUT', '/switch/<switch>/port/<path:port>', Schema({
     'switch': basestring, 'port': basestring,
-}))
+}), batch=True)
 def switch_register_port(switch, port):
     """Register a port on a switch.
 
@@ -932,7 +1267,7 @@ def switch_register_port(switch, port):
 
 @rest_call('DELETE', '/switch/<switch>/port/<path:port>', Schema({
     'switch': basestring, 'port': basestring,
-}))
+}), batch=True)
 def switch_delete_port(switch, port):
     """Delete a port on a switch.
 
@@ -979,7 +1314,10 @@ def show_port(switch, port):
     """
     get_auth_backend().require_admin()
     switch = _must_find(model.Switch, switch)
-    port = _must_find_n(switch, model.Port, port)
+    port = _must_find_n(switch, model.Port, port,
+                        db.joinedload('nic').joinedload('owner'),
+                        db.joinedload('nic').subqueryload('attachments')
+                        .joinedload('network'))
     nic = port.nic
     return_obj = {}
     if nic:
@@ -991,18 +1329,31 @@ def show_port(switch, port):
     return json.dumps(return_obj)
 
 
-@rest_call('GET', '/switches', Schema({}))
-def list_switches():
+_SWITCH_FIELDS = {
+    'name': lambda switch: switch.label,
+    'type': lambda switch: switch.type,
+}
+
+
+@rest_call('GET', '/switches', _list_schema({}))
+@cached(model.Switch)
+def list_switches(limit=None, cursor=None, fields=None):
     """List all switches.
 
-    Returns a JSON array of strings representing a list of switches.
+    Returns a JSON array of strings representing a list of switches, or,
+    if `fields` is given, of objects with those fields.
 
     Example:  '["cisco3", "brocade1", "mock2"]'
     """
     get_auth_backend().require_admin()
-    switches = model.Switch.query.all()
-    snames = sorted([s.label for s in switches])
-    return json.dumps(snames)
+    fields = _select_fields(fields, _SWITCH_FIELDS)
+    switches, next_cursor = _paginate(model.Switch.query, model.Switch.label,
+                                      limit, cursor)
+    if fields is None:
+        body = [s.label for s in switches]
+    else:
+        body = _field_dicts(switches, fields, _SWITCH_FIELDS)
+    return _page_response(body, next_cursor)
 
 
 @rest_call('POST', '/switch/<switch>/port/<path:port>/connect_nic', Schema({
@@ -1010,7 +1361,7 @@ def list_switches():
     'port': basestring,
     'node': basestring,
     'nic': basestring,
-}))
+}), batch=True)
 def port_connect_nic(switch, port, node, nic):
     """Connect a port on a switch to a nic on a node.
 
@@ -1039,7 +1390,7 @@ def port_connect_nic(switch, port, node, nic):
 
 @rest_call('POST', '/switch/<switch>/port/<path:port>/detach_nic', Schema({
     'switch': basestring, 'port': basestring,
-}))
+}), batch=True)
 def port_detach_nic(switch, port):
     """Detach a port from the nic it's attached to
 
@@ -1065,7 +1416,7 @@ def port_detach_nic(switch, port):
 
 @rest_call('POST', '/switch/<switch>/port/<path:port>/revert', Schema({
     'switch': basestring, 'port': basestring,
-}))
+}), batch=True)
 def port_revert(switch, port):
     get_auth_backend().require_admin()
     switch = _must_find(model.Switch, switch)
@@ -1083,41 +1434,119 @@ def port_revert(switch, port):
     db.session.commit()
 
 
-@rest_call('GET', '/nodes/<is_free>', Schema({'is_free': basestring}))
-def list_nodes(is_free):
-    """List all nodes or all free nodes
+_NODE_FIELDS = {
+    'name': lambda node: node.label,
+    'project': lambda node:
+        None if node.project is None else node.project.label,
+    'metadata': lambda node: {m.label: m.value for m in node.metadata},
+}
+
+
+@rest_call('GET', '/nodes/<is_free>', _list_schema({
+    'is_free': basestring,
+    Optional('project'): basestring,
+    Optional('switch'): basestring,
+    Optional('metadata'): basestring,
+}))
+@cached(model.Node, model.Project, model.Nic, model.Port, model.Switch,
+        model.Metadata)
+def list_nodes(is_free, project=None, switch=None, metadata=None,
+               limit=None, cursor=None, fields=None):
+    """List all nodes, all free nodes or all allocated nodes
+
+    `is_free` is "free" for free nodes only, "allocated" for nodes in a
+    project only, or anything else (normally "all") for both. The nodes
+    may be further filtered by `project`, `switch` and `metadata`; see
+    `_list_nodes`.
 
-    Returns a JSON array of strings representing a list of nodes.
+    Returns a JSON array of strings representing a list of nodes, or, if
+    `fields` is given, of objects with those fields.
 
     Example:  '["node1", "node2", "node3"]'
     """
+    auth_backend = get_auth_backend()
+    fields = _select_fields(fields, _NODE_FIELDS)
+
+    query = model.Node.query
     if is_free == "free":
-        nodes = model.Node.query.filter_by(project_id=None).all()
-    else:
-        nodes = model.Node.query.all()
+        query = query.filter_by(project_id=None)
+    elif is_free == "allocated":
+        query = query.filter(model.Node.project_id.isnot(None))
 
-    nodes = sorted([n.label for n in nodes])
-    return json.dumps(nodes)
+    if project is not None:
+        project = _must_find(model.Project, project)
+        auth_backend.require_project_access(project)
+        query = query.filter_by(project=project)
+    elif is_free != "free" and set(fields or ()) - {'name'}:
+        # Like show_node, the nodes' details are only available to those
+        # with access to their projects:
+        auth_backend.require_admin()
+
+    return _list_nodes(query, switch, metadata, limit, cursor, fields)
 
 
-@rest_call('GET', '/project/<project>/nodes', Schema({'project': basestring}))
-def list_project_nodes(project):
+@rest_call('GET', '/project/<project>/nodes', _list_schema({
+    'project': basestring,
+    Optional('switch'): basestring,
+    Optional('metadata'): basestring,
+}))
+@cached(model.Project, model.Node, model.Nic, model.Port, model.Switch,
+        model.Metadata)
+def list_project_nodes(project, switch=None, metadata=None,
+                       limit=None, cursor=None, fields=None):
     """List all nodes belonging the given project.
 
-    Returns a JSON array of strings representing a list of nodes.
+    The nodes may be filtered by `switch` and `metadata`; see `_list_nodes`.
+
+    Returns a JSON array of strings representing a list of nodes, or, if
+    `fields` is given, of objects with those fields.
 
     Example:  '["node1", "node2", "node3"]'
     """
     project = _must_find(model.Project, project)
     get_auth_backend().require_project_access(project)
-    nodes = project.nodes
-    nodes = [n.label for n in nodes]
-    return json.dumps(nodes)
+    fields = _select_fields(fields, _NODE_FIELDS)
+    query = model.Node.query.filter_by(project=project)
+    return _list_nodes(query, switch, metadata, limit, cursor, fields)
+
+
+def _list_nodes(query, switch, metadata, limit, cursor, fields):
+    """Return one page of the nodes selected by `query`, for a list call.
+
+    If `switch` is not None, only nodes with a nic connected to a port on
+    that switch are included; this requires administrative access. If
+    `metadata` is not None, only nodes with a metadata key of that name are
+    included.
+
+    `limit`, `cursor` and `fields` are as for `_paginate` and
+    `_select_fields`, except that `fields` has already been parsed.
+    """
+    if switch is not None:
+        get_auth_backend().require_admin()
+        switch = _must_find(model.Switch, switch)
+        query = query.filter(model.Node.nics.any(
+            model.Nic.port.has(model.Port.owner == switch)))
+    if metadata is not None:
+        query = query.filter(model.Node.metadata.any(label=metadata))
+
+    if fields is not None:
+        if 'project' in fields:
+            query = query.options(db.joinedload('project'))
+        if 'metadata' in fields:
+            query = query.options(db.subqueryload('metadata'))
+    nodes, next_cursor = _paginate(query, model.Node.label, limit, cursor)
+
+    if fields is None:
+        body = [n.label for n in nodes]
+    else:
+        body = _field_dicts(nodes, fields, _NODE_FIELDS)
+    return _page_response(body, next_cursor)
 
 
 @rest_call('GET', '/project/<project>/networks', Schema({
     'project': basestring,
 }))
+@cached(model.Project, model.Network, model.network_projects)
 def list_project_networks(project):
     """List all private networks the project can access.
 
@@ -1133,38 +1562,85 @@ def list_project_networks(project):
 
 
 @rest_call('GET', '/node/<nodename>', Schema({'nodename': basestring}))
+@cached(model.Node, model.Project, model.Nic, model.Port, model.Switch,
+        model.NetworkAttachment, model.Network, model.Metadata)
 def show_node(nodename):
     """Show the details of a node.
 
     Returns a JSON object representing a node.
     """
 
-    node = _must_find(model.Node, nodename)
+    node = _must_find(model.Node, nodename, *_node_details_options())
     if node.project is not None:
         get_auth_backend().require_project_access(node.project)
 
-    # build list of nics
-    nic = [{'label': n.label,
-            'macaddr': n.mac_addr,
-            'port': None if n.port is None else n.port.label,
-            'switch': None if n.port is None else n.port.owner.label,
-            'networks': dict([(attachment.channel,
-                               attachment.network.label)
-                             for attachment in n.attachments]),
-            } for n in node.nics]
-
-    # remove port and switch info if the user is not an admin
-    if not get_auth_backend().have_admin():
-        for nics in nic:
-            del nics['port']
-            del nics['switch']
+    return json.dumps(_node_dict(node, get_auth_backend().have_admin()),
+                      sort_keys=True)
 
-    return json.dumps({
-        'name': node.label,
-        'project': None if node.project_id is None else node.project.label,
-        'nics': nic,
-        'metadata': {m.label: m.value for m in node.metadata}
-    }, sort_keys=True)
+
+@rest_call('GET', '/nodes/<is_free>/details', Schema({
+    'is_free': basestring,
+    Optional('project'): basestring,
+    Optional('nodes'): basestring,
+    Optional('limit'): And(Use(int), lambda n: n > 0),
+    Optional('cursor'): basestring,
+}))
+def show_nodes(is_free, project=None, nodes=None, limit=None, cursor=None):
+    """Show the details of many nodes at once.
+
+    The nodes are selected by `is_free` and `project` as for `list_nodes`,
+    and, if `nodes` (a comma-separated list of node names) is given, are
+    limited to those nodes. `limit` and `cursor` are as for `_paginate`.
+
+    Returns a JSON array of objects, one per node, in the format returned
+    by `show_node`. The details are read with a few queries per
+    `_NODE_DETAILS_CHUNK_SIZE` nodes, regardless of how many nics etc. the
+    nodes have, and the response is streamed as they are read.
+    """
+    auth_backend = get_auth_backend()
+    query = model.Node.query
+    if is_free == "free":
+        query = query.filter_by(project_id=None)
+    elif is_free == "allocated":
+        query = query.filter(model.Node.project_id.isnot(None))
+
+    if project is not None:
+        project = _must_find(model.Project, project)
+        auth_backend.require_project_access(project)
+        query = query.filter_by(project=project)
+    if nodes is not None:
+        labels = set(nodes.split(','))
+        query = query.filter(model.Node.label.in_(labels))
+        found = set(label for (label,) in
+                    db.session.query(model.Node.label)
+                    .filter(model.Node.label.in_(labels)))
+        missing = sorted(labels - found)
+        if missing:
+            raise NotFoundError("Node %s does not exist." % missing[0])
+        for node_project in model.Project.query.join(model.Project.nodes) \
+                .filter(model.Node.label.in_(labels)).distinct():
+            auth_backend.require_project_access(node_project)
+    elif project is None and is_free != "free":
+        auth_backend.require_admin()
+
+    if cursor is not None:
+        query = query.filter(model.Node.label > _decode_cursor(cursor))
+    headers = {}
+    if limit is not None:
+        # Find the last node on this page, and whether there are more:
+        last = [label for (label,) in
+                query.with_entities(model.Node.label)
+                .order_by(model.Node.label)
+                .offset(limit - 1).limit(2)]
+        if len(last) == 2:
+            query = query.filter(model.Node.label <= last[0])
+            headers['X-Next-Cursor'] = _encode_cursor(last[0])
+
+    admin = auth_backend.have_admin()
+    response = json_array(_node_dict(node, admin)
+                          for node in _node_details(query))
+    response.headers.extend(headers)
+    return response
 
 
 @rest_call('GET', '/project/<project>/headnodes', Schema({
@@ -1233,15 +1709,32 @@ def list_headnode_images():
 
 # Console code #
 ################
-@rest_call('GET', '/node/<nodename>/console', Schema({'nodename': basestring}))
-def show_console(nodename):
-    """Show the contents of the console log."""
+@rest_call('GET', '/node/<nodename>/console', Schema({
+    'nodename': basestring,
+    Optional('offset'): And(Use(int), lambda n: n >= 0),
+    Optional('tail'): And(Use(int), lambda n: n >= 0),
+}))
+def show_console(nodename, offset=None, tail=None):
+    """Show the contents of the console log.
+
+    If `offset` is supplied, only the output from that byte offset on is
+    shown; if `tail` is supplied, only the last `tail` bytes. The log is
+    streamed, and the ``X-Console-Offset`` header holds the offset at which
+    to continue reading later.
+    """
+    if offset is not None and tail is not None:
+        raise BadArgumentError('At most one of offset and tail may be '
+                               'supplied.')
     node = _must_find(model.Node, nodename)
-    log = node.obm.get_console()
+    log = node.obm.get_console_range(offset, tail)
     if log is None:
         raise NotFoundError('The console log for %s '
                             'does not exist.' % nodename)
-    return log
+    chunks, start, end = log
+    return flask.Response(chunks, headers={
+        'X-Console-Start': str(start),
+        'X-Console-Offset': str(end),
+    })
 
 
 @rest_call('PUT', '/node/<nodename>/console', Schema({'nodename': basestring}))
@@ -1261,8 +1754,65 @@ def stop_console(nodename):
     node.obm.delete_console()
 
 
+# Batch code #
+##############
+@rest_call('POST', '/batch', Schema({
+    'operations': [{
+        'method': basestring,
+        'path': basestring,
+        Optional('body'): dict,
+    }],
+}), dont_log=('operations',))
+def batch(operations):
+    """Run several API calls in a single database transaction.
+
+    The operations are logged individually; see `hil.rest.run_batch` for
+    details.
+    """
+    return run_batch(operations)
+
+
 # Helper functions #
 ####################
+def _new_node_obm(node, taken):
+    """Validate `node`, an item of `node_register_many`'s `nodes`.
+
+    `taken` is the set of names which are already in use. Returns the
+    node's obm (an instance of the right subclass of `model.Obm`), or
+    raises an APIError describing what is wrong with `node`.
+    """
+    if node['name'] in taken:
+        raise DuplicateError("Node %s already exists." % node['name'])
+    obm_type = node['obm']['type']
+    cls = concrete_class_for(model.Obm, obm_type)
+    if cls is None:
+        raise BadArgumentError('%r is not a valid OBM type.' % obm_type)
+    try:
+        cls.validate(node['obm'])
+    except SchemaError:
+        raise BadArgumentError('Invalid arguments for an OBM of type %r.'
+                               % obm_type)
+    nics = set()
+    for nic in node.get('nics', []):
+        if nic['label'] in nics:
+            raise DuplicateError("Nic %s on Node %s already exists" %
+                                 (nic['label'], node['name']))
+        nics.add(nic['label'])
+    return cls(**node['obm'])
+
+
+def _bulk_insert(cls, rows):
+    """Insert `rows` (dicts of column values) into `cls`'s table.
+
+    The rows are inserted with a single statement. Unlike a flush, this
+    isn't noticed by the hooks which bump the table's generation (see
+    `model.Generation`) on commit, so we tell them here.
+    """
+    if rows:
+        db.session.bulk_insert_mappings(cls, rows)
+        model.bump_generations(db.session, [cls.__table__.name])
+
+
 def _assert_absent(cls, name):
     """Raises a DuplicateError if the given object is already in the database.
 
@@ -1280,7 +1830,7 @@ def _assert_absent(cls, name):
         raise DuplicateError("%s %s already exists." % (cls.__name__, name))
 
 
-def _must_find(cls, name):
+def _must_find(cls, name, *options):
     """Raises a NotFoundError if the given object doesn't exist in the datbase.
     Otherwise returns the object
 
@@ -1290,18 +1840,217 @@ def _must_find(cls, name):
 
     cls - the class of the object to query.
     name - the name of the object in question.
+    options - loader options (e.g. ``db.joinedload(...)``) for the query,
+        for callers which will walk the object's relationships.
 
     Must be called within a request context.
     """
-    obj = db.session.query(cls).filter_by(label=name).first()
+    obj = db.session.query(cls).options(*options) \
+        .filter_by(label=name).first()
     if not obj:
         raise NotFoundError("%s %s does not exist." % (cls.__name__, name))
     return obj
 
 
-def _namespaced_query(obj_outer, cls_inner, name_inner):
-    """Helper function to search for subobjects of an object."""
+def _any(query):
+    """Return whether `query` has any results, without loading them.
+
+    This is a single ``EXISTS`` query, however many results there are; use
+    it rather than checking a relationship's collection for emptiness.
+    """
+    return db.session.query(query.exists()).scalar()
+
+
+def _paginate(query, column, limit=None, cursor=None):
+    """Return one page of the results of `query`, for a list call.
+
+    The results are ordered by `column`, which must be unique (normally
+    the ``label`` column of the queried class). If `limit` is not None, at
+    most `limit` results are returned. `cursor`, if not None, is one
+    returned by an earlier call, and selects the results which follow the
+    page it was returned with.
+
+    The ordering and selection are done by the database, so the cost of a
+    call depends on `limit`, not on the total number of results.
+
+    Returns a tuple ``(results, next_cursor)``, where `next_cursor` is
+    None if this is the last page.
+    """
+    query = query.order_by(column)
+    if cursor is not None:
+        query = query.filter(column > _decode_cursor(cursor))
+    if limit is None:
+        return query.all(), None
+    # Fetch one extra result, to tell whether there is another page:
+    results = query.limit(limit + 1).all()
+    if len(results) <= limit:
+        return results, None
+    results = results[:limit]
+    return results, _encode_cursor(getattr(results[-1], column.key))
+
+
+def _encode_cursor(key):
+    """Return an opaque cursor for the results following `key`."""
+    return base64.urlsafe_b64encode(json.dumps(key))
+
+
+def _decode_cursor(cursor):
+    """Return the key encoded in `cursor` by `_encode_cursor`.
+
+    Raises BadArgumentError if `cursor` is not a valid cursor.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise BadArgumentError("Invalid cursor: %r" % cursor)
+    if not isinstance(key, basestring):
+        raise BadArgumentError("Invalid cursor: %r" % cursor)
+    return key
+
+
+def _select_fields(fields, available):
+    """Parse the `fields` argument to a list call.
+
+    `fields` is a comma-separated list of field names, or None, and
+    `available` is a dictionary mapping the names of the fields which the
+    call supports to functions computing them.
+
+    Returns a list of field names, or None if `fields` is None. Raises
+    BadArgumentError if any of the fields are not supported.
+    """
+    if fields is None:
+        return None
+    fields = fields.split(',')
+    for field in fields:
+        if field not in available:
+            raise BadArgumentError("Unknown field %r; valid fields are: %s"
+                                   % (field, ', '.join(sorted(available))))
+    return fields
+
+
+def _field_dicts(objects, fields, available):
+    """Return a list of dictionaries holding the `fields` of `objects`.
+
+    `fields` and `available` are as for `_select_fields`.
+    """
+    return [dict((field, available[field](obj)) for field in fields)
+            for obj in objects]
+
+
+def _page_response(body, next_cursor):
+    """Return the response for a page of a list call.
+
+    `body` is the (JSON-serializable) page. If `next_cursor` is not None,
+    it is returned in the ``X-Next-Cursor`` header.
+    """
+    body = json.dumps(body, sort_keys=True)
+    if next_cursor is None:
+        return body
+    return body, 200, {'X-Next-Cursor': next_cursor}
+
+
+def _node_dict(node, admin):
+    """Return the representation of `node` used by `show_node`.
+
+    The nics' ports and switches are only included if `admin` is true.
+    """
+    nics = []
+    for nic in node.nics:
+        nic_dict = {
+            'label': nic.label,
+            'macaddr': nic.mac_addr,
+            'networks': dict([(attachment.channel, attachment.network.label)
+                              for attachment in nic.attachments]),
+        }
+        if admin:
+            nic_dict['port'] = None if nic.port is None else nic.port.label
+            nic_dict['switch'] = \
+                None if nic.port is None else nic.port.owner.label
+        nics.append(nic_dict)
+    return {
+        'name': node.label,
+        'project': None if node.project_id is None else node.project.label,
+        'nics': nics,
+        'metadata': {m.label: m.value for m in node.metadata},
+    }
+
+
+# The number of nodes whose details `_node_details` reads at a time:
+_NODE_DETAILS_CHUNK_SIZE = 500
+
+
+def _joinedload_obm():
+    """Return a loader option loading nodes' obms, driver columns and all."""
+    return db.joinedload(
+        model.Node.obm.of_type(model.polymorphic(model.Obm)))
+
+
+def _node_details_options():
+    """Return loader options for everything `_node_dict` needs.
+
+    With these, a query loads the details of any number of nodes with one
+    query per relationship, rather than one per node, nic and attachment.
+    """
+    return (
+        db.joinedload('project'),
+        db.subqueryload('nics').joinedload('port').joinedload('owner'),
+        db.subqueryload('nics').subqueryload('attachments')
+        .joinedload('network'),
+        db.subqueryload('metadata'),
+    )
+
+
+def _node_details(query):
+    """Generate the nodes selected by `query`, with their details loaded.
+
+    The nodes are generated in order of their labels. Everything
+    `_node_dict` needs is loaded up front (see `_node_details_options`), a
+    chunk of nodes at a time.
+    """
+    query = query.options(*_node_details_options())
+    cursor = None
+    while True:
+        nodes, cursor = _paginate(query, model.Node.label,
+                                  _NODE_DETAILS_CHUNK_SIZE, cursor)
+        for node in nodes:
+            yield node
+        if cursor is None:
+            return
+
+
+def _obm_job_dict(job):
+    """Return the representation of `job` used by the API."""
+    return {
+        'id': job.id,
+        'node': job.node.label,
+        'type': job.type,
+        'bootdev': job.bootdev,
+        'status': job.status,
+        'error': job.error,
+    }
+
+
+def _power_state_dict(power_state):
+    """Return the representation of `power_state` used by the API.
+
+    `power_state` may be None, for a node whose state hasn't been read.
+    """
+    if power_state is None:
+        return {'state': None, 'updated': None, 'error': None}
+    return {
+        'state': power_state.state,
+        'updated': power_state.updated.isoformat(),
+        'error': power_state.error,
+    }
+
+
+def _namespaced_query(obj_outer, cls_inner, name_inner, *options):
+    """Helper function to search for subobjects of an object.
+
+    `options` are loader options for the query, as for `_must_find`.
+    """
     return db.session.query(cls_inner) \
+        .options(*options) \
         .filter_by(owner=obj_outer) \
         .filter_by(label=name_inner).first()
 
@@ -1327,7 +2076,7 @@ def _assert_absent_n(obj_outer, cls_inner, name_inner):
                               obj_outer.__class__.__name__, obj_outer.label))
 
 
-def _must_find_n(obj_outer, cls_inner, name_inner):
+def _must_find_n(obj_outer, cls_inner, name_inner, *options):
     """Searches the database for a "namespaced" object, such as a nic on a node.
 
     Raises NotFoundError if there is none.  Otherwise returns the object.
@@ -1337,10 +2086,11 @@ def _must_find_n(obj_outer, cls_inner, name_inner):
     obj_outer - the "owner" object
     cls_inner - the "owned" class
     name_inner - the name of the "owned" object
+    options - loader options for the query, as for `_must_find`.
 
     Must be called within a request context.
     """
-    obj_inner = _namespaced_query(obj_outer, cls_inner, name_inner)
+    obj_inner = _namespaced_query(obj_outer, cls_inner, name_inner, *options)
     if obj_inner is None:
         raise NotFoundError("%s %s on %s %s does not exist." %
                             (cls_inner.__name__, name_inner,
@@ -4,11 +4,36 @@ from hil.errors import AuthorizationError
 from hil import model
 from abc import ABCMeta, abstractmethod
 
+import flask
 import sys
 
 _auth_backend = None
 
 
+class AuthContext(object):
+    """What a request is authorized to do, as computed by its auth backend.
+
+    Attributes:
+
+    `admin`
+        Whether the request is authorized to act as an administrator.
+    `project_ids`
+        A frozenset of the ids of the projects the request may act as, or
+        None if the backend checks project access some other way (see
+        ``AuthBackend._have_project_access``).
+
+    The context is built once per request (see ``AuthBackend.context``), so
+    that the ``have_*`` and ``require_*`` checks don't need to query the
+    database each time.
+    """
+
+    def __init__(self, admin, project_ids=None):
+        self.admin = admin
+        self.project_ids = project_ids
+        # The value of ``hil.rest.local.auth`` this was built from:
+        self.auth = None
+
+
 class AuthBackend(object):
     """An authentication/authorization backend.
 
@@ -17,9 +42,10 @@ class AuthBackend(object):
     of the subclass
 
     Subclasses of AuthBackend must override `authenticate`, `_have_admin`,
-    and `_have_project_access`, and nothing else. Users of the AuthBackend must
-    not invoke `_have_admin` and `_have_project_access`, preferring
-    `have_admin` and `have_project_access`.
+    and `_have_project_access`, and may override `_make_context` and
+    `scope`, but nothing else. Users of the AuthBackend must not invoke
+    `_have_admin`, `_have_project_access` and `_make_context`, preferring
+    `have_admin`, `have_project_access` and `context`.
     """
 
     __metaclass__ = ABCMeta
@@ -59,13 +85,61 @@ class AuthBackend(object):
         the `have_*` and `require_*` wrappers handle this.
         """
 
+    def scope(self):
+        """Return a value identifying what the request is authorized to do.
+
+        The value must be hashable, and two requests with equal scopes must
+        be authorized to do exactly the same things. It is used as part of
+        the key for cached API responses (see ``hil.cache``), so that a
+        response is only ever reused for a request which would have been
+        allowed to see it.
+
+        This will be called sometime after ``authenticate()``. The default
+        returns None, which disables response caching for the request.
+        """
+        return None
+
+    def _make_context(self):
+        """Return an ``AuthContext`` for the request.
+
+        This will be called sometime after ``authenticate()``, at most once
+        per request (see `context`). The default asks `_have_admin`, and
+        leaves project access to `_have_project_access`; backends which can
+        cheaply find all of the projects a request may act as should
+        override this to list them.
+        """
+        return AuthContext(admin=self._have_admin())
+
+    def context(self):
+        """Return the request's ``AuthContext``.
+
+        The context is built by `_make_context` the first time this is
+        called, and kept for the rest of the request; it is rebuilt if the
+        backend changes ``hil.rest.local.auth``, or calls `reset_context`.
+        """
+        auth = getattr(flask.g, 'auth', None)
+        context = getattr(flask.g, 'auth_context', None)
+        if context is None or context.auth is not auth:
+            context = self._make_context()
+            context.auth = auth
+            flask.g.auth_context = context
+        return context
+
+    def reset_context(self):
+        """Discard the request's ``AuthContext``, if it has been built.
+
+        Backends must call this if what the request is authorized to do
+        changes, other than by replacing ``hil.rest.local.auth``.
+        """
+        flask.g.auth_context = None
+
     def have_admin(self):
         """Check if the request is authorized to act as an administrator.
 
         Return True if so, False if not. This will be caled sometime after
         ``authenticate()``.
         """
-        return self._have_admin()
+        return self.context().admin
 
     def have_project_access(self, project):
         """Check if the request is authorized to act as the given project.
@@ -81,7 +155,12 @@ class AuthBackend(object):
 
         assert isinstance(project, model.Project)
 
-        return self._have_admin() or self._have_project_access(project)
+        context = self.context()
+        if context.admin:
+            return True
+        if context.project_ids is not None:
+            return project.id in context.project_ids
+        return self._have_project_access(project)
 
     def require_admin(self):
         """Ensure the request is authorized to act as an administrator.
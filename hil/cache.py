@@ -0,0 +1,218 @@
+# Copyright 2017 Massachusetts Open Cloud Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the
+# License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS
+# IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.  See the License for the specific language
+# governing permissions and limitations under the License.
+"""A cache for the responses of read-only API calls.
+
+API calls decorated with `cached` keep their responses in an in-memory
+cache, keyed by the call, its arguments and the caller's authorization
+scope (see ``AuthBackend.scope``). Each entry records the generations (see
+``hil.model.Generation``) of the tables the call reads, and is only reused
+while those are unchanged, so reusing one costs a single small query.
+
+Responses from cached calls also carry an ``ETag`` header, derived from the
+same information; a client which sends it back via ``If-None-Match`` gets
+an empty 304 response if nothing has changed. The ETags are weak, since the
+same response may be sent with different encodings (see
+``hil.rest._compress``).
+
+The cache is per-process. Its size is set by the ``max_entries`` option in
+the ``[response-cache]`` section of ``hil.cfg``.
+
+``LabelSet`` applies the same scheme to the set of labels of a model's
+objects, for code (e.g. auth backends) which checks for them often.
+"""
+
+from collections import OrderedDict
+from functools import wraps
+import hashlib
+import inspect
+import threading
+
+import flask
+import sqlalchemy
+
+from hil.auth import get_auth_backend
+from hil.config import cfg
+from hil.model import db, Generation
+
+DEFAULT_MAX_ENTRIES = 1024
+
+
+def max_entries():
+    """Return the maximum number of responses to cache.
+
+    This is the ``max_entries`` option in the ``[response-cache]`` section
+    of ``hil.cfg``. 0 disables the cache (but not ETags).
+    """
+    if cfg.has_option('response-cache', 'max_entries'):
+        return cfg.getint('response-cache', 'max_entries')
+    return DEFAULT_MAX_ENTRIES
+
+
+def generations(tables):
+    """Return the current generations of `tables` (a sorted list of names).
+
+    The result is a tuple, in the same order as `tables`. Tables which have
+    never changed have generation 0.
+    """
+    rows = dict(db.session.query(Generation.table_name,
+                                 Generation.generation)
+                .filter(Generation.table_name.in_(tables)))
+    return tuple(rows.get(name, 0) for name in tables)
+
+
+class ResponseCache(object):
+    """A size-bounded map from keys to ``(generations, body)`` pairs.
+
+    When full, the least recently used entry is evicted. Safe to use from
+    multiple threads.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, generations):
+        """Return the body cached under `key`, if it is for `generations`.
+
+        Returns None if there is no such body.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            # Re-insert the entry, to mark it as recently used:
+            self._entries[key] = entry
+        if entry[0] != generations:
+            return None
+        return entry[1]
+
+    def put(self, key, generations, body):
+        """Cache `body` under `key`, replacing any existing entry."""
+        limit = max_entries()
+        if limit <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (generations, body)
+            while len(self._entries) > limit:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+
+
+responses = ResponseCache()
+
+
+def _table_names(dependency):
+    """Return the names of the tables underlying `dependency`.
+
+    `dependency` may be a model class (all of whose tables are included, for
+    classes using inheritance) or a ``Table``.
+    """
+    if isinstance(dependency, sqlalchemy.Table):
+        return [dependency.name]
+    return [table.name for table in db.inspect(dependency).tables]
+
+
+class LabelSet(object):
+    """The set of labels of the objects of a model class, e.g. ``Project``.
+
+    The labels are kept in memory, and reloaded only when the class's
+    tables change, so that checking for one (with ``in``) usually costs a
+    single small query of their generations. Safe to use from multiple
+    threads.
+    """
+
+    def __init__(self, cls):
+        self._cls = cls
+        self._generations = None
+        self._labels = frozenset()
+        self._lock = threading.Lock()
+
+    def __contains__(self, label):
+        if db.session.info.get('changed_tables'):
+            # This transaction has changes of its own; see `cached`.
+            return self._cls.query.filter_by(label=label).count() != 0
+        gens = generations(sorted(_table_names(self._cls)))
+        with self._lock:
+            if gens == self._generations:
+                return label in self._labels
+        labels = frozenset(row.label
+                           for row in db.session.query(self._cls.label))
+        with self._lock:
+            self._generations = gens
+            self._labels = labels
+        return label in labels
+
+
+def cached(*dependencies):
+    """Decorator caching the responses of a read-only API call.
+
+    `dependencies` are the model classes and tables which the call reads;
+    the cached response is discarded when any of them change. The call
+    must return a string (or a tuple of a string, a status and headers, as
+    flask allows), and must depend on nothing but its arguments,
+    `dependencies` and the caller's authorization scope. Errors are not
+    cached.
+
+    This goes between ``rest_call`` and the function, e.g.::
+
+        @rest_call('GET', '/nodes/<is_free>', Schema({'is_free': basestring}))
+        @cached(model.Node)
+        def list_nodes(is_free):
+            ...
+    """
+    tables = sorted(set(name
+                        for dependency in dependencies
+                        for name in _table_names(dependency)))
+
+    def decorator(f):
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            scope = get_auth_backend().scope()
+            if scope is None or db.session.info.get('changed_tables'):
+                # Either the auth backend doesn't support caching, or this
+                # transaction has changes of its own, which may yet be
+                # rolled back. Either way, the response can't be shared.
+                return f(*args, **kwargs)
+
+            callargs = inspect.getcallargs(f, *args, **kwargs)
+            key = (f.__name__, tuple(sorted(callargs.items())), scope)
+            # We must read the generations before anything else; if a
+            # change is committed in between, the cached response will be
+            # newer than its generations claim, which is harmless. The
+            # other way around, it would be stale.
+            gens = generations(tables)
+            etag = hashlib.sha1(repr((key, gens))).hexdigest()
+
+            body = responses.get(key, gens)
+            if body is None:
+                body = f(*args, **kwargs)
+                responses.put(key, gens, body)
+
+            @flask.after_this_request
+            def set_etag(response):
+                response.set_etag(etag, weak=True)
+                return response
+
+            if flask.request.if_none_match.contains_weak(etag):
+                return flask.Response(status=304)
+            return body
+
+        return wrapper
+    return decorator
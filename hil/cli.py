@@ -12,8 +12,15 @@
 # express or implied.  See the License for the specific language
 # governing permissions and limitations under the License.
 
-"""This module implements the HIL command line tool."""
-from hil import config, server, migrations
+"""This module implements the HIL command line tool.
+
+Most commands are clients of the API, and need nothing but ``hil.client``.
+Importing the server side of HIL (flask, the model, extensions...) takes
+far longer than such a command takes to run, so this module avoids it:
+commands which run server-side code are declared with `server_cmd`, and
+import what they need themselves.
+"""
+from hil import config, startup
 from hil.config import cfg
 from hil.commands.util import ensure_not_root
 
@@ -21,20 +28,27 @@ import inspect
 import json
 import os
 import requests
+import shlex
 import sys
+import threading
 import urllib
 import schema
 import logging
 
 from functools import wraps
+from StringIO import StringIO
 
-from hil.client.client import Client, RequestsHTTPClient, KeystoneHTTPClient
+from hil.client.client import Client, KeystoneHTTPClient, \
+    TokenHTTPClient, fit_connection_pool
 from hil.client.base import FailedAPICallException
+from hil.client.node import read_nodes_csv, read_nodes_json
 
 
 logger = logging.getLogger(__name__)
 command_dict = {}
 usage_dict = {}
+# The names of the commands declared with `server_cmd`:
+server_commands = set()
 MIN_PORT_NUMBER = 1
 MAX_PORT_NUMBER = 2**16 - 1
 
@@ -81,11 +95,26 @@ def cmd(f):
                 sys.stderr.write(e.message + '\n\n')
             sys.stderr.write('Invalid arguements.  Usage:\n')
             help(f.__name__)
+            # Lets `batch` and `shell` tell that the command failed:
+            return False
 
     command_dict[f.__name__] = wrapped
     return wrapped
 
 
+def server_cmd(f):
+    """A decorator for CLI commands which run server-side code.
+
+    This is `cmd`, except that `main` loads the extensions listed in
+    ``hil.cfg`` before running the command; client commands skip that,
+    since it imports much of the server. The command must import any other
+    server-side modules it uses itself, rather than at the top of this
+    module.
+    """
+    server_commands.add(f.__name__)
+    return cmd(f)
+
+
 def setup_http_client():
     """Set `http_client` to a valid instance of `HTTPClient`
 
@@ -96,7 +125,8 @@ def setup_http_client():
 
     1. If the environment variables HIL_USERNAME and HIL_PASSWORD
        are defined, it will use HTTP basic auth, with the corresponding
-       user name and password.
+       user name and password (or bearer tokens obtained with them; see
+       `TokenHTTPClient`).
     2. If the `python-keystoneclient` library is installed, and the
        environment variables:
 
@@ -126,8 +156,8 @@ def setup_http_client():
     if basic_username is not None and basic_password is not None:
         # For calls with no client library support yet.
         # Includes all headnode calls; registration of nodes and switches.
-        http_client = RequestsHTTPClient()
-        http_client.auth = (basic_username, basic_password)
+        # Long-running commands switch to bearer tokens automatically:
+        http_client = TokenHTTPClient(ep, basic_username, basic_password)
         # For calls using the client library
         C = Client(ep, http_client)
         return
@@ -141,6 +171,8 @@ def setup_http_client():
         os_project_domain_id = os.getenv('OS_PROJECT_DOMAIN_ID') or 'default'
         if None in (os_auth_url, os_username, os_password, os_project_name):
             raise KeyError("Required openstack environment variable not set.")
+        from keystoneauth1.identity import v3
+        from keystoneauth1 import session
         auth = v3.Password(auth_url=os_auth_url,
                            username=os_username,
                            password=os_password,
@@ -211,7 +243,7 @@ def do_delete(url):
 # DELETE UPTIL HERE once all calls have client library support.
 
 
-@cmd
+@server_cmd
 def serve(port):
     try:
         port = schema.And(
@@ -231,23 +263,29 @@ def serve(port):
         debug = False
     # We need to import api here so that the functions within it get registered
     # (via `rest_call`), though we don't use it directly:
-    from hil import model, api, rest
+    from hil import model, api, rest, server, migrations
     server.init()
     migrations.check_db_schema()
-    server.stop_orphan_consoles()
-    rest.serve(port, debug=debug)
+    startup.report()
+    if cfg.has_section('server'):
+        # Production mode; see hil.prefork:
+        from hil import prefork
+        prefork.serve(port)
+    else:
+        rest.serve(port, debug=debug)
 
 
-@cmd
+@server_cmd
 def serve_networks():
     """Start the HIL networking server"""
-    from hil import model, deferred
+    from hil import model, deferred, server, migrations
     from time import sleep
     server.init()
     server.register_drivers()
     server.validate_state()
     model.init_db()
     migrations.check_db_schema()
+    startup.report()
 
     # Check if config contains usable sleep_time
     if (cfg.has_section('network-daemon') and
@@ -272,6 +310,148 @@ def serve_networks():
         sleep(sleep_time)
 
 
+@server_cmd
+def serve_obm():
+    """Start the HIL obm daemon, which executes queued obm jobs
+
+    It also keeps the nodes' cached power states up to date.
+    """
+    from hil import model, obm_jobs, server, migrations
+    from time import sleep
+    server.init()
+    server.register_drivers()
+    server.validate_state()
+    model.init_db()
+    migrations.check_db_schema()
+    startup.report()
+
+    options = {}
+    for option, default, bounds in [('sleep_time', 2, (0, 3600)),
+                                    ('max_workers', 16, (0, 1024)),
+                                    ('max_per_bmc', 1, (0, 1024))]:
+        if cfg.has_option('obm-daemon', option):
+            try:
+                value = cfg.getfloat('obm-daemon', option)
+            except ValueError:
+                sys.exit("Error: %s set to non-numeric value" % option)
+            if not bounds[0] < value < bounds[1]:
+                sys.exit("Error: %s not within bounds %d < %s < %d" %
+                         (option, bounds[0], option, bounds[1]))
+        else:
+            value = default
+        options[option] = value
+
+    runner = obm_jobs.JobRunner(max_workers=int(options['max_workers']),
+                                max_per_bmc=int(options['max_per_bmc']))
+    runner.recover()
+    # Refresh cached power states once they're halfway to expiring, so the
+    # API server doesn't have to:
+    max_age = model.PowerState.ttl() / 2
+    while True:
+        # Start jobs until we hit the concurrency limits or run out, and
+        # then power state refreshes with whatever capacity is left; then
+        # delay so we don't tight loop.
+        while runner.run_jobs():
+            pass
+        runner.refresh_power_states(max_age)
+        sleep(options['sleep_time'])
+
+
+@server_cmd
+def serve_consoles():
+    """Start the HIL console daemon, which logs nodes' consoles"""
+    from hil import model, consoles, server, migrations
+    server.init()
+    server.register_drivers()
+    server.validate_state()
+    model.init_db()
+    migrations.check_db_schema()
+    startup.report()
+
+    options = {}
+    for option, default, bounds in [('sleep_time', 2, (0, 3600)),
+                                    ('cleanup_workers', 8, (0, 1024))]:
+        if cfg.has_option('console', option):
+            try:
+                value = cfg.getfloat('console', option)
+            except ValueError:
+                sys.exit("Error: %s set to non-numeric value" % option)
+            if not bounds[0] < value < bounds[1]:
+                sys.exit("Error: %s not within bounds %d < %s < %d" %
+                         (option, bounds[0], option, bounds[1]))
+        else:
+            value = default
+        options[option] = value
+
+    consoles.serve(options['sleep_time'],
+                   cleanup_workers=int(options['cleanup_workers']))
+
+
+@cmd
+def project_power_cycle(project):
+    """Power cycle every node in <project>, asynchronously
+
+    Prints the ids of the queued jobs; see show_obm_job.
+    """
+    for job in C.node.queue_obm_jobs('power_cycle', project=project):
+        print job['id'], job['node']
+
+
+@cmd
+def project_set_bootdev(project, dev):
+    """Set every node in <project> to boot from <dev>, asynchronously
+
+    Prints the ids of the queued jobs; see show_obm_job.
+    """
+    for job in C.node.queue_obm_jobs('set_bootdev', project=project,
+                                     bootdev=dev):
+        print job['id'], job['node']
+
+
+@cmd
+def node_power_status(node):
+    """Show the power state of <node>"""
+    _print_power_status(C.node.power_status(node))
+
+
+@cmd
+def list_power_status():
+    """Show the power state of every node"""
+    for node, power_state in sorted(C.node.list_power_status().items()):
+        _print_power_status(power_state, node)
+
+
+@cmd
+def list_project_power_status(project):
+    """Show the power state of every node in <project>"""
+    power_states = C.node.list_power_status(project=project)
+    for node, power_state in sorted(power_states.items()):
+        _print_power_status(power_state, node)
+
+
+def _print_power_status(power_state, node=None):
+    if power_state['state'] is not None:
+        status = power_state['state']
+    elif power_state['error'] is not None:
+        status = 'unknown (%s)' % power_state['error']
+    else:
+        status = 'unknown'
+    if power_state['updated'] is not None:
+        status += ', as of %s UTC' % power_state['updated']
+    if node is not None:
+        status = '%s: %s' % (node, status)
+    print status
+
+
+@cmd
+def show_obm_job(job):
+    """Show the status of the obm job <job>"""
+    job = C.node.show_obm_job(job)
+    for key in 'node', 'type', 'bootdev', 'status', 'error':
+        if job[key] is not None:
+            print '%s: %s' % (key, job[key])
+
+
 @cmd
 def user_create(username, password, is_admin):
     """Create a user <username> with password <password>.
@@ -321,10 +501,18 @@ def user_delete(username):
 
 
 @cmd
-def list_projects():
-    """List all projects"""
-    q = C.project.list()
-    sys.stdout.write('%s Projects :    ' % len(q) + " ".join(q) + '\n')
+def list_projects(*options):
+    """List all projects
+
+    <options> are as for list_nodes, but only "fields" and "page_size" are
+    supported.
+    """
+    kwargs = _list_options(options)
+    q = C.project.list(**kwargs)
+    if 'fields' in kwargs:
+        _print_list(q)
+    else:
+        sys.stdout.write('%s Projects :    ' % len(q) + " ".join(q) + '\n')
 
 
 @cmd
@@ -435,6 +623,42 @@ def node_register(node, subtype, *args):
     do_put(url, data={"obm": obminfo})
 
 
+@cmd
+def node_register_many(source):
+    """Register the nodes listed in the file <source>, in one go
+
+    <source> is a CSV file if its name ends in ".csv", and a JSON file
+    otherwise; it may be "-" to read JSON from stdin. The formats are
+    described by read_nodes_csv and read_nodes_json in hil.client.node;
+    for example, a CSV file might read:
+
+        name,obm.type,obm.host,obm.user,obm.password,nic.eth0,nic.eth1
+        node-01,ipmi,10.0.0.1,admin,secret,00:11:22:33:44:01,...
+
+    The nodes are registered along with their nics and metadata. If any
+    of them are invalid, none are registered, and each problem is
+    reported.
+    """
+    f = sys.stdin if source == '-' else open(source)
+    try:
+        if source.endswith('.csv'):
+            nodes = read_nodes_csv(f)
+        else:
+            nodes = read_nodes_json(f)
+    except ValueError as e:
+        raise InvalidAPIArgumentsException('Error: %s: %s' % (source, e))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    try:
+        C.node.register_many(nodes)
+    except FailedAPICallException as e:
+        for node, msg in e.errors:
+            sys.stderr.write('%s: %s\n' % (node, msg))
+        raise
+    sys.stdout.write('Registered %d nodes\n' % len(nodes))
+
+
 @cmd
 def node_delete(node):
     """Delete <node>"""
@@ -605,10 +829,18 @@ def switch_delete(switch):
 
 
 @cmd
-def list_switches():
-    """List all switches"""
-    q = C.switch.list()
-    sys.stdout.write('%s switches :    ' % len(q) + " ".join(q) + '\n')
+def list_switches(*options):
+    """List all switches
+
+    <options> are as for list_nodes, but only "fields" and "page_size" are
+    supported.
+    """
+    kwargs = _list_options(options)
+    q = C.switch.list(**kwargs)
+    if 'fields' in kwargs:
+        _print_list(q)
+    else:
+        sys.stdout.write('%s switches :    ' % len(q) + " ".join(q) + '\n')
 
 
 @cmd
@@ -656,26 +888,49 @@ def list_network_attachments(network, project):
 
 
 @cmd
-def list_nodes(is_free):
-    """List all nodes or all free nodes
-
-    <is_free> may be either "all" or "free", and determines whether
-        to list all nodes or all free nodes.
+def list_nodes(is_free, *options):
+    """List all nodes, all free nodes or all allocated nodes
+
+    <is_free> may be "all", "free" or "allocated", and determines whether
+        to list all nodes, free nodes or nodes allocated to projects.
+    <options> are of the form key=value, where key is one of:
+        project   - only list nodes in this project
+        switch    - only list nodes with a nic connected to this switch
+        metadata  - only list nodes with this metadata key
+        fields    - a comma-separated list of fields to show for each
+                    node (name, project, metadata)
+        page_size - fetch the list in pages of this many nodes
     """
-    q = C.node.list(is_free)
-    if is_free == 'all':
+    if is_free not in ('all', 'free', 'allocated'):
+        sys.stdout.write('Error: %s is an invalid argument\n' % (is_free))
+        return
+    kwargs = _list_options(options, 'project', 'switch', 'metadata')
+    q = C.node.list(is_free, **kwargs)
+    if 'fields' in kwargs:
+        _print_list(q)
+    elif is_free == 'all':
         sys.stdout.write('All nodes %s\t:    %s\n' % (len(q), " ".join(q)))
     elif is_free == 'free':
         sys.stdout.write('Free nodes %s\t:   %s\n' % (len(q), " ".join(q)))
     else:
-        sys.stdout.write('Error: %s is an invalid argument\n' % (is_free))
+        sys.stdout.write('Allocated nodes %s\t:   %s\n' %
+                         (len(q), " ".join(q)))
 
 
 @cmd
-def list_project_nodes(project):
-    """List all nodes attached to a <project>"""
-    q = C.project.nodes_in(project)
-    sys.stdout.write('Nodes allocated to %s:  ' % project + " ".join(q) + '\n')
+def list_project_nodes(project, *options):
+    """List all nodes attached to a <project>
+
+    <options> are as for list_nodes, except that "project" is not
+    supported.
+    """
+    kwargs = _list_options(options, 'switch', 'metadata')
+    q = C.project.nodes_in(project, **kwargs)
+    if 'fields' in kwargs:
+        _print_list(q)
+    else:
+        sys.stdout.write('Nodes allocated to %s:  ' % project +
+                         " ".join(q) + '\n')
 
 
 @cmd
@@ -702,11 +957,58 @@ def show_port(switch, port):
 
 
 @cmd
-def list_networks():
-    """List all networks"""
-    q = C.network.list()
-    for item in q.items():
-        sys.stdout.write('%s \t : %s\n' % (item[0], item[1]))
+def list_networks(*options):
+    """List all networks
+
+    <options> are as for list_nodes, except that the only filter is
+    "project" (networks the project can access), and the fields are name,
+    network_id, owner and projects.
+    """
+    kwargs = _list_options(options, 'project')
+    q = C.network.list(**kwargs)
+    if 'fields' in kwargs:
+        _print_list(q)
+    else:
+        for item in q.items():
+            sys.stdout.write('%s \t : %s\n' % (item[0], item[1]))
+
+
+def _list_options(options, *filters):
+    """Parse the <options> of a list command.
+
+    Each option must be of the form key=value, where key is one of
+    `filters`, "fields" or "page_size". Returns a dictionary of keyword
+    arguments for the client library.
+    """
+    kwargs = {}
+    for option in options:
+        key, sep, value = option.partition('=')
+        if not sep or key not in filters + ('fields', 'page_size'):
+            raise InvalidAPIArgumentsException(
+                'Error: Invalid option %r.' % option)
+        if key == 'fields':
+            value = value.split(',')
+        elif key == 'page_size':
+            try:
+                value = schema.And(schema.Use(int),
+                                   lambda n: n > 0).validate(value)
+            except schema.SchemaError:
+                raise InvalidAPIArgumentsException(
+                    'Error: page_size must be a positive integer.')
+        kwargs[key] = value
+    return kwargs
+
+
+def _print_list(objects):
+    """Print the objects returned by a list call with fields, one per line.
+
+    Fields are printed as key=value; values other than strings are printed
+    as JSON.
+    """
+    for obj in objects:
+        print ' '.join('%s=%s' % (key, value if isinstance(value, basestring)
+                                  else json.dumps(value, sort_keys=True))
+                       for key, value in sorted(obj.items()))
 
 
 @cmd
@@ -757,8 +1059,23 @@ def list_headnode_images():
 @cmd
 def show_console(node):
     """Display console log for <node>"""
-    url = object_url('node', node, 'console')
-    do_get(url)
+    log, _ = C.node.show_console(node)
+    sys.stdout.write(log)
+
+
+@cmd
+def follow_console(node):
+    """Display console log for <node>, and then any new output as it arrives
+
+    Runs until interrupted.
+    """
+    from time import sleep
+    log, offset = C.node.show_console(node)
+    while True:
+        sys.stdout.write(log)
+        sys.stdout.flush()
+        sleep(1)
+        log, offset = C.node.show_console(node, offset=offset)
 
 
 @cmd
@@ -773,7 +1090,7 @@ def stop_console(node):
     C.node.stop_console(node)
 
 
-@cmd
+@server_cmd
 def create_admin_user(username, password):
     """Create an admin user. Only valid for the database auth backend.
 
@@ -796,6 +1113,192 @@ def create_admin_user(username, password):
     db.session.commit()
 
 
+# Commands which can't be run by `batch` or `shell`, besides those declared
+# with `server_cmd`:
+_UNBATCHABLE_COMMANDS = frozenset(['batch', 'shell'])
+
+
+def _run_line(line):
+    """Run the command on `line`, as it would be written after ``hil``.
+
+    `line` is split into words as by a shell (so arguments may be quoted),
+    and may end with a #comment. Blank lines do nothing.
+
+    Returns None if the command succeeded, or a message describing the
+    error if it failed; errors are not raised, so that one bad command
+    doesn't end a batch or shell session.
+    """
+    try:
+        argv = shlex.split(line, comments=True)
+    except ValueError as e:
+        return 'Could not parse %r: %s' % (line, e)
+    if not argv:
+        return None
+    name = argv[0]
+    if name not in command_dict:
+        return 'Unknown command %r' % name
+    if name in server_commands or name in _UNBATCHABLE_COMMANDS:
+        return '%s cannot be run from a batch or shell' % name
+    try:
+        if command_dict[name](*argv[1:]) is False:
+            return 'Invalid arguments to %s' % name
+    except (FailedAPICallException, InvalidAPIArgumentsException) as e:
+        return e.message or 'Failed'
+    except SystemExit as e:
+        # Some code paths give up via sys.exit; that must not end the batch
+        # (or, with workers, kill the thread running the command):
+        if e.code is None or e.code == 0:
+            return None
+        if isinstance(e.code, int):
+            return 'Exited with status %d' % e.code
+        return str(e.code).strip()
+    except Exception as e:
+        return 'Unexpected error: %s' % e
+    return None
+
+
+class _ThreadOutput(object):
+    """Stands in for ``sys.stdout`` or ``sys.stderr`` in `batch`.
+
+    Output is written to the buffer of the current thread, if it has one
+    (set via the `buffer` attribute of `local`), and to the real stream
+    otherwise. This keeps the output of commands running at the same time
+    from being interleaved.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        getattr(self.local, 'buffer', self.stream).write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+@cmd
+def batch(source, *options):
+    """Run the commands in the file <source>, one per line
+
+    <source> may be "-" to read them from stdin. Each line is a command as
+    it would be written after "hil"; blank lines and #comments are
+    ignored. The commands share one connection to the server, and
+    authenticate only once, which is much faster than running "hil" for
+    each. A command which fails is reported, along with its line number,
+    and the rest still run.
+
+    <options> are of the form key=value, where key is:
+        workers - run up to this many commands at once (default 1). Only
+                  use this if the commands don't depend on each other.
+                  Their output is still printed in order.
+    """
+    workers = 1
+    for option in options:
+        key, sep, value = option.partition('=')
+        if key != 'workers' or not sep:
+            raise InvalidAPIArgumentsException(
+                'Error: Invalid option %r.' % option)
+        try:
+            workers = schema.And(schema.Use(int),
+                                 lambda n: n > 0).validate(value)
+        except schema.SchemaError:
+            raise InvalidAPIArgumentsException(
+                'Error: workers must be a positive integer.')
+
+    f = sys.stdin if source == '-' else open(source)
+    lines = enumerate(iter(f.readline, ''), 1)
+    failures = []
+    try:
+        if workers == 1:
+            for lineno, line in lines:
+                error = _run_line(line)
+                if error is not None:
+                    sys.stderr.write('Error on line %d: %s\n' %
+                                     (lineno, error))
+                    failures.append(lineno)
+        else:
+            _batch_concurrently(lines, workers, failures)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    if failures:
+        shown = ', '.join(str(n) for n in failures[:10])
+        if len(failures) > 10:
+            shown += '...'
+        raise FailedAPICallException(
+            '%d command(s) failed, on line(s) %s' % (len(failures), shown))
+
+
+def _batch_concurrently(lines, workers, failures):
+    """Run `lines` (pairs of line numbers and commands) in `workers` threads.
+
+    The output of each command is printed once it and the commands before
+    it are done. The line numbers of failed commands are appended to
+    `failures`.
+    """
+    from multiprocessing.pool import ThreadPool
+    # Keep a connection open for each thread:
+    fit_connection_pool(http_client, workers)
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = _ThreadOutput(stdout), _ThreadOutput(stderr)
+
+    def run(item):
+        lineno, line = item
+        sys.stdout.local.buffer = StringIO()
+        sys.stderr.local.buffer = StringIO()
+        try:
+            error = _run_line(line)
+            return (lineno, error, sys.stdout.local.buffer.getvalue(),
+                    sys.stderr.local.buffer.getvalue())
+        finally:
+            del sys.stdout.local.buffer
+            del sys.stderr.local.buffer
+
+    pool = ThreadPool(workers)
+    try:
+        for lineno, error, out, err in pool.imap(run, lines):
+            stdout.write(out)
+            stderr.write(err)
+            if error is not None:
+                stderr.write('Error on line %d: %s\n' % (lineno, error))
+                failures.append(lineno)
+            stdout.flush()
+    finally:
+        pool.close()
+        sys.stdout, sys.stderr = stdout, stderr
+
+
+@cmd
+def shell():
+    """Run commands interactively, sharing one connection to the server
+
+    Enter each command as it would be written after "hil". End the session
+    with "exit" or EOF (ctrl-D).
+    """
+    try:
+        # Gives raw_input line editing and history:
+        import readline  # pylint: disable=unused-import
+    except ImportError:
+        pass
+    prompt = 'hil> ' if sys.stdin.isatty() else ''
+    while True:
+        try:
+            line = raw_input(prompt)
+        except EOFError:
+            if prompt:
+                sys.stdout.write('\n')
+            return
+        except KeyboardInterrupt:
+            sys.stdout.write('\n')
+            continue
+        if line.strip() in ('exit', 'quit'):
+            return
+        error = _run_line(line)
+        if error is not None:
+            sys.stderr.write('Error: %s\n' % error)
+
+
 @cmd
 def help(*commands):
     """Display usage of all following <commands>, or of all commands if none
@@ -819,13 +1322,18 @@ def main():
     this function.
     """
     ensure_not_root()
-    config.setup()
+    with startup.phase('load config'):
+        config.load()
+        config.configure_logging()
 
     if len(sys.argv) < 2 or sys.argv[1] not in command_dict:
         # Display usage for all commands
         help()
         sys.exit(1)
     else:
+        if sys.argv[1] in server_commands:
+            with startup.phase('load extensions'):
+                config.load_extensions()
         setup_http_client()
         try:
             command_dict[sys.argv[1]](*sys.argv[2:])
@@ -1,10 +1,33 @@
 """ This module implements the HIL client library. """
 
+from collections import namedtuple
+import json
 from urlparse import urljoin
 
 
 class FailedAPICallException(Exception):
-    pass
+    """An API call failed.
+
+    For a bulk call which the server rejected item by item (see
+    ``hil.errors.BulkError``), `errors` is a list of ``(item, message)``
+    pairs, one per invalid item; for other calls it is empty.
+    """
+
+    def __init__(self, message='', errors=()):
+        Exception.__init__(self, message)
+        self.errors = list(errors)
+
+
+class BulkResult(namedtuple('BulkResult', ['value', 'error'])):
+    """The outcome of one item of a bulk call (see `ClientBase.each`).
+
+    `value` is what the single call returned, and `error` the exception it
+    raised (usually a FailedAPICallException), or None if it succeeded.
+    """
+
+    @property
+    def ok(self):
+        return self.error is None
 
 
 class ClientBase(object):
@@ -17,6 +40,11 @@ class ClientBase(object):
     appropriate message.
     """
 
+    # The most requests bulk calls (see `each`) make at once:
+    max_workers = 8
+    # The most operations `each_batched` sends in one batch:
+    batch_size = 100
+
     def __init__(self, endpoint, httpClient):
         """ Initialize an instance of the library with following parameters.
 
@@ -28,6 +56,8 @@ class ClientBase(object):
         """
         self.endpoint = endpoint
         self.httpClient = httpClient
+        # Whether the server has a batch endpoint; see `each_batched`:
+        self.batch_supported = True
 
     def object_url(self, *args):
         """Generate URL from combining endpoint and args as relative URL"""
@@ -43,4 +73,109 @@ class ClientBase(object):
                 return
         else:
             e = response.json()
-            raise FailedAPICallException(e['msg'])
+            raise FailedAPICallException(
+                e['msg'], [(error['item'], error['msg'])
+                           for error in e.get('errors', [])])
+
+    def list_pages(self, url, page_size=None, **params):
+        """Fetch the full result of the list call at `url`.
+
+        `params` are the call's query parameters; those which are None are
+        omitted, and `fields`, if given, is a list of field names. The
+        result is fetched in pages of at most `page_size` entries (or in one
+        page, if `page_size` is None), following the server's cursors.
+
+        Returns the concatenation of the pages or, for calls which return
+        a JSON object, their union.
+        """
+        params = dict((key, value) for key, value in params.items()
+                      if value is not None)
+        if 'fields' in params:
+            params['fields'] = ','.join(params['fields'])
+        if page_size is not None:
+            params['limit'] = page_size
+        result = None
+        while True:
+            response = self.httpClient.request('GET', url, params=params)
+            page = self.check_response(response)
+            if result is None:
+                result = page
+            elif isinstance(result, dict):
+                result.update(page)
+            else:
+                result.extend(page)
+            cursor = response.headers.get('X-Next-Cursor')
+            if cursor is None:
+                return result
+            params['cursor'] = cursor
+
+    def each(self, f, args_list):
+        """Call ``f(*args)`` for each tuple `args` in `args_list`.
+
+        The calls are made concurrently, up to `max_workers` at a time,
+        sharing the connections of the HTTP client. Returns a list of
+        `BulkResult`, in the order of `args_list`; a call which fails
+        doesn't stop the others.
+        """
+        args_list = list(args_list)
+
+        def call(args):
+            try:
+                return BulkResult(f(*args), None)
+            except Exception as e:
+                return BulkResult(None, e)
+
+        workers = min(self.max_workers, len(args_list))
+        if workers <= 1:
+            return [call(args) for args in args_list]
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(call, args_list)
+        finally:
+            pool.close()
+
+    def each_batched(self, f, args_list, operation):
+        """Like `each`, but using the server's batch endpoint if possible.
+
+        `f` must be an API call which may be used in a batch (see the
+        ``batch`` call in docs/rest_api.md), and which returns nothing.
+        `operation` maps each tuple of arguments to the call's HTTP method,
+        its path (relative to the endpoint) and its request body (or None),
+        as a tuple.
+
+        The arguments are sent in batches of `batch_size`, one batch at a
+        time. A batch is all or nothing, and only reports its first error,
+        so if one fails, its calls are made individually instead, with
+        `each`, to find out which of them fail. The same goes for all of
+        them if the server has no batch endpoint.
+        """
+        args_list = list(args_list)
+        results = []
+        for i in range(0, len(args_list), self.batch_size):
+            chunk = args_list[i:i + self.batch_size]
+            if self.batch_supported and len(chunk) > 1 and \
+                    self._run_batch(chunk, operation):
+                results.extend([BulkResult(None, None)] * len(chunk))
+            else:
+                results.extend(self.each(f, chunk))
+        return results
+
+    def _run_batch(self, args_list, operation):
+        """Run the calls for `args_list` in one batch; see `each_batched`.
+
+        Returns whether the batch succeeded.
+        """
+        operations = []
+        for args in args_list:
+            method, path, body = operation(*args)
+            op = {'method': method, 'path': '/' + path.lstrip('/')}
+            if body is not None:
+                op['body'] = body
+            operations.append(op)
+        response = self.httpClient.request(
+            'POST', self.object_url('batch'),
+            data=json.dumps({'operations': operations}))
+        if response.status_code in (404, 405):
+            self.batch_supported = False
+        return response.ok
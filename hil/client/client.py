@@ -6,6 +6,9 @@ from hil.client.network import Network
 from hil.client.user import User
 import abc
 import requests
+import threading
+import time
+from urlparse import urljoin
 
 
 class HTTPClient(object):
@@ -55,6 +58,145 @@ class RequestsHTTPClient(requests.Session, HTTPClient):
     """
 
 
+class TokenHTTPClient(RequestsHTTPClient):
+    """An HTTPClient which authenticates with bearer tokens.
+
+    This is for the database auth backend (``hil.ext.auth.database``). The
+    client exchanges its user name and password for a short-lived token,
+    via the server's ``/auth/token`` call, and sends that instead of the
+    password, which saves the server from checking the password on every
+    request. Since obtaining a token takes a request of its own, the first
+    `BASIC_REQUESTS` requests use basic auth, so that short sessions (e.g.
+    a single CLI command) don't pay for it. A new token is obtained when
+    the current one is about to expire, or is rejected (e.g. after the
+    server restarts). If the server does not issue tokens, or rejects the
+    ones it issues (as happens when several server processes don't share a
+    ``token_secret``), the client falls back to basic auth.
+    """
+
+    # Obtain a new token this many seconds before the current one expires:
+    REFRESH_MARGIN = 60
+    # The number of requests to make with basic auth before using tokens:
+    BASIC_REQUESTS = 1
+
+    def __init__(self, endpoint, username, password):
+        """Create a TokenHTTPClient
+
+        Parameters
+        ----------
+
+        endpoint : str
+            The HIL server's endpoint, e.g. http://127.0.0.1:5000
+        username : str
+            The user name to authenticate as
+        password : str
+            The user's password
+        """
+        super(TokenHTTPClient, self).__init__()
+        self.endpoint = endpoint
+        self.credentials = (username, password)
+        self.token = None
+        self.expires = 0
+        self.use_tokens = True
+        self.basic_requests = 0
+        # Held while obtaining a token, so that threads sharing the client
+        # (see ``ClientBase.each``) don't all obtain one at once:
+        self._token_lock = threading.Lock()
+
+    def refresh_token(self):
+        """Obtain a new token from the server.
+
+        The current token stays in use until the new one arrives. Returns
+        the new token, or None if none was issued; sets `use_tokens` to
+        False if the server does not issue tokens.
+        """
+        with self._token_lock:
+            return self._obtain_token()
+
+    def _replace_token(self, stale):
+        """Obtain a new token in place of `stale`, unless another thread
+        already has; return the current token, or None.
+        """
+        with self._token_lock:
+            if self.token != stale:
+                return self.token
+            return self._obtain_token()
+
+    def _obtain_token(self):
+        # The caller must hold `_token_lock`.
+        response = super(TokenHTTPClient, self).request(
+            'POST', urljoin(self.endpoint, 'auth/token'),
+            auth=self.credentials)
+        if response.status_code in (404, 405):
+            self.use_tokens = False
+            return None
+        if not response.ok:
+            return None
+        body = response.json()
+        self.token, self.expires = body['token'], body['expires']
+        return body['token']
+
+    def request(self, method, url, data=None, params=None, **kwargs):
+        """Make an HTTP request, authenticating with a token if possible."""
+        if not self.use_tokens or self.basic_requests < self.BASIC_REQUESTS:
+            self.basic_requests += 1
+            return self._request_with_password(method, url, data, params,
+                                               **kwargs)
+        # Other threads may replace the token as we go, so work on a copy:
+        token = self.token
+        fresh = False
+        if token is None or self.expires - self.REFRESH_MARGIN < time.time():
+            token = self._replace_token(token)
+            fresh = True
+            if token is None:
+                # The server doesn't issue tokens, or rejected our
+                # credentials; either way, let basic auth report it:
+                return self._request_with_password(method, url, data,
+                                                   params, **kwargs)
+        response = self._request_with_token(token, method, url, data, params,
+                                            **kwargs)
+        if _invalid_token(response) and not fresh:
+            # The token may have been revoked; try once with a new one:
+            token = self._replace_token(token)
+            if token is None:
+                return self._request_with_password(method, url, data,
+                                                   params, **kwargs)
+            response = self._request_with_token(token, method, url, data,
+                                                params, **kwargs)
+        if _invalid_token(response):
+            # The server rejects the tokens it issues: if ``token_secret``
+            # is unset, each server process signs tokens with a key of its
+            # own, so another process (or the same one, restarted) won't
+            # accept them. Stick to basic auth:
+            self.use_tokens = False
+            response = self._request_with_password(method, url, data,
+                                                   params, **kwargs)
+        return response
+
+    def _request_with_password(self, method, url, data, params, **kwargs):
+        return super(TokenHTTPClient, self).request(
+            method, url, data=data, params=params, auth=self.credentials,
+            **kwargs)
+
+    def _request_with_token(self, token, method, url, data, params,
+                            **kwargs):
+        headers = dict(kwargs.pop('headers', None) or {})
+        headers['Authorization'] = 'Bearer ' + token
+        return super(TokenHTTPClient, self).request(
+            method, url, data=data, params=params, headers=headers,
+            **kwargs)
+
+
+def _invalid_token(response):
+    """Return whether `response` rejects the bearer token it was sent.
+
+    Other 401 responses mean that the (authenticated) user may not make the
+    call, which a new token won't change.
+    """
+    return response.status_code == 401 and \
+        'invalid_token' in response.headers.get('WWW-Authenticate', '')
+
+
 class KeystoneHTTPClient(HTTPClient):
     """An HTTPClient which authenticates with Keystone.
 
@@ -94,9 +236,30 @@ class KeystoneHTTPClient(HTTPClient):
             return e.response
 
 
+def fit_connection_pool(http_client, size):
+    """Let `http_client` keep `size` connections to the server open.
+
+    requests keeps up to 10 by default; more than that many threads sharing
+    a client (see ``ClientBase.each``) would otherwise keep opening new
+    connections. Does nothing for clients which don't use requests
+    directly.
+    """
+    if isinstance(http_client, requests.Session):
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=size)
+        http_client.mount('http://', adapter)
+        http_client.mount('https://', adapter)
+
+
 class Client(object):
 
-    def __init__(self, endpoint, httpClient):
+    def __init__(self, endpoint, httpClient, max_workers=None):
+        """Create a Client
+
+        If `max_workers` is given, bulk calls (see ``ClientBase.each``) make
+        up to that many requests at once, rather than
+        ``ClientBase.max_workers``, and `httpClient` keeps as many
+        connections open (see `fit_connection_pool`).
+        """
         self.httpClient = httpClient
         self.endpoint = endpoint
         self.node = Node(self.endpoint, self.httpClient)
@@ -105,3 +268,8 @@ class Client(object):
         self.port = Port(self.endpoint, self.httpClient)
         self.network = Network(self.endpoint, self.httpClient)
         self.user = User(self.endpoint, self.httpClient)
+        if max_workers is not None:
+            for part in (self.node, self.project, self.switch, self.port,
+                         self.network, self.user):
+                part.max_workers = max_workers
+            fit_connection_pool(httpClient, max_workers)
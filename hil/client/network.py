@@ -8,16 +8,25 @@ class Network(ClientBase):
         objects and relations.
         """
 
-        def list(self):
-            """Lists all networks under HIL """
+        def list(self, project=None, fields=None, page_size=None):
+            """Lists all networks under HIL, or those <project> can access """
             url = self.object_url('networks')
-            return self.check_response(self.httpClient.request("GET", url))
+            return self.list_pages(url, page_size, project=project,
+                                   fields=fields)
 
         def show(self, network):
             """Shows attributes of a network. """
             url = self.object_url('network', network)
             return self.check_response(self.httpClient.request("GET", url))
 
+        def show_many(self, networks):
+            """Shows the attributes of each of <networks>
+
+            Returns a list of BulkResult, in the same order, whose values
+            are as returned by show.
+            """
+            return self.each(self.show, [(network,) for network in networks])
+
         def create(self, network, owner, access, net_id):
             """Create a link-layer <network>.
 
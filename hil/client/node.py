@@ -1,6 +1,88 @@
+import csv
 import json
 from hil.client.base import ClientBase
 
+# The prefix of the OBM types' names; see `expand_obm_type`:
+OBM_API = "http://schema.massopencloud.org/haas/v0/obm/"
+
+
+def expand_obm_type(obm_type):
+    """Return the full name of <obm_type>
+
+    Short names, such as "ipmi", are expanded to the name of the OBM type
+    of the same name which comes with HIL. Full names are returned as-is.
+    """
+    if '/' in obm_type:
+        return obm_type
+    return OBM_API + obm_type
+
+
+def read_nodes_json(f):
+    """Read the nodes to register with register_many from the file <f>
+
+    The file must hold a JSON array of nodes, in the format register_many
+    takes. The nodes' OBM types may be given by their short names (see
+    expand_obm_type). Raises ValueError if the file isn't such an array.
+    """
+    nodes = json.load(f)
+    if not isinstance(nodes, list):
+        raise ValueError('Expected a JSON array of nodes')
+    for node in nodes:
+        obm = node.get('obm') if isinstance(node, dict) else None
+        if isinstance(obm, dict) and isinstance(obm.get('type'), basestring):
+            obm['type'] = expand_obm_type(obm['type'])
+    return nodes
+
+
+def read_nodes_csv(f):
+    """Read the nodes to register with register_many from the CSV file <f>
+
+    The first row of the file is a header, naming the columns; each row
+    after that is a node. The columns are:
+
+        name            - the node's name
+        obm.<key>       - the OBM argument <key> (e.g. obm.type, obm.host)
+        nic.<label>     - the mac address of the nic <label>
+        metadata.<key>  - the value of the metadata <key> (a string)
+
+    Empty cells are skipped, so nodes with different nics may share a file.
+    The OBM types may be given by their short names (see expand_obm_type).
+    Raises ValueError if the file is empty, the header has any other
+    columns, or a node has no name.
+    """
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        raise ValueError('Empty CSV file')
+    for column in header:
+        kind, sep, key = column.partition('.')
+        if column != 'name' and \
+                not (sep and key and kind in ('obm', 'nic', 'metadata')):
+            raise ValueError('Invalid column %r' % column)
+    nodes = []
+    for row in reader:
+        if not any(row):
+            continue
+        node = {'obm': {}, 'nics': [], 'metadata': {}}
+        for column, value in zip(header, row):
+            kind, _, key = column.partition('.')
+            if not value:
+                continue
+            elif kind == 'name':
+                node['name'] = value
+            elif kind == 'obm':
+                node['obm'][key] = value
+            elif kind == 'nic':
+                node['nics'].append({'label': key, 'macaddr': value})
+            else:
+                node['metadata'][key] = value
+        if 'name' not in node:
+            raise ValueError('Row %d has no name' % reader.line_num)
+        if 'type' in node['obm']:
+            node['obm']['type'] = expand_obm_type(node['obm']['type'])
+        nodes.append(node)
+    return nodes
+
 
 class Node(ClientBase):
     """Consists of calls to query and manipulate node related
@@ -8,16 +90,50 @@ class Node(ClientBase):
     objects and relations.
     """
 
-    def list(self, is_free):
-        """List all nodes that HIL manages """
+    def list(self, is_free, project=None, switch=None, metadata=None,
+             fields=None, page_size=None):
+        """List all nodes that HIL manages
+
+        <is_free> is "all", "free" or "allocated". The nodes may be
+        filtered by <project>, by <switch> (nodes with a nic connected to
+        it) and by <metadata> (nodes with a metadata key of that name).
+        If <fields> (a list of field names) is given, returns a list of
+        objects with those fields, rather than a list of names.
+        """
         url = self.object_url('nodes', is_free)
-        return self.check_response(self.httpClient.request('GET', url))
+        return self.list_pages(url, page_size, project=project,
+                               switch=switch, metadata=metadata,
+                               fields=fields)
 
     def show(self, node_name):
         """Shows attributes of a given node """
         url = self.object_url('node', node_name)
         return self.check_response(self.httpClient.request('GET', url))
 
+    def show_many(self, is_free='all', project=None, nodes=None,
+                  page_size=None):
+        """Shows the attributes of many nodes at once
+
+        <is_free> and <project> are as for list. If <nodes> (a list of node
+        names) is given, only those nodes are shown. Returns a list of
+        nodes, each as returned by show.
+
+        This uses the server's bulk call, so it fails as a whole if any of
+        <nodes> can't be shown; see show_each for results per node.
+        """
+        url = self.object_url('nodes', is_free, 'details')
+        if nodes is not None:
+            nodes = ','.join(nodes)
+        return self.list_pages(url, page_size, project=project, nodes=nodes)
+
+    def show_each(self, nodes):
+        """Shows the attributes of each of <nodes> (a list of node names)
+
+        Returns a list of BulkResult, in the same order, whose values are
+        as returned by show.
+        """
+        return self.each(self.show, [(node,) for node in nodes])
+
     def register(self, node, subtype, *args):
         """Register a node with appropriate OBM driver. """
         # Registering a node requires apriori knowledge of the
@@ -33,6 +149,25 @@ class Node(ClientBase):
         # and currently active drivers for HIL
         raise NotImplementedError
 
+    def register_many(self, nodes):
+        """Register many nodes at once, with their nics and metadata
+
+        <nodes> is a list of dicts, each with the keys "name", "obm" (the
+        node's OBM type and arguments, as a dict) and optionally "nics" (a
+        list of dicts with the keys "label" and "macaddr") and "metadata"
+        (a dict). read_nodes_json and read_nodes_csv read such lists from
+        files.
+
+        This makes a single call, which registers either all of the nodes
+        or, if any are invalid, none of them; in that case, the
+        FailedAPICallException's <errors> lists what is wrong with each.
+        """
+        url = self.object_url('nodes')
+        return self.check_response(
+                self.httpClient.request('POST', url,
+                                        data=json.dumps({'nodes': nodes}))
+                )
+
     def delete(self, node_name):
         """Deletes the node from database. """
         url = self.object_url('node', node_name)
@@ -48,6 +183,45 @@ class Node(ClientBase):
         url = self.object_url('node', node_name, 'power_off')
         return self.check_response(self.httpClient.request('POST', url))
 
+    def power_status(self, node_name):
+        """Returns the power state of <node>, as cached by HIL"""
+        url = self.object_url('node', node_name, 'power_status')
+        return self.check_response(self.httpClient.request('GET', url))
+
+    def list_power_status(self, project=None):
+        """Returns the cached power states of every node in <project>, or
+        of every node if <project> is None.
+        """
+        url = self.object_url('power_status')
+        params = {}
+        if project is not None:
+            params['project'] = project
+        return self.check_response(
+                self.httpClient.request('GET', url, params=params)
+                )
+
+    def queue_obm_jobs(self, type, project=None, nodes=None, bootdev=None):
+        """Queue the obm operation <type> on every node in <project>, or on
+        each of the list of <nodes>. Returns the list of jobs.
+        """
+        url = self.object_url('obm_jobs')
+        payload = {'type': type}
+        if project is not None:
+            payload['project'] = project
+        if nodes is not None:
+            payload['nodes'] = nodes
+        if bootdev is not None:
+            payload['bootdev'] = bootdev
+        response = self.httpClient.request('POST', url,
+                                           data=json.dumps(payload))
+        self.check_response(response)
+        return response.json()
+
+    def show_obm_job(self, job):
+        """Shows the status of the obm job <job>"""
+        url = self.object_url('obm_job', str(job))
+        return self.check_response(self.httpClient.request('GET', url))
+
     def add_nic(self, node_name, nic_name, macaddr):
         """Add a <nic> to <node>"""
         url = self.object_url('node', node_name, 'nic', nic_name)
@@ -56,6 +230,18 @@ class Node(ClientBase):
                 self.httpClient.request('PUT', url, data=payload)
                 )
 
+    def add_nic_many(self, nics):
+        """Add many nics at once
+
+        <nics> is a list of (node, nic, macaddr) tuples, as for add_nic.
+        Returns a list of BulkResult, in the same order.
+        """
+        return self.each_batched(
+            self.add_nic, nics,
+            lambda node, nic, macaddr: (
+                'PUT', '/'.join(['node', node, 'nic', nic]),
+                {'macaddr': macaddr}))
+
     def remove_nic(self, node_name, nic_name):
         """Remove a <nic> from <node>"""
         url = self.object_url('node', node_name, 'nic', nic_name)
@@ -73,6 +259,20 @@ class Node(ClientBase):
                 self.httpClient.request('POST', url, data=payload)
                 )
 
+    def connect_network_many(self, connections):
+        """Connect many nics to networks at once
+
+        <connections> is a list of (node, nic, network, channel) tuples, as
+        for connect_network. Returns a list of BulkResult, in the same
+        order.
+        """
+        return self.each_batched(
+            self.connect_network, connections,
+            lambda node, nic, network, channel: (
+                'POST', '/'.join(['node', node, 'nic', nic,
+                                  'connect_network']),
+                {'network': network, 'channel': channel}))
+
     def detach_network(self, node, nic, network):
         """Disconnect <node> from <network> on the given <nic>. """
         url = self.object_url(
@@ -83,9 +283,37 @@ class Node(ClientBase):
                 self.httpClient.request('POST', url, data=payload)
                 )
 
-    def show_console(self, node):
-        """Display console log for <node> """
-        raise NotImplementedError
+    def detach_network_many(self, detachments):
+        """Disconnect many nics from networks at once
+
+        <detachments> is a list of (node, nic, network) tuples, as for
+        detach_network. Returns a list of BulkResult, in the same order.
+        """
+        return self.each_batched(
+            self.detach_network, detachments,
+            lambda node, nic, network: (
+                'POST', '/'.join(['node', node, 'nic', nic,
+                                  'detach_network']),
+                {'network': network}))
+
+    def show_console(self, node, offset=None, tail=None):
+        """Return the console log for <node>.
+
+        If <offset> is given, return only the output from that byte offset
+        on; if <tail> is given, only the last <tail> bytes. Returns a tuple
+        (log, next_offset); pass next_offset as <offset> to get only the
+        output which arrives later.
+        """
+        url = self.object_url('node', node, 'console')
+        params = {}
+        if offset is not None:
+            params['offset'] = offset
+        if tail is not None:
+            params['tail'] = tail
+        response = self.httpClient.request('GET', url, params=params)
+        if not response.ok:
+            self.check_response(response)
+        return response.content, int(response.headers['X-Console-Offset'])
 
     def start_console(self, node):
         """Start logging console output from <node> """
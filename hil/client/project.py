@@ -8,16 +8,21 @@ class Project(ClientBase):
         objects and relations.
         """
 
-        def list(self):
+        def list(self, fields=None, page_size=None):
             """Lists all projects under HIL """
 
             url = self.object_url('/projects')
-            return self.check_response(self.httpClient.request("GET", url))
+            return self.list_pages(url, page_size, fields=fields)
 
-        def nodes_in(self, project_name):
-            """Lists nodes allocated to project <project_name> """
+        def nodes_in(self, project_name, switch=None, metadata=None,
+                     fields=None, page_size=None):
+            """Lists nodes allocated to project <project_name>
+
+            The other arguments are as for Node.list.
+            """
             url = self.object_url('project', project_name, 'nodes')
-            return self.check_response(self.httpClient.request("GET", url))
+            return self.list_pages(url, page_size, switch=switch,
+                                   metadata=metadata, fields=fields)
 
         def networks_in(self, project_name):
             """Lists nodes allocated to project <project_name> """
@@ -41,15 +46,26 @@ class Project(ClientBase):
             url = self.object_url(
                     'project', project_name, 'connect_node'
                     )
-            self.payload = json.dumps({'node': node_name})
+            payload = json.dumps({'node': node_name})
             return self.check_response(
-                    self.httpClient.request("POST", url, data=self.payload)
+                    self.httpClient.request("POST", url, data=payload)
                     )
 
+        def connect_many(self, project_name, node_names):
+            """Adds many nodes to a project at once.
+
+            Returns a list of BulkResult, in the order of <node_names>.
+            """
+            return self.each_batched(
+                self.connect, [(project_name, node) for node in node_names],
+                lambda project, node: (
+                    'POST', '/'.join(['project', project, 'connect_node']),
+                    {'node': node}))
+
         def detach(self, project_name, node_name):
             """Detaches a node from a project. """
             url = self.object_url('project', project_name, 'detach_node')
-            self.payload = json.dumps({'node': node_name})
+            payload = json.dumps({'node': node_name})
             return self.check_response(
-                    self.httpClient.request("POST", url, data=self.payload)
+                    self.httpClient.request("POST", url, data=payload)
                     )
@@ -8,10 +8,10 @@ class Switch(ClientBase):
     objects and relations.
     """
 
-    def list(self):
-        """List all nodes that HIL manages """
+    def list(self, fields=None, page_size=None):
+        """List all switches that HIL manages """
         url = self.object_url('/switches')
-        return self.check_response(self.httpClient.request("GET", url))
+        return self.list_pages(url, page_size, fields=fields)
 
     def register(self, switch, subtype, *args):
         """Registers a switch with name <switch> and
@@ -32,6 +32,14 @@ class Switch(ClientBase):
         url = self.object_url('switch', switch)
         return self.check_response(self.httpClient.request("GET", url))
 
+    def show_many(self, switches):
+        """Shows the attributes of each of <switches>
+
+        Returns a list of BulkResult, in the same order, whose values are
+        as returned by show.
+        """
+        return self.each(self.show, [(switch,) for switch in switches])
+
 
 class Port(ClientBase):
     """Port related operations. """
@@ -41,6 +49,17 @@ class Port(ClientBase):
         url = self.object_url('switch', switch, 'port', port)
         return self.check_response(self.httpClient.request("PUT", url))
 
+    def register_many(self, ports):
+        """Register many ports at once
+
+        <ports> is a list of (switch, port) tuples. Returns a list of
+        BulkResult, in the same order.
+        """
+        return self.each_batched(
+            self.register, ports,
+            lambda switch, port: (
+                'PUT', '/'.join(['switch', switch, 'port', port]), None))
+
     def delete(self, switch, port):
         """Deletes information of the <port> for <switch> """
         url = self.object_url('switch', switch, 'port', port)
@@ -54,6 +73,19 @@ class Port(ClientBase):
                 self.httpClient.request("POST", url, data=payload)
                 )
 
+    def connect_nic_many(self, connections):
+        """Connect many ports to nics at once
+
+        <connections> is a list of (switch, port, node, nic) tuples, as for
+        connect_nic. Returns a list of BulkResult, in the same order.
+        """
+        return self.each_batched(
+            self.connect_nic, connections,
+            lambda switch, port, node, nic: (
+                'POST', '/'.join(['switch', switch, 'port', port,
+                                  'connect_nic']),
+                {'node': node, 'nic': nic}))
+
     def detach_nic(self, switch, port):
         """"Detaches <port> of <switch>. """
         url = self.object_url('switch', switch, 'port', port, 'detach_nic')
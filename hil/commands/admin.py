@@ -1,3 +1,6 @@
+import atexit
+
+from hil import startup
 from hil import config, model
 from hil.commands import db
 from hil.commands.util import ensure_not_root
@@ -11,6 +14,9 @@ manager.add_command('db', db.command)
 def main():
     """Entrypoint for the hil-admin command."""
     ensure_not_root()
+    # The commands may not return (e.g. they may call sys.exit), so report
+    # the startup profile (if enabled) on the way out:
+    atexit.register(startup.report)
     config.setup()
     model.init_db()
     manager.run()
@@ -1,5 +1,13 @@
+from flask_migrate import Migrate, MigrateCommand
 from hil import server
-from hil.migrations import command, create_db
+from hil.flaskapp import app
+from hil.migrations import MIGRATIONS_DIR, configure_alembic, create_db, \
+    write_heads_manifests
+from hil.model import db
+
+migrate = Migrate(app, db, directory=MIGRATIONS_DIR)
+migrate.configure(configure_alembic)
+command = MigrateCommand
 
 
 @command.command
@@ -7,3 +15,13 @@ def create():
     """Initialize the database."""
     server.init()
     create_db()
+
+
+@command.command
+def cache_heads():
+    """Rewrite the manifests of the migration scripts' revisions.
+
+    Run this after adding or changing a migration script; see
+    ``hil.migrations.write_heads_manifests``.
+    """
+    write_heads_manifests()
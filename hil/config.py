@@ -25,6 +25,8 @@ import importlib
 import os
 import sys
 
+from hil import startup
+
 cfg = ConfigParser.RawConfigParser()
 cfg.optionxform = str
 
@@ -87,10 +89,12 @@ def load_extensions():
     if not cfg.has_section('extensions'):
         return
     for name in cfg.options('extensions'):
-        importlib.import_module(name)
+        with startup.phase('import ' + name):
+            importlib.import_module(name)
     for name in cfg.options('extensions'):
         if hasattr(sys.modules[name], 'setup'):
-            sys.modules[name].setup()
+            with startup.phase('set up ' + name):
+                sys.modules[name].setup()
 
 
 def setup(filename='hil.cfg'):
@@ -99,6 +103,8 @@ def setup(filename='hil.cfg'):
     This is equivalent to calling load, configure_logging, and
     load_extensions in sequence.
     """
-    load(filename)
-    configure_logging()
-    load_extensions()
+    with startup.phase('load config'):
+        load(filename)
+        configure_logging()
+    with startup.phase('load extensions'):
+        load_extensions()
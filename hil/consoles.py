@@ -0,0 +1,607 @@
+# Copyright 2017 Massachusetts Open Cloud Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the
+# License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS
+# IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.  See the License for the specific language
+# governing permissions and limitations under the License.
+
+"""Console logging: ring buffers and the console daemon.
+
+Each node's console log is a ``RingBuffer``: a fixed-size, memory-mapped
+file in the console log directory, which holds the most recent output from
+the node's console. Obm drivers create, read and delete the buffers (via
+``start_console``, ``get_console`` etc.) from the API server.
+
+The processes which actually talk to the consoles (e.g. ``ipmitool sol
+activate``) are all owned by the console daemon (``hil serve_consoles``),
+which runs a ``ConsoleManager``. The daemon keeps a session running for every
+buffer marked active, copying its output into the buffer; it restarts
+sessions which die, and stops sessions whose buffers have been deactivated
+or deleted. The API server and the daemon thus only communicate through the
+buffers themselves.
+
+Drivers opt in to this by implementing ``Obm.console_commands``.
+"""
+
+import errno
+import json
+import logging
+import mmap
+import os
+import select
+import signal
+import struct
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from subprocess import Popen, PIPE, call
+
+from hil.config import cfg
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_DIR = '/var/run/hil_console_logs'
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# The name of the console daemon's registry of sessions, in the log directory:
+REGISTRY = 'sessions.json'
+
+# The most we copy out of a buffer at once when reading it:
+CHUNK_SIZE = 64 * 1024
+
+# Console output is filtered through ``strip_non_ascii`` before it is shown
+# to users; these are the bytes it removes.
+_NON_ASCII = ''.join(chr(i) for i in range(128, 256))
+
+# The header at the start of each buffer file:
+#
+# * the magic string ``HILC``
+# * flags (see ``_ACTIVE``)
+# * three bytes of padding
+# * the capacity of the buffer in bytes (excluding the header)
+# * the total number of bytes ever written to the buffer
+#
+# The last of these doubles as the absolute offset of the end of the log;
+# the buffer holds the ``capacity`` bytes before it (or fewer, if less than
+# that has been written).
+_HEADER = struct.Struct('<4sB3xQQ')
+_MAGIC = 'HILC'
+_ACTIVE = 0x1
+_FLAGS_OFFSET = 4
+_POSITION_OFFSET = 16
+
+
+def log_dir():
+    """Return the directory in which console logs are kept."""
+    if cfg.has_option('console', 'log_dir'):
+        return cfg.get('console', 'log_dir')
+    return DEFAULT_LOG_DIR
+
+
+def buffer_size():
+    """Return the capacity to use for new console logs, in bytes."""
+    if cfg.has_option('console', 'buffer_size'):
+        return cfg.getint('console', 'buffer_size')
+    return DEFAULT_BUFFER_SIZE
+
+
+class RingBuffer(object):
+    """A console log stored in a fixed-size, memory-mapped file.
+
+    There should be at most one writer (the console daemon) at a time, but
+    any number of readers, in any process.
+    """
+
+    def __init__(self, path):
+        """Open the existing buffer at ``path``.
+
+        Raises ``IOError`` if the file doesn't exist, and ``ValueError`` if
+        it isn't a valid buffer.
+        """
+        self.path = path
+        self._file = open(path, 'r+b')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0)
+        except Exception:
+            self._file.close()
+            raise
+        if len(self._map) < _HEADER.size:
+            self.close()
+            raise ValueError('%s is not a console log' % path)
+        magic, _, self.capacity, _ = _HEADER.unpack_from(self._map)
+        if magic != _MAGIC or len(self._map) != _HEADER.size + self.capacity:
+            self.close()
+            raise ValueError('%s is not a console log' % path)
+
+    @staticmethod
+    def create(path, capacity):
+        """Create an empty, active buffer at ``path``.
+
+        The file is built under a temporary name and renamed into place, so
+        nobody ever sees a partially initialized buffer. Any existing buffer
+        at ``path`` is replaced.
+        """
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _ACTIVE, capacity, 0))
+            f.truncate(_HEADER.size + capacity)
+        os.rename(tmp, path)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def inode(self):
+        """Return the inode number of the buffer's file.
+
+        This lets the daemon notice when a buffer has been deleted and
+        re-created under the same name.
+        """
+        return os.fstat(self._file.fileno()).st_ino
+
+    @property
+    def position(self):
+        """The total number of bytes ever written to the buffer."""
+        return struct.unpack_from('<Q', self._map, _POSITION_OFFSET)[0]
+
+    @property
+    def active(self):
+        """Whether the console daemon should be logging to this buffer."""
+        flags = struct.unpack_from('<B', self._map, _FLAGS_OFFSET)[0]
+        return bool(flags & _ACTIVE)
+
+    @active.setter
+    def active(self, value):
+        flags = struct.unpack_from('<B', self._map, _FLAGS_OFFSET)[0]
+        if value:
+            flags |= _ACTIVE
+        else:
+            flags &= ~_ACTIVE
+        struct.pack_into('<B', self._map, _FLAGS_OFFSET, flags)
+
+    def write(self, data):
+        """Append ``data`` to the log, overwriting the oldest output."""
+        position = self.position
+        end = position + len(data)
+        if len(data) > self.capacity:
+            data = data[-self.capacity:]
+        start = end - len(data)
+
+        index = start % self.capacity
+        first = min(len(data), self.capacity - index)
+        self._map[_HEADER.size + index:_HEADER.size + index + first] = \
+            data[:first]
+        if first < len(data):
+            self._map[_HEADER.size:_HEADER.size + len(data) - first] = \
+                data[first:]
+        # Publish the new data only once it's in place:
+        struct.pack_into('<Q', self._map, _POSITION_OFFSET, end)
+
+    def read(self, offset=None):
+        """Read the log, starting at the absolute offset ``offset``.
+
+        If ``offset`` is None, or older than the oldest data still in the
+        buffer, reading starts with the oldest data. Returns a tuple
+        ``(data, end)``, where ``end`` is the offset just past ``data``.
+        """
+        _, end, chunks = self.read_chunks(offset)
+        return ''.join(chunks), end
+
+    def read_chunks(self, offset=None, tail=None, chunk_size=CHUNK_SIZE):
+        """Like ``read``, but return the data a chunk at a time.
+
+        If ``tail`` is not None, only (up to) the last ``tail`` bytes are
+        read. Returns a tuple ``(start, end, chunks)``, where ``chunks`` is
+        an iterator over strings of at most ``chunk_size`` bytes, which
+        together hold the log from offset ``start`` up to ``end``. The chunks
+        are copied out of the buffer as they are consumed, so only one is in
+        memory at a time.
+
+        Output written while the chunks are being consumed is not included.
+        If that output overwrites data not yet consumed, that data is
+        skipped.
+        """
+        end = self.position
+        start = max(end - self.capacity, 0)
+        if offset is not None:
+            start = min(max(start, offset), end)
+        if tail is not None:
+            start = max(start, end - tail)
+        return start, end, self._chunks(start, end, chunk_size)
+
+    def _chunks(self, start, end, chunk_size):
+        while start < end:
+            index = start % self.capacity
+            count = min(end - start, self.capacity - index, chunk_size)
+            data = self._map[_HEADER.size + index:
+                             _HEADER.size + index + count]
+            # The writer may have lapped us while we were copying, in which
+            # case the start of what we copied may be newer data; drop it.
+            oldest = self.position - self.capacity
+            if oldest > start:
+                data = data[oldest - start:]
+            if data:
+                yield data
+            start += count
+
+
+def strip_non_ascii(data):
+    """Return ``data`` with any non-ASCII bytes removed."""
+    return data.translate(None, _NON_ASCII)
+
+
+def open_buffer(path):
+    """Open the buffer at ``path``, or return None if it doesn't exist."""
+    try:
+        return RingBuffer(path)
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+
+
+def start_logging(path):
+    """Create the buffer at ``path`` if needed, and mark it active."""
+    buf = open_buffer(path)
+    if buf is None:
+        RingBuffer.create(path, buffer_size())
+        return
+    try:
+        buf.active = True
+    finally:
+        buf.close()
+
+
+def stop_logging(path):
+    """Mark the buffer at ``path`` (if any) inactive, keeping its contents."""
+    buf = open_buffer(path)
+    if buf is None:
+        return
+    try:
+        buf.active = False
+    finally:
+        buf.close()
+
+
+def read_log(path):
+    """Return the contents of the buffer at ``path``, or None if none."""
+    buf = open_buffer(path)
+    if buf is None:
+        return None
+    try:
+        return buf.read()[0]
+    finally:
+        buf.close()
+
+
+def read_log_chunks(path, offset=None, tail=None):
+    """Read the buffer at ``path`` a chunk at a time.
+
+    Returns None if there is no buffer, and otherwise the same as
+    ``RingBuffer.read_chunks``. The buffer is closed once the chunks have
+    been consumed.
+    """
+    buf = open_buffer(path)
+    if buf is None:
+        return None
+    start, end, chunks = buf.read_chunks(offset, tail)
+
+    def closing_chunks():
+        try:
+            for chunk in chunks:
+                yield chunk
+        finally:
+            buf.close()
+    return start, end, closing_chunks()
+
+
+def delete_log(path):
+    """Delete the buffer at ``path``, if it exists."""
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+class _Session(object):
+    """A console process, logging to a buffer."""
+
+    def __init__(self, path, commands):
+        self.path = path
+        self.commands = commands
+        self.buffer = RingBuffer(path)
+        self.inode = self.buffer.inode()
+        self.eof = False
+        # stdin is a pipe which is never written: given a terminal, console
+        # processes like ipmitool change its settings to behave like the
+        # remote tty, which garbles the output. close_fds keeps each session
+        # from holding the others' pipes open, which would hide their EOFs.
+        with open(os.devnull, 'w') as devnull:
+            self.proc = Popen(commands[0],
+                              stdin=PIPE,
+                              stdout=PIPE,
+                              stderr=devnull,
+                              close_fds=True)
+
+    def alive(self):
+        return not self.eof and self.proc.poll() is None
+
+    def current(self):
+        """Return True if our buffer is still the one at ``path``."""
+        try:
+            return os.stat(self.path).st_ino == self.inode
+        except OSError:
+            return False
+
+    def stop(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            self.proc.wait()
+        self.proc.stdin.close()
+        self.proc.stdout.close()
+        self.buffer.close()
+
+
+def _is_running(pid, program):
+    """Return True if process ``pid`` exists and is running ``program``.
+
+    Checking the program guards against the pid having been reused since
+    we recorded it. This relies on Linux's ``/proc``; elsewhere, it always
+    returns False.
+    """
+    try:
+        with open('/proc/%d/cmdline' % pid) as f:
+            argv = f.read().split('\0')
+    except IOError:
+        return False
+    return argv[0] == program
+
+
+class ConsoleManager(object):
+    """Owns the console processes, and copies their output to the buffers.
+
+    Sessions are keyed by the path of their buffer; see ``reconcile``.
+
+    If ``registry`` is not None, it is the path of a file in which the
+    manager records the process id of each session, so that a later manager
+    can clean up after this one if it dies; see ``recover``.
+
+    Cleanup commands (e.g. ``ipmitool sol deactivate``) may be slow, so
+    they are run in the background, at most ``cleanup_workers`` at once. A
+    session isn't (re)started until its cleanup has finished.
+    """
+
+    def __init__(self, registry=None, cleanup_workers=8):
+        self.sessions = {}
+        self.registry = registry
+        self._pool = ThreadPool(cleanup_workers)
+        self._lock = threading.Lock()
+        # Paths of the buffers whose sessions are being cleaned up:
+        self._cleaning = set()
+
+    def pids(self):
+        """Return a dict mapping buffer paths to console process ids."""
+        return dict((path, session.proc.pid)
+                    for path, session in self.sessions.items())
+
+    def cleaning(self):
+        """Return the set of paths whose cleanup commands are running."""
+        with self._lock:
+            return set(self._cleaning)
+
+    def recover(self):
+        """Stop the sessions left running by a previous manager.
+
+        Kills each of the processes listed in the registry which is still
+        running, and returns the list of all the paths in the registry: the
+        caller should pass the cleanup commands for these to
+        ``clean_up``. Sessions which weren't registered aren't touched.
+        """
+        if self.registry is None:
+            return []
+        try:
+            with open(self.registry) as f:
+                registry = json.load(f)
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return []
+            raise
+        for path, entry in registry.items():
+            if _is_running(entry['pid'], entry['program']):
+                logger.info('Stopping orphaned console session for %s '
+                            '(pid %d)', path, entry['pid'])
+                try:
+                    os.kill(entry['pid'], signal.SIGTERM)
+                except OSError as e:
+                    if e.errno != errno.ESRCH:
+                        raise
+        self._save_registry()
+        return [str(path) for path in registry]
+
+    def clean_up(self, commands):
+        """Run cleanup commands in the background.
+
+        ``commands`` is a dict mapping buffer paths to cleanup commands.
+        """
+        for path, command in commands.items():
+            with self._lock:
+                self._cleaning.add(path)
+            self._pool.apply_async(self._run_cleanup, (path, command))
+
+    def reconcile(self, wanted):
+        """Bring the running sessions in line with ``wanted``.
+
+        ``wanted`` is a dict mapping buffer paths to the commands for their
+        sessions, as returned by ``Obm.console_commands``. Sessions not
+        in ``wanted`` (or whose buffer or commands have changed) are
+        stopped, sessions which have died are restarted, and missing ones
+        are started.
+        """
+        before = self.pids()
+        for path, session in self.sessions.items():
+            if path in wanted and session.current() and \
+                    session.commands == wanted[path] and session.alive():
+                continue
+            if path in wanted and not session.alive():
+                logger.info('Console session for %s died; restarting', path)
+            self._stop(path)
+
+        cleaning = self.cleaning()
+        for path, commands in wanted.items():
+            if path not in self.sessions and path not in cleaning:
+                try:
+                    self.sessions[path] = _Session(path, commands)
+                except (IOError, OSError, ValueError):
+                    # Most likely the buffer was deleted in the meantime;
+                    # we'll try again on the next pass if not.
+                    logger.exception('Could not start console session for %s',
+                                     path)
+        if self.pids() != before:
+            self._save_registry()
+
+    def pump(self, timeout):
+        """Copy console output to the buffers for up to ``timeout`` seconds.
+
+        Returns early (after copying) once any output has arrived.
+        """
+        sessions = dict((session.proc.stdout.fileno(), session)
+                        for session in self.sessions.values()
+                        if not session.eof)
+        if not sessions:
+            time.sleep(timeout)
+            return
+        try:
+            ready, _, _ = select.select(sessions.keys(), [], [], timeout)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+        for fd in ready:
+            data = os.read(fd, 64 * 1024)
+            if data:
+                sessions[fd].buffer.write(data)
+            else:
+                sessions[fd].eof = True
+
+    def stop_all(self):
+        """Stop all sessions, and wait for their cleanup to finish.
+
+        The manager can't be used afterwards.
+        """
+        for path in self.sessions.keys():
+            self._stop(path)
+        self._save_registry()
+        self._pool.close()
+        self._pool.join()
+
+    def _stop(self, path):
+        session = self.sessions.pop(path)
+        session.stop()
+        if session.commands[1] is not None:
+            self.clean_up({path: session.commands[1]})
+
+    def _run_cleanup(self, path, command):
+        try:
+            with open(os.devnull, 'r+') as devnull:
+                call(command, stdin=devnull, stdout=devnull, stderr=devnull)
+        except Exception:
+            logger.exception('Error cleaning up console session for %s',
+                             path)
+        finally:
+            with self._lock:
+                self._cleaning.discard(path)
+
+    def _save_registry(self):
+        if self.registry is None:
+            return
+        registry = dict((path, {'pid': session.proc.pid,
+                                'program': session.commands[0][0]})
+                        for path, session in self.sessions.items())
+        tmp = '%s.%d.tmp' % (self.registry, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(registry, f)
+        os.rename(tmp, self.registry)
+
+
+def wanted_sessions():
+    """Return the sessions the console daemon should be running.
+
+    The result is in the form expected by ``ConsoleManager.reconcile``:
+    every obm which supports console logging and has an active buffer.
+    """
+    from hil import model
+    wanted = {}
+    for obm in model.db.session.query(model.polymorphic(model.Obm)):
+        commands = obm.console_commands()
+        if commands is None:
+            continue
+        path = obm.get_console_log_filename()
+        try:
+            buf = open_buffer(path)
+        except ValueError:
+            logger.warning('Ignoring invalid console log %s', path)
+            continue
+        if buf is None:
+            continue
+        try:
+            if buf.active:
+                wanted[path] = commands
+        finally:
+            buf.close()
+    # Don't hold a transaction open while we sleep:
+    model.db.session.rollback()
+    return wanted
+
+
+def cleanup_commands(paths):
+    """Return the cleanup commands for the sessions logging to ``paths``.
+
+    The result is in the form expected by ``ConsoleManager.clean_up``.
+    Paths which don't belong to any obm (e.g. because its node has been
+    deleted) are left out.
+    """
+    from hil import model
+    paths = set(paths)
+    commands = {}
+    for obm in model.db.session.query(model.polymorphic(model.Obm)):
+        console_commands = obm.console_commands()
+        if console_commands is None or console_commands[1] is None:
+            continue
+        path = obm.get_console_log_filename()
+        if path in paths:
+            commands[path] = console_commands[1]
+    model.db.session.rollback()
+    return commands
+
+
+def serve(sleep_time, cleanup_workers=8):
+    """Run the console daemon; never returns.
+
+    On startup, the sessions left behind by a previous daemon (if it died
+    uncleanly) are stopped, with their cleanup commands running in the
+    background.
+
+    Every ``sleep_time`` seconds the running sessions are reconciled with
+    the database and the buffers (so that's how long it can take for
+    ``start_console`` etc. to take effect, and for a dead session to be
+    restarted). In between, console output is copied to the buffers.
+    """
+    manager = ConsoleManager(registry=os.path.join(log_dir(), REGISTRY),
+                             cleanup_workers=cleanup_workers)
+    manager.clean_up(cleanup_commands(manager.recover()))
+    try:
+        while True:
+            manager.reconcile(wanted_sessions())
+            deadline = time.time() + sleep_time
+            while time.time() < deadline:
+                manager.pump(max(deadline - time.time(), 0))
+    finally:
+        manager.stop_all()
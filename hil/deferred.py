@@ -91,6 +91,10 @@ def apply_networking():
     """
     # Get the journal enries
     actions = model.NetworkingAction.query \
+        .options(db.joinedload('nic').joinedload('port')
+                 .joinedload(model.Port.owner.of_type(
+                     model.polymorphic(model.Switch))),
+                 db.joinedload('new_network')) \
         .order_by(model.NetworkingAction.id).all()
 
     if actions == []:
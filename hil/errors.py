@@ -104,5 +104,30 @@ class IllegalStateError(APIError):
     status_code = 409  # Conflict
 
 
+class BulkError(APIError):
+    """An exception indicating that some items of a bulk request are invalid.
+
+    `errors` is a list of ``(item, error)`` pairs, where `item` names an
+    invalid item (e.g. a node) and `error` is the APIError describing what
+    is wrong with it. As well as the usual keys, the body of the response
+    has the key ``errors``: a list of objects with the keys ``item``,
+    ``type`` and ``msg``, one per pair.
+    """
+
+    def __init__(self, message='', errors=()):
+        APIError.__init__(self, message)
+        self.errors = list(errors)
+
+    def get_response(self, environ):
+        return flask.make_response(json.dumps({
+            'type': self.__class__.__name__,
+            'msg': self.message,
+            'errors': [{'item': item,
+                        'type': error.__class__.__name__,
+                        'msg': error.message}
+                       for item, error in self.errors],
+        }), self.status_code)
+
+
 class OBMError(ServerError):
     """An error occured communicating with the OBM for a node."""
@@ -1,19 +1,37 @@
 """Auth plugin using usernames & passwords in the DB, with HTTP basic auth.
 
 Includes API calls for managing users.
+
+Verifying a password is deliberately slow, so successful verifications are
+cached for a short time (see `CredentialCache`). Clients making many calls
+can also exchange their password for a short-lived bearer token (see
+`auth_token`), which is cheap to check.
 """
 from hil import api, model, auth
 from hil.model import db
 from hil.auth import get_auth_backend
+from hil.config import cfg
 from hil.rest import rest_call, local, ContextLogger
 from hil.errors import *
 from passlib.hash import sha512_crypt
 from schema import Schema, Optional
+from collections import OrderedDict
+import base64
 import flask
+import hashlib
+import hmac
+import json
 import logging
+import os
+import threading
+import time
 
 logger = ContextLogger(logging.getLogger(__name__), {})
 
+DEFAULT_CREDENTIAL_CACHE_TTL = 60
+DEFAULT_CREDENTIAL_CACHE_SIZE = 1024
+DEFAULT_TOKEN_TTL = 3600
+
 
 class User(db.Model):
     """A user of the HIL.
@@ -41,12 +59,190 @@ class User(db.Model):
         self.set_password(password)
 
     def verify_password(self, password):
-        """Return whether `password` is the user's (plaintext) password."""
-        return sha512_crypt.verify(password, self.hashed_password)
+        """Return whether `password` is the user's (plaintext) password.
+
+        Successful verifications are remembered by `credentials`, so
+        repeating one is cheap.
+        """
+        if credentials.check(self, password):
+            return True
+        if sha512_crypt.verify(password, self.hashed_password):
+            credentials.add(self, password)
+            return True
+        return False
 
     def set_password(self, password):
         """Set the user's password to `password` (which must be plaintext)."""
         self.hashed_password = sha512_crypt.encrypt(password)
+        credentials.invalidate(self.label)
+
+
+class CredentialCache(object):
+    """A cache of recently verified passwords.
+
+    Entries are keyed by the user's name and a keyed hash of the password,
+    where the key is random and private to the process; the password itself
+    is never stored. Each entry records the user's hashed password at the
+    time, and is only valid while that is unchanged, so a password changed
+    by another process invalidates it too.
+
+    Entries expire after ``credential_cache_ttl`` seconds (default 60), and
+    at most ``credential_cache_size`` (default 1024) are kept, evicting the
+    least recently used. Both are options in the ``[hil.ext.auth.database]``
+    section of ``hil.cfg``; a TTL of 0 disables the cache.
+
+    Safe to use from multiple threads.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._secret = os.urandom(32)
+
+    def _key(self, user, password):
+        if isinstance(password, unicode):
+            password = password.encode('utf-8')
+        return (user.label,
+                hmac.new(self._secret, password, hashlib.sha256).digest())
+
+    @staticmethod
+    def _option(name, default):
+        section = 'hil.ext.auth.database'
+        if cfg.has_option(section, name):
+            return cfg.getfloat(section, name)
+        return default
+
+    def check(self, user, password):
+        """Return whether `password` was recently verified for `user`."""
+        key = self._key(user, password)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return False
+            expires, hashed_password = entry
+            if expires < time.time() or \
+                    hashed_password != user.hashed_password:
+                return False
+            # Re-insert the entry, to mark it as recently used:
+            self._entries[key] = entry
+            return True
+
+    def add(self, user, password):
+        """Record that `password` has been verified for `user`."""
+        ttl = self._option('credential_cache_ttl',
+                           DEFAULT_CREDENTIAL_CACHE_TTL)
+        size = self._option('credential_cache_size',
+                            DEFAULT_CREDENTIAL_CACHE_SIZE)
+        if ttl <= 0 or size <= 0:
+            return
+        key = self._key(user, password)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + ttl, user.hashed_password)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username):
+        """Forget all of the passwords verified for the user `username`."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == username]:
+                del self._entries[key]
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+
+
+credentials = CredentialCache()
+
+
+class TokenSigner(object):
+    """Issues and checks signed bearer tokens.
+
+    A token is ``<payload>.<signature>``, both URL-safe base64. The payload
+    is a JSON object giving the user's id (``user``), whether they are an
+    admin (``admin``), the time at which the token expires (``expires``,
+    seconds since the epoch) and a fingerprint of the user's hashed
+    password (``password``); the signature is an HMAC-SHA256 of the
+    payload. A token is only accepted while the user still exists and its
+    admin flag and password fingerprint are still current, so changing a
+    user's password or admin status, or deleting them, revokes their
+    tokens.
+
+    The key is the ``token_secret`` option in the
+    ``[hil.ext.auth.database]`` section of ``hil.cfg``. If that is unset, a
+    random key is used, which is private to the process (and the workers
+    forked from it; see ``hil.prefork``); in that case, tokens are only
+    accepted by the server which issued them, and only until it restarts.
+    Tokens are valid for ``token_ttl`` seconds (default 3600).
+    """
+
+    def __init__(self):
+        self._random_secret = os.urandom(32)
+
+    def _secret(self):
+        if cfg.has_option('hil.ext.auth.database', 'token_secret'):
+            return cfg.get('hil.ext.auth.database', 'token_secret')
+        return self._random_secret
+
+    def _mac(self, data):
+        return hmac.new(self._secret(), data, hashlib.sha256).digest()
+
+    def _password_fingerprint(self, user):
+        return base64.urlsafe_b64encode(
+            self._mac(user.hashed_password.encode('utf-8'))[:12])
+
+    def ttl(self):
+        """Return the number of seconds for which new tokens are valid."""
+        if cfg.has_option('hil.ext.auth.database', 'token_ttl'):
+            return cfg.getint('hil.ext.auth.database', 'token_ttl')
+        return DEFAULT_TOKEN_TTL
+
+    def issue(self, user):
+        """Return a new token for `user`, and the time it expires."""
+        expires = int(time.time()) + self.ttl()
+        payload = base64.urlsafe_b64encode(json.dumps({
+            'user': user.id,
+            'admin': user.is_admin,
+            'expires': expires,
+            'password': self._password_fingerprint(user),
+        }))
+        signature = base64.urlsafe_b64encode(self._mac(payload))
+        return payload + '.' + signature, expires
+
+    def check(self, token):
+        """Return the user whose (valid) token is `token`.
+
+        Returns None if the token is invalid, expired or revoked.
+        """
+        if isinstance(token, unicode):
+            try:
+                token = token.encode('ascii')
+            except UnicodeEncodeError:
+                return None
+        payload, _, signature = token.partition('.')
+        expected = base64.urlsafe_b64encode(self._mac(payload))
+        if not hmac.compare_digest(signature, expected):
+            return None
+        try:
+            claims = json.loads(base64.urlsafe_b64decode(payload))
+            user_id = claims['user']
+            is_admin = claims['admin']
+            expires = claims['expires']
+            fingerprint = claims['password']
+        except (TypeError, ValueError, KeyError):
+            return None
+        if expires < time.time():
+            return None
+        user = User.query.get(user_id)
+        if user is None or user.is_admin != is_admin or \
+                fingerprint != self._password_fingerprint(user):
+            return None
+        return user
+
+
+tokens = TokenSigner()
 
 
 # A joining table for users and projects, which have a many to many
@@ -60,7 +256,7 @@ user_projects = db.Table('user_projects',
     'user': basestring,
     'password': basestring,
     Optional('is_admin'): bool,
-}), dont_log=('password',))
+}), dont_log=('password',), batch=True)
 def user_create(user, password, is_admin=False):
     """Create user with given password.
 
@@ -77,7 +273,8 @@ def user_create(user, password, is_admin=False):
     db.session.commit()
 
 
-@rest_call('DELETE', '/auth/basic/user/<user>', Schema({'user': basestring}))
+@rest_call('DELETE', '/auth/basic/user/<user>', Schema({'user': basestring}),
+           batch=True)
 def user_delete(user):
     """Delete user.
 
@@ -89,6 +286,7 @@ def user_delete(user):
     # hil.api:
     user = api._must_find(User, user)
 
+    credentials.invalidate(user.label)
     db.session.delete(user)
     db.session.commit()
 
@@ -96,7 +294,7 @@ def user_delete(user):
 @rest_call('POST', '/auth/basic/user/<user>/add_project', Schema({
     'user': basestring,
     'project': basestring,
-}))
+}), batch=True)
 def user_add_project(user, project):
     """Add a user to a project.
 
@@ -115,7 +313,7 @@ def user_add_project(user, project):
 @rest_call('POST', '/auth/basic/user/<user>/remove_project', Schema({
     'user': basestring,
     'project': basestring,
-}))
+}), batch=True)
 def user_remove_project(user, project):
     """Remove a user from a project.
 
@@ -134,20 +332,42 @@ def user_remove_project(user, project):
 @rest_call('PATCH', '/auth/basic/user/<user>', Schema({
     'user': basestring,
     'is_admin': bool,
-}))
+}), batch=True)
 def user_set_admin(user, is_admin):
     get_auth_backend().require_admin()
     user = api._must_find(User, user)
     if user.label == local.auth.label:
         raise IllegalStateError("Cannot set own admin status")
     user.is_admin = is_admin
+    credentials.invalidate(user.label)
     db.session.commit()
 
 
+@rest_call('POST', '/auth/token', Schema({}))
+def auth_token():
+    """Issue a bearer token for the authenticated user.
+
+    The token may be used instead of the user's password, by sending the
+    header ``Authorization: Bearer <token>``, until it expires (see
+    `TokenSigner`). Returns a JSON object with the keys ``token`` and
+    ``expires``.
+    """
+    user = local.auth
+    if user is None:
+        raise AuthorizationError("Authentication is required to obtain "
+                                 "a token.")
+    token, expires = tokens.issue(user)
+    return json.dumps({'token': token, 'expires': expires})
+
+
 class DatabaseAuthBackend(auth.AuthBackend):
 
     def authenticate(self):
         local.auth = None
+        scheme, _, token = flask.request.headers.get('Authorization', '') \
+            .partition(' ')
+        if scheme.lower() == 'bearer':
+            return self._authenticate_token(token.strip())
         if flask.request.authorization is None:
             return False
         authorization = flask.request.authorization
@@ -163,13 +383,50 @@ class DatabaseAuthBackend(auth.AuthBackend):
             logger.info("Failed authentication for user %r", user.label)
             return False
 
+    def _authenticate_token(self, token):
+        user = tokens.check(token)
+        if user is None:
+            logger.info("Failed authentication with a bearer token")
+
+            # Tell clients that the token itself was rejected (as in RFC
+            # 6750), rather than the call, so they know to get a new one:
+            @flask.after_this_request
+            def mark_invalid_token(response):
+                if response.status_code == 401:
+                    response.headers['WWW-Authenticate'] = \
+                        'Bearer error="invalid_token"'
+                return response
+            return False
+        local.auth = user
+        logger.info("Successful token authentication for user %r",
+                    user.label)
+        return True
+
     def _have_admin(self):
         user = local.auth
         return user is not None and user.is_admin
 
     def _have_project_access(self, project):
+        return project.id in self.context().project_ids
+
+    def _make_context(self):
         user = local.auth
-        return user is not None and project in user.projects
+        if user is None:
+            return auth.AuthContext(admin=False, project_ids=frozenset())
+        # Fetch just the ids, rather than loading the user's projects:
+        project_ids = db.session.query(user_projects.c.project_id) \
+            .filter(user_projects.c.user_id == user.id)
+        return auth.AuthContext(
+            admin=user.is_admin,
+            project_ids=frozenset(row.project_id for row in project_ids))
+
+    def scope(self):
+        if local.auth is None:
+            return 'anonymous'
+        context = self.context()
+        return (local.auth.id,
+                context.admin,
+                tuple(sorted(context.project_ids)))
 
 
 def setup(*args, **kwargs):
@@ -1,10 +1,16 @@
 """Keystone authentication backend.
 
 This is a thin wrapper around the `keystonemiddleware` library.
+
+The labels of the projects registered with HIL are cached in memory (see
+``hil.cache.LabelSet``), and keystonemiddleware can cache validated tokens
+in memcached (see ``docs/keystone-auth.md``), so that most requests need
+neither a query for the caller's project nor a round trip to keystone.
 """
 from keystonemiddleware.auth_token import filter_factory
 from flask import request
 from hil.flaskapp import app
+from hil.cache import LabelSet
 from hil.config import cfg
 from hil.model import Project
 from hil import auth, rest
@@ -13,6 +19,9 @@ import sys
 
 logger = rest.ContextLogger(logging.getLogger(__name__), {})
 
+# The labels of the projects registered with HIL:
+registered_projects = LabelSet(Project)
+
 
 class KeystoneAuthBackend(auth.AuthBackend):
 
@@ -35,7 +44,7 @@ class KeystoneAuthBackend(auth.AuthBackend):
             return True
 
         project_id = request.environ['HTTP_X_PROJECT_ID']
-        if Project.query.filter_by(label=project_id).count() == 0:
+        if project_id not in registered_projects:
             logger.info("Successful authentication by Openstack project %r, "
                         "but this project is not registered with HIL",
                         project_id)
@@ -49,6 +58,11 @@ class KeystoneAuthBackend(auth.AuthBackend):
     def _have_admin(self):
         return 'admin' in request.environ['HTTP_X_ROLES'].split(',')
 
+    def scope(self):
+        if self._have_admin():
+            return 'admin'
+        return ('project', request.environ['HTTP_X_PROJECT_ID'])
+
 
 def setup(*args, **kwargs):
     if not cfg.has_section(__name__):
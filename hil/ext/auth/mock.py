@@ -46,12 +46,19 @@ class MockAuthBackend(auth.AuthBackend):
     def _have_project_access(self, project):
         return project == rest.local.auth['project']
 
+    def scope(self):
+        project = rest.local.auth['project']
+        return (rest.local.auth['admin'],
+                None if project is None else project.label)
+
     def set_project(self, project):
         """Change the project that the request is acting on behalf of."""
         rest.local.auth['project'] = project
+        self.reset_context()
 
     def set_admin(self, admin):
         rest.local.auth['admin'] = admin
+        self.reset_context()
 
     def set_user(self, user):
         rest.local.auth['user'] = user
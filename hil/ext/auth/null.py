@@ -22,6 +22,9 @@ class NullAuthBackend(auth.AuthBackend):
     def _have_project_access(self, project):
         return True
 
+    def scope(self):
+        return 'admin'
+
 
 def setup(*args, **kwargs):
     auth.set_auth_backend(NullAuthBackend())
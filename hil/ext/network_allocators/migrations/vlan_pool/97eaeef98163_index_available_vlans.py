@@ -0,0 +1,29 @@
+"""Index the vlan table by availability
+
+``VlanAllocator.get_new_network_id`` looks for an available VLAN each time a
+network is created.
+
+Revision ID: 97eaeef98163
+Revises:
+Create Date: 2026-10-19 11:02:37.514206
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from hil.model import db
+from hil.flaskapp import app
+
+# revision identifiers, used by Alembic.
+revision = '97eaeef98163'
+down_revision = None
+branch_labels = ('hil.ext.network_allocators.vlan_pool',)
+
+
+def upgrade():
+    metadata = sa.MetaData(bind=db.get_engine(app), reflect=True)
+    if 'vlan' in metadata.tables:
+        op.create_index('ix_vlan_available', 'vlan', ['available'])
+
+
+def downgrade():
+    op.drop_index('ix_vlan_available', table_name='vlan')
@@ -1,11 +1,15 @@
 """VLAN based ``network_allocator`` implementation."""
 
 import logging
+from os.path import dirname, join
 
 from hil.network_allocator import NetworkAllocator, set_network_allocator
+from hil.migrations import paths
 from hil.model import db
 from hil.config import cfg
 
+paths[__name__] = join(dirname(__file__), 'migrations', 'vlan_pool')
+
 
 def get_vlan_list():
     """Return a list of vlans in the module's config section.
@@ -82,7 +86,7 @@ class Vlan(db.Model):
     """
     id = db.Column(db.Integer, primary_key=True)
     vlan_no = db.Column(db.Integer, nullable=False, unique=True)
-    available = db.Column(db.Boolean, nullable=False)
+    available = db.Column(db.Boolean, nullable=False, index=True)
 
     def __init__(self, vlan_no):
         self.vlan_no = vlan_no
@@ -17,6 +17,7 @@
 import schema
 import logging
 
+from hil import consoles
 from hil.model import db, Obm
 from hil.errors import OBMError, BadArgumentError
 from hil.dev_support import no_dry_run
@@ -47,30 +48,59 @@ class Ipmi(Obm):
             'password': basestring,
             }).validate(kwargs)
 
-    def _ipmitool(self, args):
-        """Invoke ipmitool with the right host/pass etc. for this node.
+    def _ipmitool_args(self, args):
+        """Return the command line for invoking ipmitool on this node.
 
         `args`- A list of any additional arguments to pass to ipmitool.
-        Returns the exit status of ipmitool.
 
         Note: Includes the ``-I lanplus`` flag, available only in IPMI v2+.
         This is needed for machines which do not accept the older version.
         """
-        status = call(['ipmitool',
-                       '-I', 'lanplus',  # see docstring above
-                       '-U', self.user,
-                       '-P', self.password,
-                       '-H', self.host] + args)
+        return ['ipmitool',
+                '-I', 'lanplus',  # see docstring above
+                '-U', self.user,
+                '-P', self.password,
+                '-H', self.host] + args
+
+    def _ipmitool(self, args):
+        """Invoke ipmitool with the right host/pass etc. for this node.
+
+        `args`- A list of any additional arguments to pass to ipmitool.
+        Returns the exit status of ipmitool.
+        """
+        status = call(self._ipmitool_args(args))
 
         if status != 0:
             logger = logging.getLogger(__name__)
             logger.info('Nonzero exit status form ipmitool, args = %r', args)
         return status
 
+    def _ipmitool_batch(self, commands):
+        """Run several ipmitool commands in a single invocation.
+
+        `commands`- A list of commands, each a list of arguments as would be
+        passed to `_ipmitool`.
+
+        The commands are fed to ipmitool's ``exec`` mode over stdin, so they
+        all share one session with the BMC, rather than each paying for the
+        (slow) session setup. As with ``exec``, the commands are all run
+        regardless of failures, and the exit status is that of the last one.
+        """
+        proc = Popen(self._ipmitool_args(['exec', '/dev/stdin']),
+                     stdin=PIPE)
+        proc.communicate(''.join(' '.join(command) + '\n'
+                                 for command in commands))
+
+        if proc.returncode != 0:
+            logger = logging.getLogger(__name__)
+            logger.info('Nonzero exit status form ipmitool, commands = %r',
+                        commands)
+        return proc.returncode
+
     @no_dry_run
     def power_cycle(self):
-        self._ipmitool(['chassis', 'bootdev', 'pxe'])
-        if self._ipmitool(['chassis', 'power', 'cycle']) == 0:
+        if self._ipmitool_batch([['chassis', 'bootdev', 'pxe'],
+                                 ['chassis', 'power', 'cycle']]) == 0:
             return
         if self._ipmitool(['chassis', 'power', 'on']) == 0:
             # power cycle will fail if the machine is not running.
@@ -78,14 +108,30 @@ class Ipmi(Obm):
             # Doing this saves power by turning things off without
             # Without breaking the HIL.
             return
-        # If it is still does not work, then it is a real error:
-        raise OBMError('Could not power cycle node %s' % self.node.label)
+        # If it is still does not work, then it is a real error. (``node`` is
+        # a backref, and so a list, even though an obm has only one node):
+        raise OBMError('Could not power cycle node %s' % self.node[0].label)
 
     @no_dry_run
     def power_off(self):
         if self._ipmitool(['chassis', 'power', 'off']) != 0:
             raise OBMError('Could not power off node %s', self.label)
 
+    @no_dry_run
+    def power_status(self):
+        proc = Popen(self._ipmitool_args(['chassis', 'power', 'status']),
+                     stdout=PIPE)
+        output = proc.communicate()[0]
+        # The output looks like "Chassis Power is on":
+        words = output.split()
+        if proc.returncode == 0 and words[-1:] in (['on'], ['off']):
+            return words[-1]
+        logger = logging.getLogger(__name__)
+        logger.info('Could not read power status from ipmitool, output = %r',
+                    output)
+        raise OBMError('Could not read power status of node %s' %
+                       self.node[0].label)
+
     def require_legal_bootdev(self, dev):
         if dev not in self.valid_bootdevices:
             raise BadArgumentError('Invald boot device')
@@ -97,51 +143,45 @@ class Ipmi(Obm):
                           'options=persistent']) != 0:
             raise OBMError('Could not set boot device')
 
+    def console_commands(self):
+        # The console daemon runs ``sol activate``, and afterwards ``sol
+        # deactivate``, so the BMC doesn't hang on to the session.
+        return (self._ipmitool_args(['sol', 'activate']),
+                self._ipmitool_args(['sol', 'deactivate']))
+
     @no_dry_run
     def start_console(self):
-        """Starts logging the IPMI console."""
-
-        # stdin and stderr are redirected to a PIPE that is never read in order
-        # to prevent stdout from becoming garbled.  This happens because
-        # ipmitool sets shell settings to behave like a tty when communicateing
-        # over Serial over Lan
-        Popen(
-            ['ipmitool',
-             '-H', self.host,
-             '-U', self.user,
-             '-P', self.password,
-             '-I', 'lanplus',
-             'sol', 'activate'],
-            stdin=PIPE,
-            stdout=open(self.get_console_log_filename(), 'a'),
-            stderr=PIPE)
-
-    # stdin, stdout, and stderr are redirected to a pipe that is never read
-    # because we are not interested in the ouput of this command.
+        """Starts logging the IPMI console.
+
+        The console daemon (``hil serve_consoles``) does the actual logging;
+        see ``hil.consoles``.
+        """
+        consoles.start_logging(self.get_console_log_filename())
+
     @no_dry_run
     def stop_console(self):
-        call(['pkill', '-f', 'ipmitool -H %s' % self.host])
-        proc = Popen(
-            ['ipmitool',
-             '-H', self.host,
-             '-U', self.user,
-             '-P', self.password,
-             '-I', 'lanplus',
-             'sol', 'deactivate'],
-            stdin=PIPE,
-            stdout=PIPE,
-            stderr=PIPE)
-        proc.wait()
+        consoles.stop_logging(self.get_console_log_filename())
 
     def delete_console(self):
-        if os.path.isfile(self.get_console_log_filename()):
-            os.remove(self.get_console_log_filename())
+        consoles.delete_log(self.get_console_log_filename())
 
     def get_console(self):
-        if not os.path.isfile(self.get_console_log_filename()):
+        log = consoles.read_log(self.get_console_log_filename())
+        if log is None:
             return None
-        with open(self.get_console_log_filename(), 'r') as log:
-            return "".join(i for i in log.read() if ord(i) < 128)
+        return consoles.strip_non_ascii(log)
+
+    def get_console_range(self, offset=None, tail=None):
+        log = consoles.read_log_chunks(self.get_console_log_filename(),
+                                       offset, tail)
+        if log is None:
+            return None
+        start, end, chunks = log
+        return (consoles.strip_non_ascii(chunk) for chunk in chunks), \
+            start, end
 
     def get_console_log_filename(self):
-        return '/var/run/hil_console_logs/%s.log' % self.host
+        return os.path.join(consoles.log_dir(), '%s.log' % self.host)
+
+    def concurrency_key(self):
+        return self.host
@@ -0,0 +1,24 @@
+"""Add the simulated power state of mock obms
+
+Revision ID: 3f1a6c2d8e5b
+Revises: df8d9f423f2b
+Create Date: 2017-08-07 11:42:17.305912
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1a6c2d8e5b'
+down_revision = 'df8d9f423f2b'
+branch_labels = None
+
+
+def upgrade():
+    op.add_column('mock_obm', sa.Column('power', sa.String(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('mock_obm', 'power')
@@ -31,6 +31,9 @@ class MockObm(Obm):
     host = Column(String, nullable=False)
     user = Column(String, nullable=False)
     password = Column(String, nullable=False)
+    # The simulated power state; None until the node is first powered on
+    # or off, which means 'off':
+    power = Column(String, nullable=True)
 
     api_name = 'http://schema.massopencloud.org/haas/v0/obm/mock'
 
@@ -49,11 +52,14 @@ class MockObm(Obm):
 
     @no_dry_run
     def power_cycle(self):
-        return
+        self.power = 'on'
 
     @no_dry_run
     def power_off(self):
-        return
+        self.power = 'off'
+
+    def power_status(self):
+        return self.power or 'off'
 
     def require_legal_bootdev(self, dev):
         return
@@ -80,3 +86,6 @@ class MockObm(Obm):
     @no_dry_run
     def get_console_log_filename(self):
         return
+
+    def concurrency_key(self):
+        return self.host
@@ -15,7 +15,12 @@
 
 from abc import ABCMeta, abstractmethod
 from hil.model import Port, NetworkAttachment
+from hil.ext.switches import _transcript
+import os
+import pexpect
 import re
+import time
+import uuid
 from hil.config import cfg
 
 _CHANNEL_RE = re.compile(r'vlan/(\d+)')
@@ -137,6 +142,42 @@ class Session(object):
             self.console.sendline('terminal length 40')
 
 
+class _Console(pexpect.spawn):
+    """A pexpect spawn object which may be recording a transcript.
+
+    If ``transcript`` is set, it is closed along with the console (which
+    pexpect also does when the console is garbage collected).
+    """
+
+    transcript = None
+
+    def close(self, *args, **kwargs):
+        try:
+            super(_Console, self).close(*args, **kwargs)
+        finally:
+            if self.transcript is not None:
+                self.transcript.close()
+
+
+def spawn(switch, command):
+    """Spawn ``command`` to talk to ``switch``'s console.
+
+    If the option ``switch_transcripts`` in the ``[devel]`` section is set,
+    the session is recorded to a transcript file in that directory; see
+    ``hil.ext.switches._transcript``. The file is closed when the console
+    is.
+    """
+    console = _Console(command)
+    if cfg.has_option('devel', 'switch_transcripts'):
+        filename = os.path.join(cfg.get('devel', 'switch_transcripts'),
+                                '%s-%d-%s.jsonl' % (switch.label,
+                                                    time.time(),
+                                                    uuid.uuid4().hex))
+        console.transcript = open(filename, 'w')
+        _transcript.record(console, console.transcript)
+    return console
+
+
 def get_prompts(console):
         # Regex to handle different prompt at switch
         # [\r\n]+ will handle any newline
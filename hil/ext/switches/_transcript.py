@@ -0,0 +1,146 @@
+# Copyright 2017 Massachusetts Open Cloud Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the
+# License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS
+# IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.  See the License for the specific language
+# governing permissions and limitations under the License.
+"""Record and replay pexpect sessions with switch consoles.
+
+A transcript is a file with one JSON object per line. Each object has a
+single key, either ``"recv"`` (a chunk of output read from the switch) or
+``"send"`` (a string we sent to the switch), in the order they happened.
+
+Chunk boundaries are preserved: several of the drivers use greedy patterns
+(e.g. ``'Port: .*'``), whose matches depend on how much output had arrived
+when ``expect`` ran, so replaying a transcript must hand the driver exactly
+the same chunks the switch did.
+
+Transcripts are recorded by setting ``switch_transcripts`` in the
+``[devel]`` section of ``hil.cfg`` to a directory; see ``record`` and
+``hil.ext.switches._console.spawn``. They are replayed with
+``ReplayConsole``, which can stand in for the console of any of the
+telnet-based drivers.
+"""
+
+import json
+import pexpect
+
+
+class _Channel(object):
+    """A file-like object for pexpect's ``logfile_read``/``logfile_send``.
+
+    Everything written to it is recorded in ``transcript`` as an event of
+    type ``direction``.
+    """
+
+    def __init__(self, transcript, direction):
+        self.transcript = transcript
+        self.direction = direction
+
+    def write(self, data):
+        self.transcript.write(json.dumps({self.direction: data}) + '\n')
+
+    def flush(self):
+        self.transcript.flush()
+
+
+def record(console, transcript):
+    """Record the session on pexpect ``console`` to ``transcript``.
+
+    ``transcript`` must be a file-like object opened for writing.
+    """
+    console.logfile_read = _Channel(transcript, 'recv')
+    console.logfile_send = _Channel(transcript, 'send')
+
+
+def load(transcript):
+    """Read a transcript from the file-like object ``transcript``.
+
+    Returns a list of ``(direction, data)`` pairs.
+    """
+    events = []
+    for line in transcript:
+        line = line.strip()
+        if not line:
+            continue
+        [(direction, data)] = json.loads(line).items()
+        # pexpect works with byte strings; json gives us back unicode.
+        events.append((str(direction), data.encode('utf-8')))
+    return events
+
+
+class TranscriptMismatch(Exception):
+    """Raised by a strict ``ReplayConsole`` when a driver sends something
+    other than what was recorded.
+    """
+
+
+class ReplayConsole(pexpect.spawn):
+    """A fake pexpect spawn object which replays a transcript.
+
+    ``events`` is a list as returned by ``load``. Reads return the recorded
+    chunks in order, regardless of what is sent; once they are exhausted,
+    reads raise ``pexpect.EOF``, as they would for a closed telnet session.
+
+    Everything sent is appended to ``sent``. If ``strict`` is True, each send
+    must match the next recorded one, or ``TranscriptMismatch`` is raised.
+    """
+
+    def __init__(self, events, strict=False):
+        # Passing ``None`` as the command gives us a spawn object without
+        # a child process; we supply the I/O ourselves. There's no point in
+        # timing out, since reads never block: the end of the transcript
+        # shows up as EOF instead.
+        pexpect.spawn.__init__(self, None, timeout=None)
+        self.name = '<replay>'
+        self.strict = strict
+        self.sent = []
+        self._recv = [data for (direction, data) in events
+                      if direction == 'recv']
+        self._send = [data for (direction, data) in events
+                      if direction == 'send']
+        self._recv_pos = 0
+        self._send_pos = 0
+
+    def read_nonblocking(self, size=1, timeout=-1):
+        if self._recv_pos == len(self._recv):
+            self.flag_eof = True
+            raise pexpect.EOF('End of transcript.')
+        data = self._recv[self._recv_pos]
+        self._recv_pos += 1
+        if self.logfile_read is not None:
+            self.logfile_read.write(data)
+            self.logfile_read.flush()
+        return data
+
+    def send(self, s):
+        # Unlike pexpect.spawn.send, don't sleep for ``delaybeforesend``;
+        # there's nobody on the other end to wait for.
+        s = self._coerce_send_string(s)
+        if self.strict:
+            if self._send_pos == len(self._send):
+                raise TranscriptMismatch('Unexpected send: %r' % s)
+            expected = self._send[self._send_pos]
+            if s != expected:
+                raise TranscriptMismatch('Expected to send %r, but sent %r'
+                                         % (expected, s))
+        self._send_pos += 1
+        self.sent.append(s)
+        if self.logfile_send is not None:
+            self.logfile_send.write(s)
+            self.logfile_send.flush()
+        return len(s)
+
+    def isalive(self):
+        return self._recv_pos < len(self._recv)
+
+    def remaining(self):
+        """Return the number of recorded chunks not yet read."""
+        return len(self._recv) - self._recv_pos
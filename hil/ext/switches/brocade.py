@@ -18,10 +18,8 @@ Uses the XML REST API for communicating with the switch.
 """
 
 import logging
-from lxml import etree
 from os.path import dirname, join
 import re
-import requests
 import schema
 
 from hil.migrations import paths
@@ -126,7 +124,7 @@ class Brocade(Switch):
         """
         url = self._construct_url(interface, suffix='mode')
         response = self._make_request('GET', url)
-        root = etree.fromstring(response.text)
+        root = self._parse(response)
         mode = root.find(self._construct_tag('vlan-mode')).text
         return mode
 
@@ -168,7 +166,7 @@ class Brocade(Switch):
         try:
             url = self._construct_url(interface, suffix='trunk')
             response = self._make_request('GET', url)
-            root = etree.fromstring(response.text)
+            root = self._parse(response)
             vlans = root.\
                 find(self._construct_tag('allowed')).\
                 find(self._construct_tag('vlan')).\
@@ -188,7 +186,7 @@ class Brocade(Switch):
         try:
             url = self._construct_url(interface, suffix='trunk')
             response = self._make_request('GET', url)
-            root = etree.fromstring(response.text)
+            root = self._parse(response)
             vlan = root.find(self._construct_tag('native-vlan')).text
             return ('vlan/native', vlan)
         except AttributeError:
@@ -227,6 +225,7 @@ class Brocade(Switch):
         """
         url = self._construct_url(interface, suffix='trunk/allowed/vlan')
         payload = '<vlan><none>true</none></vlan>'
+        import requests
         requests.put(url, data=payload, auth=self._auth)
 
     def _set_native_vlan(self, interface, vlan):
@@ -292,8 +291,19 @@ class Brocade(Switch):
         """ Construct the xml tag by prepending the brocade tag prefix. """
         return '{urn:brocade.com:mgmt:brocade-interface}%s' % name
 
+    @staticmethod
+    def _parse(response):
+        """ Parse the xml body of a response from the switch. """
+        # lxml and requests are imported where they are used, rather than
+        # at the top of the module, since they are slow to import and every
+        # HIL process loads this driver (if configured), while only those
+        # which talk to the switch need them:
+        from lxml import etree
+        return etree.fromstring(response.text)
+
     def _make_request(self, method, url, data=None,
                       acceptable_error_codes=()):
+        import requests
         r = requests.request(method, url, data=data, auth=self._auth)
         if r.status_code >= 400 and \
            r.status_code not in acceptable_error_codes:
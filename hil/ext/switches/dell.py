@@ -17,7 +17,6 @@ Currently the driver uses telnet to connect to the switch's console; in
 the long term we want to be using SNMP.
 """
 
-import pexpect
 import logging
 import schema
 
@@ -74,7 +73,7 @@ class _PowerConnect55xxSession(_BaseSession):
     @staticmethod
     def connect(switch):
         # connect to the switch, and log in:
-        console = pexpect.spawn('telnet ' + switch.hostname)
+        console = _console.spawn(switch, 'telnet ' + switch.hostname)
         console.expect('User Name:')
         console.sendline(switch.username)
         console.expect('Password:')
@@ -18,7 +18,6 @@ Currently the driver uses telnet to connect to the switch's console; in
 the long term we want to be using SNMP.
 """
 
-import pexpect
 import re
 import logging
 import schema
@@ -83,7 +82,7 @@ class _DellN3000Session(_BaseSession):
     @staticmethod
     def connect(switch):
         # connect to the switch, and log in:
-        console = pexpect.spawn('telnet ' + switch.hostname)
+        console = _console.spawn(switch, 'telnet ' + switch.hostname)
         console.expect('User:')
         console.sendline(switch.username)
         console.expect('Password:')
@@ -18,7 +18,6 @@ Currently the driver uses telnet to connect to the switch's console; in the
 long term we want to be using SNMP.
 """
 
-import pexpect
 import re
 import schema
 import logging
@@ -101,7 +100,7 @@ class _Session(_console.Session):
 
     @staticmethod
     def connect(switch):
-        console = pexpect.spawn('telnet ' + switch.hostname)
+        console = _console.spawn(switch, 'telnet ' + switch.hostname)
         console.expect('login: ')
         console.sendline(switch.username)
         console.expect('Password: ')
@@ -1,13 +1,23 @@
-from flask_migrate import Migrate, MigrateCommand
+"""Database creation, and support for migration scripts.
+
+The migration scripts themselves are run with alembic, via flask-migrate's
+``hil-admin db`` commands (see ``hil.commands.db``). Alembic is slow to
+import, and slow to read the scripts, so this module avoids it at startup:
+checking the schema version (`check_db_schema`) uses a manifest of the
+revisions in each directory of scripts (``heads.json``; see
+`write_heads_manifests`), and only falls back to alembic if a manifest is
+missing or out of date.
+"""
+from hil import startup
 from hil.flaskapp import app
-from hil.model import db
+from hil.model import db, Generation
 from hil.network_allocator import get_network_allocator
 from os.path import join, dirname
+import hashlib
+import json
+import os
 import sys
 
-from alembic.config import Config
-from alembic.script import ScriptDirectory
-
 # This is a dictionary mapping the names of modules to directories containing
 # their alembic version scripts. Extensions may add entries to this with their
 # own module names as keys.
@@ -18,16 +28,16 @@ paths = {
     'hil': join(dirname(__file__), 'migrations', 'versions'),
 }
 
-migrate = Migrate(app, db,
-                  # Use the package's directory. This ensures that the
-                  # migration scripts are available when the package is
-                  # installed system-wide:
-                  directory=join(dirname(__file__), 'migrations'))
-command = MigrateCommand
+# The alembic environment. This is the package's directory, which ensures
+# that the migration scripts are available when the package is installed
+# system-wide:
+MIGRATIONS_DIR = join(dirname(__file__), 'migrations')
+
+# The name of the manifest file in each directory of version scripts:
+HEADS_MANIFEST = 'heads.json'
 
 
-@migrate.configure
-def _configure_alembic(config):
+def configure_alembic(config):
     """Customize alembic configuration."""
     # Configure the path for version scripts to include all of the directories
     # named in the `paths` dictionary, above:
@@ -52,13 +62,88 @@ AlembicVersion = db.Table(
 )
 
 
-def _expected_heads():
-    cfg_path = join(dirname(__file__), 'migrations',  'alembic.ini')
+def _script_directory():
+    """Return an alembic ``ScriptDirectory`` for all of the `paths`."""
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+    cfg_path = join(MIGRATIONS_DIR, 'alembic.ini')
     cfg = Config(cfg_path)
-    _configure_alembic(cfg)
-    cfg.set_main_option('script_location', dirname(cfg_path))
-    script_dir = ScriptDirectory.from_config(cfg)
-    return set(script_dir.get_heads())
+    configure_alembic(cfg)
+    cfg.set_main_option('script_location', MIGRATIONS_DIR)
+    return ScriptDirectory.from_config(cfg)
+
+
+def _script_hashes(directory):
+    """Return a dict mapping the names of the scripts in `directory` to the
+    sha1 hashes of their contents.
+
+    This identifies the contents of a manifest's directory, so that we
+    notice scripts being added, removed or changed.
+    """
+    hashes = {}
+    for name in os.listdir(directory):
+        if name.endswith('.py'):
+            with open(join(directory, name), 'rb') as f:
+                hashes[name] = hashlib.sha1(f.read()).hexdigest()
+    return hashes
+
+
+def _read_heads_manifest(directory):
+    """Return the manifest in `directory`, or None if it is out of date.
+
+    The manifest is a dict with the keys ``scripts`` (see `_script_hashes`),
+    ``revisions`` (the revisions defined by the directory's scripts) and
+    ``down_revisions`` (those which the scripts follow).
+    """
+    try:
+        with open(join(directory, HEADS_MANIFEST)) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if manifest.get('scripts') != _script_hashes(directory):
+        return None
+    return manifest
+
+
+def write_heads_manifests():
+    """Write the manifest of each of the directories in `paths`.
+
+    The manifests are shipped with HIL, and must be rewritten whenever a
+    migration script is added or changed (with ``hil-admin db
+    cache_heads``); a unit test checks that they are up to date.
+    """
+    manifests = dict((directory, {'revisions': [], 'down_revisions': []})
+                     for directory in paths.values())
+    for script in _script_directory().walk_revisions():
+        manifest = manifests[dirname(script.path)]
+        manifest['revisions'].append(script.revision)
+        down_revision = script.down_revision
+        if down_revision is None:
+            down_revision = ()
+        elif not isinstance(down_revision, (tuple, list)):
+            down_revision = (down_revision,)
+        manifest['down_revisions'].extend(down_revision)
+    for directory, manifest in manifests.items():
+        manifest['revisions'].sort()
+        manifest['down_revisions'].sort()
+        manifest['scripts'] = _script_hashes(directory)
+        with open(join(directory, HEADS_MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=4, sort_keys=True,
+                      separators=(',', ': '))
+            f.write('\n')
+
+
+def _expected_heads():
+    """Return the set of the latest revisions of the migration scripts."""
+    revisions = set()
+    down_revisions = set()
+    for directory in paths.values():
+        manifest = _read_heads_manifest(directory)
+        if manifest is None:
+            return set(_script_directory().get_heads())
+        revisions.update(manifest['revisions'])
+        down_revisions.update(manifest['down_revisions'])
+    return revisions - down_revisions
 
 
 def create_db():
@@ -75,24 +160,48 @@ def create_db():
             db.session.execute(
                 AlembicVersion.insert().values(version_num=head)
             )
+        create_generations(db.session.connection())
         get_network_allocator().populate()
         db.session.commit()
 
 
+def create_generations(connection):
+    """Create the missing generation counters (see `Generation`).
+
+    Each table in the database gets a counter, starting at 0, if it doesn't
+    have one already. This is done whenever tables may have been created:
+    by `create_db`, and after running migration scripts (see
+    ``migrations/env.py``), so that the transactions which bump the
+    counters never need to create them, and race to do so.
+    """
+    tables = db.inspect(connection).get_table_names()
+    if Generation.__table__.name not in tables:
+        # We've been downgraded to before the table existed.
+        return
+    existing = set(name for (name,) in
+                   connection.execute(db.select([Generation.table_name])))
+    missing = [name for name in sorted(tables) if name not in existing]
+    if missing:
+        connection.execute(Generation.__table__.insert(),
+                           [{'table_name': name, 'generation': 0}
+                            for name in missing])
+
+
 def check_db_schema():
     """Verify that the database schema is present and up-to-date.
 
     If not, an error message is printed and the program is aborted.
     """
-    tablenames = db.inspect(db.engine).get_table_names()
+    with startup.phase('check database schema'):
+        tablenames = db.inspect(db.engine).get_table_names()
 
-    if 'alembic_version' not in tablenames:
-        sys.exit("ERROR: Database schema is not initialized; have you run "
-                 "hil-admin db create?")
+        if 'alembic_version' not in tablenames:
+            sys.exit("ERROR: Database schema is not initialized; have you "
+                     "run hil-admin db create?")
 
-    actual_heads = {row[0] for row in
-                    db.session.query(AlembicVersion).all()}
+        actual_heads = {row[0] for row in
+                        db.session.query(AlembicVersion).all()}
 
-    if _expected_heads() != actual_heads:
-        sys.exit("ERROR: Database schema version is incorrect; try "
-                 "running hil-admin db upgrade heads.")
+        if _expected_heads() != actual_heads:
+            sys.exit("ERROR: Database schema version is incorrect; try "
+                     "running hil-admin db upgrade heads.")
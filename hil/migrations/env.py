@@ -12,6 +12,7 @@ from sqlalchemy import engine_from_config, pool
 from logging.config import fileConfig
 import logging
 from flask import current_app
+from hil.migrations import create_generations
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -87,6 +88,8 @@ def run_migrations_online():
     try:
         with context.begin_transaction():
             context.run_migrations()
+            # Migrations may have added tables, which need counters too:
+            create_generations(connection)
     finally:
         connection.close()
 
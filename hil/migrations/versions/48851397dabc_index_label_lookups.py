@@ -0,0 +1,55 @@
+"""Add unique constraints and indexes for label lookups
+
+Almost every API call looks objects up by label: top-level objects (nodes,
+projects, networks, switches and headnodes) by label alone, and the rest by
+their owner and label. Each of these is now a unique constraint, which also
+indexes the lookup. Network attachments get the unique constraints which
+the API already enforced, and networking actions are indexed by nic.
+
+Upgrading fails if the database already contains duplicates.
+
+Revision ID: 48851397dabc
+Revises: 9c2e1d5b7a43
+Create Date: 2026-10-19 10:41:12.302877
+
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '48851397dabc'
+down_revision = '9c2e1d5b7a43'
+branch_labels = None
+
+# (constraint name, table, columns) for each unique constraint. The names are
+# those postgres chooses for constraints created by ``hil-admin db create``:
+unique_constraints = [
+    ('node_label_key', 'node', ['label']),
+    ('project_label_key', 'project', ['label']),
+    ('network_label_key', 'network', ['label']),
+    ('switch_label_key', 'switch', ['label']),
+    ('headnode_label_key', 'headnode', ['label']),
+    ('nic_owner_id_label_key', 'nic', ['owner_id', 'label']),
+    ('port_owner_id_label_key', 'port', ['owner_id', 'label']),
+    ('metadata_owner_id_label_key', 'metadata', ['owner_id', 'label']),
+    ('hnic_owner_id_label_key', 'hnic', ['owner_id', 'label']),
+    ('network_attachment_nic_id_network_id_key', 'network_attachment',
+     ['nic_id', 'network_id']),
+    ('network_attachment_nic_id_channel_key', 'network_attachment',
+     ['nic_id', 'channel']),
+]
+
+
+def upgrade():
+    for name, table, columns in unique_constraints:
+        op.create_unique_constraint(name, table, columns)
+    op.create_index('ix_networking_action_nic_id', 'networking_action',
+                    ['nic_id'])
+
+
+def downgrade():
+    op.drop_index('ix_networking_action_nic_id',
+                  table_name='networking_action')
+    for name, table, _ in reversed(unique_constraints):
+        op.drop_constraint(name, table, type_='unique')
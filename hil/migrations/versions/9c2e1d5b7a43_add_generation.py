@@ -0,0 +1,33 @@
+"""Add generation table
+
+Revision ID: 9c2e1d5b7a43
+Revises: fcef4b63fd6b
+Create Date: 2017-07-24 10:03:51.120457
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c2e1d5b7a43'
+down_revision = 'fcef4b63fd6b'
+branch_labels = None
+
+
+def upgrade():
+    generation = op.create_table(
+        'generation',
+        sa.Column('table_name', sa.String(), nullable=False),
+        sa.Column('generation', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('table_name'))
+    # Create the counters up front, so concurrent transactions don't race to
+    # create them later:
+    tables = sa.inspect(op.get_bind()).get_table_names()
+    op.bulk_insert(generation, [{'table_name': name, 'generation': 0}
+                                for name in tables])
+
+
+def downgrade():
+    op.drop_table('generation')
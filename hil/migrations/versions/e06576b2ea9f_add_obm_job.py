@@ -0,0 +1,32 @@
+"""Add obm_job table
+
+Revision ID: e06576b2ea9f
+Revises: c45f6a96dbe7
+Create Date: 2017-07-10 11:02:44.130952
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e06576b2ea9f'
+down_revision = 'c45f6a96dbe7'
+branch_labels = None
+
+
+def upgrade():
+    op.create_table('obm_job',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('type', sa.String(), nullable=False),
+                    sa.Column('bootdev', sa.String(), nullable=True),
+                    sa.Column('status', sa.String(), nullable=False),
+                    sa.Column('error', sa.String(), nullable=True),
+                    sa.Column('node_id', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(['node_id'], ['node.id'], ),
+                    sa.PrimaryKeyConstraint('id'))
+
+
+def downgrade():
+    op.drop_table('obm_job')
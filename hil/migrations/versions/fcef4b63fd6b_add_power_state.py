@@ -0,0 +1,32 @@
+"""Add power_state table
+
+Revision ID: fcef4b63fd6b
+Revises: e06576b2ea9f
+Create Date: 2017-07-17 14:21:09.583213
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'fcef4b63fd6b'
+down_revision = 'e06576b2ea9f'
+branch_labels = None
+
+
+def upgrade():
+    op.create_table('power_state',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('node_id', sa.Integer(), nullable=False),
+                    sa.Column('state', sa.String(), nullable=True),
+                    sa.Column('error', sa.String(), nullable=True),
+                    sa.Column('updated', sa.DateTime(), nullable=False),
+                    sa.ForeignKeyConstraint(['node_id'], ['node.id'], ),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('node_id'))
+
+
+def downgrade():
+    op.drop_table('power_state')
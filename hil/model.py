@@ -24,14 +24,16 @@ Extensions are permitted to create new database objects by subclassing from
 # from sqlalchemy import *
 # from sqlalchemy.ext.declarative import declarative_base, declared_attr
 # from sqlalchemy.orm import relationship, sessionmaker,backref
-from flask.ext.sqlalchemy import SQLAlchemy
+from flask.ext.sqlalchemy import SQLAlchemy, SignallingSession
 from subprocess import call, check_call, Popen, PIPE
 from hil.flaskapp import app
 from hil.config import cfg
 from hil.dev_support import no_dry_run
+from hil.errors import OBMError
+from datetime import datetime, timedelta
 import uuid
 import xml.etree.ElementTree
-from sqlalchemy import BigInteger
+from sqlalchemy import BigInteger, event
 from sqlalchemy.dialects import sqlite
 
 # without setting this explicitly, we get a warning that this option
@@ -59,6 +61,26 @@ def init_db(uri=None):
     app.config.update(SQLALCHEMY_DATABASE_URI=uri)
 
 
+def polymorphic(cls):
+    """Return an entity for loading `cls` along with all of its subclasses.
+
+    ``Switch`` and ``Obm`` use joined-table inheritance: each driver keeps
+    its columns in a table of its own. Loading objects through the base
+    class costs another query per object to read those columns; querying
+    this entity instead reads every driver's table in the same query. Use
+    it as the entity of a query, or with ``of_type`` to load a
+    relationship eagerly, e.g.::
+
+        Port.query.options(
+            db.joinedload(Port.owner.of_type(polymorphic(Switch))))
+
+    The drivers are those loaded when this is called, so call it when
+    building the query, not at import time.
+    """
+    # Joined eager loading requires the subclass tables to be aliased:
+    return db.with_polymorphic(cls, '*', flat=True)
+
+
 # A joining table for project's access to networks, which have a many to many
 # relationship:
 network_projects = db.Table(
@@ -69,6 +91,10 @@ network_projects = db.Table(
 
 class Nic(db.Model):
     """a nic belonging to a Node"""
+    __table_args__ = (
+        db.UniqueConstraint('owner_id', 'label',
+                            name='nic_owner_id_label_key'),
+    )
 
     id = db.Column(BigIntegerType, primary_key=True)
     label = db.Column(db.String, nullable=False)
@@ -94,7 +120,7 @@ class Nic(db.Model):
 class Node(db.Model):
     """a (physical) machine"""
     id = db.Column(db.Integer, primary_key=True)
-    label = db.Column(db.String, nullable=False)
+    label = db.Column(db.String, nullable=False, unique=True)
 
     # The project to which this node is allocated. If the project is null, the
     # node is unallocated:
@@ -110,6 +136,26 @@ class Node(db.Model):
                           single_parent=True,
                           cascade='all, delete-orphan')
 
+    def refresh_power_state(self):
+        """Read the node's power state from its obm, and cache it.
+
+        Returns the node's (updated) ``PowerState``. If reading the power
+        state fails, the error is recorded in the ``PowerState`` rather than
+        raised.
+        """
+        try:
+            state = self.obm.power_status()
+            error = None
+        except OBMError as e:
+            state = None
+            error = e.description
+        if self.power_state is None:
+            self.power_state = PowerState()
+        self.power_state.state = state
+        self.power_state.error = error
+        self.power_state.updated = datetime.utcnow()
+        return self.power_state
+
 
 class Project(db.Model):
     """a collection of resources
@@ -117,7 +163,7 @@ class Project(db.Model):
     A project may contain allocated nodes, networks, and headnodes.
     """
     id = db.Column(db.Integer, primary_key=True)
-    label = db.Column(db.String, nullable=False)
+    label = db.Column(db.String, nullable=False, unique=True)
 
     def __init__(self, label):
         """Create a project with the given label."""
@@ -129,6 +175,11 @@ class Metadata(db.Model):
 
     Metadata may a key, a hash, or otherwise
     """
+    __table_args__ = (
+        db.UniqueConstraint('owner_id', 'label',
+                            name='metadata_owner_id_label_key'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     label = db.Column(db.String, nullable=False)
     value = db.Column(db.String)
@@ -148,7 +199,7 @@ class Network(db.Model):
     See docs/networks.md for more information on the parameters.
     """
     id = db.Column(db.Integer, primary_key=True)
-    label = db.Column(db.String, nullable=False)
+    label = db.Column(db.String, nullable=False, unique=True)
 
     # The project to which the network belongs, or None if the network was
     # created by the administrator.  This field determines who can delete a
@@ -190,6 +241,11 @@ class Port(db.Model):
     The port's label is an identifier that is meaningful only to the
     corresponding switch's driver.
     """
+    __table_args__ = (
+        db.UniqueConstraint('owner_id', 'label',
+                            name='port_owner_id_label_key'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     label = db.Column(db.String, nullable=False)
     owner_id = db.Column(db.ForeignKey('switch.id'), nullable=False)
@@ -210,7 +266,7 @@ class Switch(db.Model):
     Subclasses MUST override both ``validate`` and ``session``.
     """
     id = db.Column(db.Integer, primary_key=True)
-    label = db.Column(db.String, nullable=False)
+    label = db.Column(db.String, nullable=False, unique=True)
 
     type = db.Column(db.String, nullable=False)
 
@@ -338,6 +394,14 @@ class Obm(db.Model):
         """
         assert False, "Subclasses MUST override the set_bootdev method "
 
+    def power_status(self):
+        """Returns the node's power state, either 'on' or 'off'.
+
+        Raises an OBMError if the state can't be determined. Callers should
+        usually use the cached state instead; see ``PowerState``.
+        """
+        assert False, "Subclasses MUST override the power_status method "
+
     def start_console(self):
         """Starts logging to the console. """
         assert False, "Subclasses MUST override the start_console method"
@@ -352,10 +416,57 @@ class Obm(db.Model):
     def get_console(self):
         assert False, "Subclasses MUST override the get_console method"
 
+    def get_console_range(self, offset=None, tail=None):
+        """Return part of the console log, to be streamed to the client.
+
+        Returns None if there is no log. Otherwise, returns a tuple
+        ``(chunks, start, end)``, where ``chunks`` is an iterable of strings
+        which together hold the log from byte offset ``start`` up to
+        ``end``. The log starts at ``offset`` if it is not None (or at the
+        oldest output still available, if that is later); if ``tail`` is not
+        None, only the last ``tail`` bytes are returned.
+
+        The default implementation just slices the result of
+        ``get_console``; drivers with large logs should override it.
+        """
+        log = self.get_console()
+        if log is None:
+            return None
+        end = len(log)
+        start = 0
+        if offset is not None:
+            start = min(offset, end)
+        if tail is not None:
+            start = max(start, end - tail)
+        return [log[start:]], start, end
+
     def get_console_log_filename(self):
         assert False, "Subclasses MUST override the get_console_log_filename" \
             "method"
 
+    def console_commands(self):
+        """Return the commands the console daemon uses to log the console.
+
+        Drivers which log the console via the console daemon (``hil
+        serve_consoles``; see ``hil.consoles``) should return a tuple
+        ``(start, cleanup)``, where ``start`` is the command line of a
+        process which writes the console's output to its stdout, and
+        ``cleanup`` is the command line of a process to run after stopping
+        it (or None). The default, None, means the driver manages the
+        console itself.
+        """
+        return None
+
+    def concurrency_key(self):
+        """Return a key identifying the management controller behind this obm.
+
+        The obm daemon (``hil serve_obm``) limits the number of operations
+        running concurrently against obms with the same key. By default every
+        obm gets its own key; drivers should override this if several obms
+        can share a controller (e.g. the same BMC address).
+        """
+        return '%s:%d' % (self.type, self.id)
+
 
 def _on_virt_uri(args_list):
     """Make an argument list to libvirt tools use right URI.
@@ -370,7 +481,7 @@ def _on_virt_uri(args_list):
 class Headnode(db.Model):
     """A virtual machine used to administer a project."""
     id = db.Column(db.Integer, primary_key=True)
-    label = db.Column(db.String, nullable=False)
+    label = db.Column(db.String, nullable=False, unique=True)
 
     # The project to which this Headnode belongs:
     project_id = db.Column(db.ForeignKey('project.id'), nullable=False)
@@ -476,6 +587,11 @@ class Headnode(db.Model):
 
 class Hnic(db.Model):
     """a network interface for a Headnode"""
+    __table_args__ = (
+        db.UniqueConstraint('owner_id', 'label',
+                            name='hnic_owner_id_label_key'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     label = db.Column(db.String, nullable=False)
 
@@ -539,7 +655,7 @@ class NetworkingAction(db.Model):
     # * 'revert_port' detaches the port from all networks.
     type = db.Column(db.String, nullable=False)
 
-    nic_id = db.Column(db.ForeignKey('nic.id'), nullable=False)
+    nic_id = db.Column(db.ForeignKey('nic.id'), nullable=False, index=True)
     new_network_id = db.Column(db.ForeignKey('network.id'), nullable=True)
 
     # If `type` is 'modify_port', this denotes the channel that should be
@@ -562,16 +678,181 @@ class NetworkingAction(db.Model):
 
 class NetworkAttachment(db.Model):
     """An attachment of a network to a particular nic on a channel"""
+    __table_args__ = (
+        db.UniqueConstraint('nic_id', 'network_id',
+                            name='network_attachment_nic_id_network_id_key'),
+        db.UniqueConstraint('nic_id', 'channel',
+                            name='network_attachment_nic_id_channel_key'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
 
-    # TODO: it would be nice to place explicit unique constraints on some
-    # things:
-    #
-    # * (nic_id, network_id)
-    # * (nic_id, channel)
     nic_id = db.Column(db.ForeignKey('nic.id'), nullable=False)
     network_id = db.Column(db.ForeignKey('network.id'), nullable=False)
     channel = db.Column(db.String, nullable=False)
 
     nic = db.relationship('Nic', backref=db.backref('attachments'))
     network = db.relationship('Network', backref=db.backref('attachments'))
+
+
+class PowerState(db.Model):
+    """The most recently read power state of a node.
+
+    Reading the power state from an obm is slow, so the API serves it from
+    here. The obm daemon refreshes states (via
+    ``Node.refresh_power_state``) in the background, and the API asks it to
+    refresh those older than a configurable TTL (see ``ObmJob``); it never
+    reads them from the obms itself.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    node_id = db.Column(db.ForeignKey('node.id'), nullable=False,
+                        unique=True)
+    node = db.relationship('Node',
+                           backref=db.backref('power_state',
+                                              uselist=False,
+                                              cascade='all, delete-orphan'))
+
+    # 'on' or 'off', or None if the state couldn't be read:
+    state = db.Column(db.String, nullable=True)
+
+    # If reading the state failed, a description of the error:
+    error = db.Column(db.String, nullable=True)
+
+    # When the state was read (in UTC):
+    updated = db.Column(db.DateTime, nullable=False)
+
+    @staticmethod
+    def ttl():
+        """Return how long (a ``timedelta``) cached states are good for.
+
+        This is the ``ttl`` option in the ``[power-state]`` section of
+        ``hil.cfg``, in seconds; the default is 60.
+        """
+        if cfg.has_option('power-state', 'ttl'):
+            return timedelta(seconds=cfg.getfloat('power-state', 'ttl'))
+        return timedelta(seconds=60)
+
+
+class ObmJob(db.Model):
+    """A queued out of band management operation on a node.
+
+    Jobs are created by the API server and executed by the obm daemon
+    (``hil serve_obm``); see ``hil.obm_jobs``.
+
+    `legal_types` is a list of legal values for the `type` field, each of
+    which is the name of the ``Obm`` method to invoke. `legal_statuses`
+    likewise lists the legal values for `status`.
+
+    The API server also queues jobs of its own, of the types in
+    `internal_types`: 'refresh_power_state' jobs refresh a node's cached
+    power state (see ``Node.refresh_power_state``), and are deleted once
+    done.
+    """
+
+    legal_types = ('power_cycle', 'power_off', 'set_bootdev')
+    internal_types = ('refresh_power_state',)
+    legal_statuses = ('pending', 'running', 'done', 'failed')
+
+    id = db.Column(db.Integer, primary_key=True)
+    type = db.Column(db.String, nullable=False)
+
+    # The boot device, if `type` is 'set_bootdev'. Ignored otherwise.
+    bootdev = db.Column(db.String, nullable=True)
+
+    status = db.Column(db.String, nullable=False, default='pending')
+
+    # If `status` is 'failed', a description of the error.
+    error = db.Column(db.String, nullable=True)
+
+    node_id = db.Column(db.ForeignKey('node.id'), nullable=False)
+    node = db.relationship('Node',
+                           backref=db.backref('obm_jobs',
+                                              cascade='all, delete-orphan'))
+
+
+class Generation(db.Model):
+    """A counter which is bumped by every transaction that changes a table.
+
+    There is one row per table, created along with the database or the
+    table (see ``hil.migrations.create_generations``).
+    The API server compares generations to tell whether a cached response
+    is still valid; see ``hil.cache``. The counters are kept in the database
+    (rather than in memory) because the API server is not the only process
+    which changes things: the networking and obm daemons do too.
+
+    The counters are bumped automatically, when a transaction commits; code
+    changing the database through the ORM needn't do anything special.
+    """
+    table_name = db.Column(db.String, primary_key=True)
+    generation = db.Column(db.BigInteger, nullable=False)
+
+
+def _changed_tables(session):
+    """Return the names of the tables which flushing `session` changes."""
+    tables = set()
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, Generation):
+            continue
+        dirty = obj in session.dirty
+        if dirty and not session.is_modified(obj):
+            continue
+        state = db.inspect(obj)
+        tables.update(table.name for table in state.mapper.tables)
+        # Changes to many to many relationships land in the joining table:
+        for rel in state.mapper.relationships:
+            if rel.secondary is None:
+                continue
+            if not dirty or state.attrs[rel.key].history.has_changes():
+                tables.add(rel.secondary.name)
+    return tables
+
+
+def bump_generations(session, tables):
+    """Note that `session`'s transaction changes `tables` (names).
+
+    Their generations are bumped when the transaction commits. This is
+    called automatically on flush; code which modifies tables without going
+    through the ORM should call it explicitly.
+    """
+    session.info.setdefault('changed_tables', set()).update(tables)
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def _bump_generations_after_flush(session, flush_context):
+    """Bump the generations of the tables changed by a flush."""
+    tables = _changed_tables(session)
+    if tables:
+        bump_generations(session, tables)
+
+
+@event.listens_for(SignallingSession, 'after_bulk_update')
+@event.listens_for(SignallingSession, 'after_bulk_delete')
+def _bump_generations_after_bulk(context):
+    """Bump the generations of the tables changed by e.g. ``query.delete()``.
+    """
+    if context.rowcount:
+        bump_generations(context.session,
+                         [table.name for table in context.mapper.tables])
+
+
+@event.listens_for(SignallingSession, 'before_commit')
+def _bump_generations_before_commit(session):
+    """Bump the generations of the tables changed by a transaction."""
+    if session.transaction.nested:
+        # Releasing a savepoint; the enclosing transaction will do this.
+        return
+    # Any remaining changes are only flushed after this hook:
+    session.flush()
+    # Bumping each counter once, at the end of the transaction, and always
+    # in the same order, avoids deadlocks between concurrent transactions:
+    for name in sorted(session.info.get('changed_tables', ())):
+        session.execute(Generation.__table__.update()
+                        .where(Generation.table_name == name)
+                        .values(generation=Generation.generation + 1))
+
+
+@event.listens_for(SignallingSession, 'after_transaction_end')
+def _forget_changed_tables(session, transaction):
+    """Forget which tables were changed once a transaction ends."""
+    if transaction.parent is None:
+        session.info.pop('changed_tables', None)
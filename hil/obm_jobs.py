@@ -0,0 +1,251 @@
+# Copyright 2017 Massachusetts Open Cloud Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the
+# License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS
+# IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.  See the License for the specific language
+# governing permissions and limitations under the License.
+
+"""Executes queued obm jobs (see ``model.ObmJob``).
+
+The obm daemon (``hil serve_obm``) creates a ``JobRunner`` and calls its
+``run_jobs`` method in a loop; it also calls ``refresh_power_states``, to
+keep the cached power states (see ``model.PowerState``) fresh. The API
+server queues jobs to refresh the states it finds stale, too. Each job or
+refresh is executed on a pool of worker threads, subject to two limits:
+
+* ``max_workers``, the number of operations running at once overall, and
+* ``max_per_bmc``, the number of operations running at once against obms
+  with the same ``concurrency_key`` (i.e. the same management controller).
+
+Each worker thread uses its own database session.
+"""
+
+import logging
+import threading
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
+
+from sqlalchemy import and_, exists, or_
+from sqlalchemy.orm import aliased
+
+from hil import model
+from hil.model import db
+from hil.errors import OBMError
+
+logger = logging.getLogger(__name__)
+
+
+class JobRunner(object):
+    """Runs obm jobs with bounded concurrency."""
+
+    def __init__(self, max_workers=16, max_per_bmc=1):
+        self.max_workers = max_workers
+        self.max_per_bmc = max_per_bmc
+        self._pool = ThreadPool(max_workers)
+        self._lock = threading.Lock()
+        # Number of operations (jobs and power state refreshes) running,
+        # overall and per concurrency key:
+        self._running = 0
+        self._running_per_bmc = {}
+        # Ids of the nodes whose power states are being refreshed:
+        self._refreshing = set()
+
+    def recover(self):
+        """Fail any jobs left running by a previous daemon.
+
+        We can't know how far such jobs got, so rather than silently
+        retrying them, we report them as failed.
+        """
+        model.ObmJob.query.filter_by(status='running').update(
+            {'status': 'failed', 'error': 'Interrupted by daemon restart'})
+        db.session.commit()
+
+    def run_jobs(self):
+        """Start as many pending jobs as the concurrency limits allow.
+
+        Returns True if any jobs were started, and False otherwise; like
+        ``deferred.apply_networking``, the caller should call this again
+        immediately if it returns True, and otherwise wait a bit.
+        """
+        with self._lock:
+            free = self.max_workers - self._running
+            refreshing = list(self._refreshing)
+        if free == 0:
+            return False
+        # Jobs on the same node run one at a time, in order:
+        running = aliased(model.ObmJob)
+        query = model.ObmJob.query.filter_by(status='pending') \
+            .filter(~exists().where(and_(
+                running.node_id == model.ObmJob.node_id,
+                running.status == 'running')))
+        if refreshing:
+            # Refreshes already underway (see refresh_power_states); these
+            # wait until they're done.
+            query = query.filter(or_(
+                model.ObmJob.type != 'refresh_power_state',
+                ~model.ObmJob.node_id.in_(refreshing)))
+        jobs = query \
+            .options(db.joinedload('node').joinedload(
+                model.Node.obm.of_type(model.polymorphic(model.Obm)))) \
+            .order_by(model.ObmJob.id).limit(free).all()
+
+        started = []
+        nodes = set()
+        with self._lock:
+            for job in jobs:
+                if self._running == self.max_workers:
+                    break
+                refresh = job.type == 'refresh_power_state'
+                if job.node_id in nodes or \
+                        refresh and job.node_id in self._refreshing:
+                    continue
+                key = job.node.obm.concurrency_key()
+                if not self._reserve(key):
+                    continue
+                if refresh:
+                    self._refreshing.add(job.node_id)
+                nodes.add(job.node_id)
+                job.status = 'running'
+                started.append((job.id, key, job.node_id if refresh else None))
+        db.session.commit()
+
+        for args in started:
+            self._pool.apply_async(self._run_job, args)
+        return started != []
+
+    def refresh_power_states(self, max_age):
+        """Start refreshing cached power states older than ``max_age``.
+
+        ``max_age`` is a ``timedelta``. States which have never been read
+        count as stale, and the stalest states are refreshed first. The
+        refreshes share the concurrency limits with the jobs, so this should
+        be called after ``run_jobs``, to give the jobs priority.
+
+        Returns True if any refreshes were started, and False otherwise.
+        """
+        with self._lock:
+            free = self.max_workers - self._running
+            refreshing = list(self._refreshing)
+        if free == 0:
+            return False
+        cutoff = datetime.utcnow() - max_age
+        query = model.Node.query \
+            .outerjoin(model.PowerState) \
+            .filter(or_(model.PowerState.id.is_(None),
+                        model.PowerState.updated < cutoff))
+        if refreshing:
+            query = query.filter(~model.Node.id.in_(refreshing))
+        nodes = query \
+            .options(db.joinedload(
+                model.Node.obm.of_type(model.polymorphic(model.Obm)))) \
+            .order_by(model.PowerState.updated.isnot(None),
+                      model.PowerState.updated) \
+            .limit(free).all()
+
+        started = []
+        with self._lock:
+            for node in nodes:
+                if self._running == self.max_workers:
+                    break
+                if node.id in self._refreshing:
+                    continue
+                key = node.obm.concurrency_key()
+                if not self._reserve(key):
+                    continue
+                self._refreshing.add(node.id)
+                started.append((node.id, key))
+        db.session.commit()
+
+        for node_id, key in started:
+            self._pool.apply_async(self._refresh_power_state, (node_id, key))
+        return started != []
+
+    def wait(self):
+        """Wait for all running jobs to finish, and shut down the pool."""
+        self._pool.close()
+        self._pool.join()
+
+    def idle(self):
+        """Return True if no jobs are running."""
+        with self._lock:
+            return self._running == 0
+
+    def _run_job(self, job_id, key, refreshing=None):
+        """Execute the job with id ``job_id``, in a worker thread.
+
+        ``refreshing`` is the id of the node whose power state the job
+        refreshes, if it is a 'refresh_power_state' job.
+        """
+        try:
+            job = model.ObmJob.query.get(job_id)
+            if job is None:
+                # The node (and with it the job) was deleted in the meantime.
+                return
+            try:
+                if job.type == 'refresh_power_state':
+                    # Errors reading the state are recorded in the state:
+                    job.node.refresh_power_state()
+                    db.session.delete(job)
+                else:
+                    if job.type == 'set_bootdev':
+                        job.node.obm.set_bootdev(job.bootdev)
+                    else:
+                        getattr(job.node.obm, job.type)()
+                    job.status = 'done'
+            except OBMError as e:
+                job.status = 'failed'
+                job.error = e.description
+            except Exception as e:
+                logger.exception('Unexpected error running obm job %d',
+                                 job_id)
+                job.status = 'failed'
+                job.error = 'Internal error: %s' % e
+            db.session.commit()
+        finally:
+            db.session.remove()
+            with self._lock:
+                self._refreshing.discard(refreshing)
+                self._release(key)
+
+    def _refresh_power_state(self, node_id, key):
+        """Refresh the power state of node ``node_id``, in a worker thread."""
+        try:
+            node = model.Node.query.get(node_id)
+            if node is not None:
+                node.refresh_power_state()
+                db.session.commit()
+        except Exception:
+            logger.exception('Unexpected error refreshing the power state '
+                             'of node %d', node_id)
+        finally:
+            db.session.remove()
+            with self._lock:
+                self._refreshing.discard(node_id)
+                self._release(key)
+
+    def _reserve(self, key):
+        """Count an operation against ``key`` as running, if the limits
+        allow it. Returns True if so, and False otherwise.
+
+        Must be called with ``_lock`` held.
+        """
+        if self._running == self.max_workers or \
+                self._running_per_bmc.get(key, 0) == self.max_per_bmc:
+            return False
+        self._running += 1
+        self._running_per_bmc[key] = self._running_per_bmc.get(key, 0) + 1
+        return True
+
+    def _release(self, key):
+        """Undo ``_reserve(key)``. Must be called with ``_lock`` held."""
+        self._running -= 1
+        self._running_per_bmc[key] -= 1
+        if self._running_per_bmc[key] == 0:
+            del self._running_per_bmc[key]
@@ -0,0 +1,274 @@
+"""A pre-forking, multi-threaded WSGI server for the API.
+
+``hil serve`` uses this when ``hil.cfg`` has a ``[server]`` section, and
+flask's development server otherwise. The master process initializes the
+API server (see ``hil.server.init``) and binds the listening socket once,
+then forks ``workers`` worker processes. Each worker accepts connections
+from the shared socket, and handles requests in a pool of ``threads``
+threads.
+
+The master restarts workers which die, and handles these signals:
+
+* ``SIGHUP``: gracefully restart the workers. New workers are started,
+  then the old ones are told to stop; each finishes the requests it has
+  already accepted before exiting.
+* ``SIGTERM`` and ``SIGINT``: gracefully shut down, likewise.
+
+Workers which haven't exited ``graceful_timeout`` seconds after being told
+to stop are killed.
+"""
+
+import errno
+import logging
+import multiprocessing
+import os
+import select
+import signal
+import threading
+import time
+from Queue import Queue
+
+from werkzeug.serving import BaseWSGIServer
+
+from hil.config import cfg
+from hil.flaskapp import app
+from hil.model import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_THREADS = 2
+DEFAULT_GRACEFUL_TIMEOUT = 30
+
+# How often (in seconds) the master checks on its workers, and workers check
+# whether they've been told to stop:
+POLL_INTERVAL = 0.5
+
+
+def options():
+    """Return the options in the ``[server]`` section of ``hil.cfg``.
+
+    The result is a dict with the keys ``host``, ``workers``, ``threads``
+    and ``graceful_timeout``, with defaults filled in for missing options.
+    ``workers`` defaults to the number of CPUs.
+    """
+    result = {
+        'host': DEFAULT_HOST,
+        'workers': multiprocessing.cpu_count(),
+        'threads': DEFAULT_THREADS,
+        'graceful_timeout': DEFAULT_GRACEFUL_TIMEOUT,
+    }
+    if cfg.has_option('server', 'host'):
+        result['host'] = cfg.get('server', 'host')
+    for name in 'workers', 'threads':
+        if cfg.has_option('server', name):
+            result[name] = cfg.getint('server', name)
+    if cfg.has_option('server', 'graceful_timeout'):
+        result['graceful_timeout'] = cfg.getfloat('server',
+                                                  'graceful_timeout')
+    return result
+
+
+class PoolServer(BaseWSGIServer):
+    """A WSGI server which handles requests in a fixed pool of threads.
+
+    Call `start` before handling requests, and `stop` afterwards; `stop`
+    waits for the requests already accepted to finish.
+    """
+
+    multithread = True
+    multiprocess = True
+
+    def __init__(self, host, port, app):
+        super(PoolServer, self).__init__(host, port, app)
+        self._queue = Queue()
+        self._threads = []
+
+    def start(self, threads):
+        """Start `threads` threads to handle requests."""
+        for _ in range(threads):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Wait for the accepted requests to finish, and stop the threads."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def handle_requests(self, timeout):
+        """Accept a connection, if one arrives within `timeout` seconds.
+
+        Unlike ``handle_request``, this works with a non-blocking socket.
+        """
+        try:
+            ready = select.select([self], [], [], timeout)[0]
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        if ready:
+            self._handle_request_noblock()
+
+    def process_request(self, request, client_address):
+        self._queue.put((request, client_address))
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+
+class Master(object):
+    """The master process of the pre-forking server.
+
+    Creating a Master binds the listening socket; `run` then forks the
+    workers, and supervises them until the server is shut down.
+    """
+
+    def __init__(self, app, host, port, workers, threads,
+                 graceful_timeout=DEFAULT_GRACEFUL_TIMEOUT):
+        self.server = PoolServer(host, port, app)
+        # Every worker waits for connections on the same socket, and only
+        # one of them gets each; the others mustn't block in accept():
+        self.server.socket.setblocking(0)
+        self.num_workers = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        # Map from the pids of running workers to the times by which they
+        # must exit, or None for workers which haven't been told to stop:
+        self.workers = {}
+        self._restarting = False
+        self._stopping = False
+
+    def run(self):
+        """Run the server, until it is told to shut down."""
+        signal.signal(signal.SIGHUP, self._handle_restart)
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        logger.info('Listening on %s:%d, with %d workers of %d threads',
+                    self.server.server_address[0],
+                    self.server.server_address[1],
+                    self.num_workers, self.threads)
+        while True:
+            self._reap()
+            if self._stopping:
+                self._stop_workers(list(self.workers))
+                if not self.workers:
+                    break
+            else:
+                if self._restarting:
+                    logger.info('Restarting workers')
+                    self._restarting = False
+                    old = [pid for pid, deadline in self.workers.items()
+                           if deadline is None]
+                    self._spawn_workers()
+                    self._stop_workers(old)
+                self._spawn_workers()
+            self._kill_late_workers()
+            time.sleep(POLL_INTERVAL)
+        self.server.server_close()
+        logger.info('Shut down')
+
+    def _handle_restart(self, signum, frame):
+        self._restarting = True
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _spawn_workers(self):
+        """Start workers until there are `num_workers` not stopping."""
+        running = sum(1 for deadline in self.workers.values()
+                      if deadline is None)
+        for _ in range(self.num_workers - running):
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    self._work()
+                    status = 0
+                except Exception:
+                    logger.exception('Worker failed')
+                finally:
+                    os._exit(status)
+            self.workers[pid] = None
+
+    def _stop_workers(self, pids):
+        """Tell the workers `pids` to stop, if they haven't been already."""
+        for pid in pids:
+            if self.workers.get(pid, 0) is None:
+                self.workers[pid] = time.time() + self.graceful_timeout
+                self._kill(pid, signal.SIGTERM)
+
+    def _kill_late_workers(self):
+        now = time.time()
+        for pid, deadline in self.workers.items():
+            if deadline is not None and deadline < now:
+                logger.warning('Worker %d did not stop in time; killing it',
+                               pid)
+                self._kill(pid, signal.SIGKILL)
+
+    @staticmethod
+    def _kill(pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError as e:
+            # The worker may have exited already:
+            if e.errno != errno.ESRCH:
+                raise
+
+    def _reap(self):
+        """Collect the workers which have exited."""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if pid == 0:
+                return
+            deadline = self.workers.pop(pid, None)
+            if deadline is None and not self._stopping:
+                logger.warning('Worker %d exited unexpectedly (status %d)',
+                               pid, status)
+
+    def _work(self):
+        """The main loop of a worker process."""
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(1))
+        # These are for the master:
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        master = os.getppid()
+        self.server.start(self.threads)
+        # If the master dies, its workers are re-parented; stop them too:
+        while not stopping and os.getppid() == master:
+            self.server.handle_requests(POLL_INTERVAL)
+        self.server.stop()
+
+
+def serve(port):
+    """Serve the API on `port`, as configured in the ``[server]`` section.
+
+    The caller must already have initialized the API server; see
+    ``hil.server.init``.
+    """
+    opts = options()
+    master = Master(app, opts['host'], port, opts['workers'],
+                    opts['threads'], opts['graceful_timeout'])
+    # The workers mustn't share the master's database connections:
+    db.engine.dispose()
+    master.run()
@@ -21,6 +21,8 @@ The main things of interest in this module are:
 """
 import logging
 import json
+import types
+import zlib
 
 import flask
 from flask import _app_ctx_stack as ctx_stack
@@ -28,14 +30,26 @@ from flask import _app_ctx_stack as ctx_stack
 from hil.flaskapp import app
 from hil.errors import APIError, AuthorizationError
 from hil.config import cfg
+from hil.model import db
 
 from schema import SchemaError
 from uuid import uuid4
+from werkzeug.exceptions import HTTPException
 
 from hil import auth
 
 local = flask.g
 
+# Map from the names of API calls which may be used in a batch (see
+# `run_batch`) to (function, schema, dont_log) tuples:
+_batch_calls = {}
+
+# Streamed responses are sent in chunks of about this many bytes:
+STREAM_CHUNK_SIZE = 8192
+
+# Responses smaller than this many bytes are not compressed, by default:
+DEFAULT_COMPRESSION_MIN_SIZE = 1024
+
 
 class _RequestInfo(object):
     """A Flask extension that stores a few per request values.
@@ -99,7 +113,7 @@ class ValidationError(APIError):
     """An exception indicating that the body of the request was invalid."""
 
 
-def rest_call(methods, path, schema, dont_log=()):
+def rest_call(methods, path, schema, dont_log=(), batch=False):
     """A decorator which registers an http mapping to a python api call.
 
     `rest_call` makes no modifications to the function itself, though the
@@ -132,6 +146,9 @@ def rest_call(methods, path, schema, dont_log=()):
             perform type validation and conversion.
     * dont_log (optional): a list of "sensitive" argument names, which should
             not be logged.
+    * batch (optional): whether the api call may be used in a batch (see
+            `run_batch`). Since a failed batch is rolled back, this must only
+            be set for calls whose only effects are on the database.
 
     For example, given::
 
@@ -172,6 +189,14 @@ def rest_call(methods, path, schema, dont_log=()):
           the status code will be 200.
         * A tuple, whose first element is a string (the response body), and
           whose second is an integer (the status code).
+        * A ``flask.Response``, e.g. to stream the body or set headers. See
+          also `json_array` and `json_object`.
+        * A generator, which will be consumed as the response is sent, and
+          encoded as a JSON array of the values it generates (see
+          `json_array`). Note that a generator function's body doesn't run
+          until the response is sent, which is too late to report errors;
+          checks (including authorization) must be done by a function which
+          returns the generator.
     """
     def register(f):
 
@@ -187,6 +212,8 @@ def rest_call(methods, path, schema, dont_log=()):
                          f.__name__,
                          _rest_wrapper(f, schema, dont_log),
                          methods=meths)
+        if batch:
+            _batch_calls[f.__name__] = (f, schema, dont_log)
         return f
     return register
 
@@ -232,16 +259,26 @@ def _do_validation(schema, kwargs):
             except ValueError:
                 raise ValidationError("The request body is not valid JSON")
 
+    return _validate(schema, final_kwargs, kwargs)
+
+
+def _validate(schema, args, path_args):
+    """Validate the arguments to an API call against `schema`.
+
+    `args` are the arguments from the request body or query parameters, and
+    `path_args` those from the URL. The latter are added to the former, and
+    the result validated and returned.
+    """
     validation_error = ValidationError(
             "Request arguments are not valid for this request")
 
-    for k in kwargs.keys():
-        if k in final_kwargs:
+    for k in path_args.keys():
+        if k in args:
             raise validation_error
-        final_kwargs[k] = kwargs[k]
+        args[k] = path_args[k]
 
     try:
-        return schema.validate(final_kwargs)
+        return schema.validate(args)
     except SchemaError:
         # It would be nice to return a more helpful error message
         # here, but it's a little awkward to extract one from the
@@ -270,21 +307,219 @@ def _rest_wrapper(f, schema, dont_log):
     def wrapper(**kwargs):
         kwargs = _do_validation(schema, kwargs)
 
-        censored_kwargs = kwargs.copy()
-        for argname in dont_log:
-            censored_kwargs[argname] = '<<CENSORED>>'
-
         init_auth()
-        logger.info('API call: %s(%s)',
-                    f.__name__, _format_arglist(**censored_kwargs))
+        _log_call(f, kwargs, dont_log)
 
         ret = f(**kwargs)
         if ret is None:
             ret = ''
+        elif isinstance(ret, types.GeneratorType):
+            ret = json_array(ret)
         return ret
     return wrapper
 
 
+def json_array(items):
+    """Return a response whose body is the JSON array of `items`.
+
+    `items` may be any iterable of JSON-serializable values, and is only
+    consumed as the response is sent, so a large array never needs to be
+    held in memory all at once. For instance, `items` may be a generator
+    over the results of a query using ``yield_per``.
+    """
+    def chunks():
+        yield '['
+        for i, item in enumerate(items):
+            if i > 0:
+                yield ', '
+            yield json.dumps(item, sort_keys=True)
+        yield ']'
+    return _json_stream(chunks())
+
+
+def json_object(pairs):
+    """Return a response whose body is a JSON object with the given `pairs`.
+
+    `pairs` is an iterable of ``(key, value)`` tuples, with no duplicate
+    keys. Like `json_array`, it is only consumed as the response is sent.
+    """
+    def chunks():
+        yield '{'
+        for i, (key, value) in enumerate(pairs):
+            if i > 0:
+                yield ', '
+            yield json.dumps(key)
+            yield ': '
+            yield json.dumps(value, sort_keys=True)
+        yield '}'
+    return _json_stream(chunks())
+
+
+def _json_stream(chunks):
+    """Return a response streaming the JSON encoded as `chunks`.
+
+    The (typically tiny) chunks are combined into pieces of roughly
+    `STREAM_CHUNK_SIZE` bytes.
+    """
+    def combined():
+        buf = []
+        size = 0
+        for chunk in chunks:
+            buf.append(chunk)
+            size += len(chunk)
+            if size >= STREAM_CHUNK_SIZE:
+                yield ''.join(buf)
+                buf = []
+                size = 0
+        if buf:
+            yield ''.join(buf)
+    return flask.Response(flask.stream_with_context(combined()),
+                          mimetype='application/json')
+
+
+def _compression_min_size():
+    """Return the size from which responses are compressed, or None.
+
+    None means compression is disabled. This is set by the ``enabled`` and
+    ``min_size`` options in the ``[compression]`` section of ``hil.cfg``.
+    """
+    if cfg.has_option('compression', 'enabled') and \
+            not cfg.getboolean('compression', 'enabled'):
+        return None
+    if cfg.has_option('compression', 'min_size'):
+        return cfg.getint('compression', 'min_size')
+    return DEFAULT_COMPRESSION_MIN_SIZE
+
+
+@app.after_request
+def _compress(response):
+    """Compress `response` with gzip, if the client accepts that.
+
+    Streamed responses are compressed as they are sent, whatever their
+    size. Others are only compressed if they are large enough (see
+    `_compression_min_size`).
+    """
+    min_size = _compression_min_size()
+    if min_size is None or \
+            response.status_code != 200 or \
+            'Content-Encoding' in response.headers or \
+            not flask.request.accept_encodings['gzip']:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if response.is_streamed:
+        response.response = _gzip_chunks(response.response)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(''.join(_gzip_chunks([data])))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def _gzip_chunks(chunks):
+    """Generate the gzip compression of the iterable of strings `chunks`."""
+    # 16 + MAX_WBITS selects the gzip format, rather than plain zlib:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _log_call(f, kwargs, dont_log):
+    """Log a call to the API call `f`, censoring the arguments in `dont_log`.
+    """
+    censored_kwargs = kwargs.copy()
+    for argname in dont_log:
+        censored_kwargs[argname] = '<<CENSORED>>'
+    logger.info('API call: %s(%s)',
+                f.__name__, _format_arglist(**censored_kwargs))
+
+
+def run_batch(operations):
+    """Run a batch of API calls, in a single database transaction.
+
+    `operations` is a list of dictionaries, each with the keys:
+
+    * ``method``: the HTTP method of the API call (e.g. ``PUT``).
+    * ``path``: the URL path of the API call (e.g. ``/node/node-99``).
+    * ``body`` (optional): the arguments not found in the path, as they
+      would appear in the request body (for GET requests, the query
+      parameters).
+
+    Each API call must have been registered by `rest_call` with
+    ``batch=True``. The calls are validated, authorized and run in order;
+    the request must already have been authenticated. Their commits only
+    end a subtransaction, so nothing is committed until all of them have
+    succeeded. If any of them fails, everything is rolled back.
+
+    On success, returns a JSON array with an object for each operation,
+    with the keys ``status`` (the HTTP status) and ``body`` (the response
+    body, a string). On failure, returns an error response for the first
+    operation which failed, like the one the call itself would have
+    returned, but with an extra key ``operation``: the (0-based) index of
+    the operation.
+    """
+    adapter = app.url_map.bind('localhost')
+    results = []
+    for i, operation in enumerate(operations):
+        try:
+            results.append(_run_batch_operation(adapter, operation))
+        except APIError as e:
+            _rollback_batch()
+            return json.dumps({
+                'type': e.__class__.__name__,
+                'msg': e.message,
+                'operation': i,
+            }), e.status_code
+        except Exception:
+            _rollback_batch()
+            raise
+    db.session.commit()
+    return json.dumps(results)
+
+
+def _rollback_batch():
+    """Roll back a batch, including the subtransaction of any operation."""
+    session = db.session()
+    # Rolling back a subtransaction leaves its parent to be rolled back too:
+    while session.transaction.parent is not None:
+        session.rollback()
+    session.rollback()
+
+
+def _run_batch_operation(adapter, operation):
+    """Run a single operation of a batch; see `run_batch`."""
+    method = operation['method'].upper()
+    path = operation['path']
+    try:
+        name, path_args = adapter.match(path, method)
+    except HTTPException:
+        raise ValidationError('No API call matches %s %s' % (method, path))
+    if name not in _batch_calls:
+        raise ValidationError('%s %s may not be used in a batch'
+                              % (method, path))
+    f, schema, dont_log = _batch_calls[name]
+    kwargs = _validate(schema, dict(operation.get('body', {})), path_args)
+    _log_call(f, kwargs, dont_log)
+
+    session = db.session()
+    transaction = session.begin(subtransactions=True)
+    ret = f(**kwargs)
+    if session.transaction is transaction:
+        # The call didn't commit; end the subtransaction ourselves:
+        transaction.commit()
+
+    status = 200
+    if isinstance(ret, tuple):
+        ret, status = ret
+    return {'status': status, 'body': ret or ''}
+
+
 def _format_arglist(*args, **kwargs):
     """Format the argument list in a human readable way.
 
@@ -5,7 +5,7 @@ import sys
 # use it directly from this module.
 from hil import api  # pylint: disable=unused-import
 
-from hil import model, auth
+from hil import model, auth, startup
 from hil.class_resolver import build_class_map_for
 from hil.network_allocator import get_network_allocator
 
@@ -40,24 +40,13 @@ def validate_state():
                  "the auth backend.")
 
 
-def stop_orphan_consoles():
-    """Stop any orphaned console logging processes.
-
-    These may exist if HIL was shut down uncleanly.
-    """
-    # Stop all orphan console logging processes on startup
-    nodes = model.Node.query.all()
-    for node in nodes:
-        node.obm.stop_console()
-        node.obm.delete_console()
-
-
 def init():
     """Set up the api server's internal state.
 
     This is a convenience wrapper that calls the other setup routines in
     this module in the correct order, as well as ``model.init_db``
     """
-    register_drivers()
-    validate_state()
-    model.init_db()
+    with startup.phase('initialize server'):
+        register_drivers()
+        validate_state()
+        model.init_db()
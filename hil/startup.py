@@ -0,0 +1,115 @@
+"""Startup profiling.
+
+If the environment variable ``HIL_PROFILE_STARTUP`` is set (to anything but
+the empty string), HIL's entry points (``hil``, ``hil-admin`` and
+``hil.wsgi``) report where their startup time went on stderr, once startup
+is complete: the time taken by each phase (see `phase`), and by importing
+each top-level package. For example::
+
+    HIL_PROFILE_STARTUP=1 hil serve_networks
+
+Entry points should import this module before anything else, so that the
+time spent importing is counted. Otherwise, profiling costs nothing when
+disabled.
+"""
+
+from contextlib import contextmanager
+import os
+import sys
+import time
+
+enabled = bool(os.environ.get('HIL_PROFILE_STARTUP'))
+
+_started = time.time()
+# (start, depth, name, seconds) for each completed phase:
+_phases = []
+_depth = [0]
+# Map from top-level package names to the time spent importing them:
+_imports = {}
+_reported = [False]
+
+
+@contextmanager
+def phase(name):
+    """Time the body of the ``with`` statement as the startup phase `name`.
+
+    Phases may be nested.
+    """
+    if not enabled:
+        yield
+        return
+    start = time.time()
+    _depth[0] += 1
+    try:
+        yield
+    finally:
+        _depth[0] -= 1
+        _phases.append((start, _depth[0], name, time.time() - start))
+
+
+def report():
+    """Report the startup profile, if profiling is enabled.
+
+    Entry points call this once startup is complete. Only the first call
+    does anything.
+    """
+    if not enabled or _reported[0]:
+        return
+    _reported[0] = True
+    total = time.time() - _started
+    out = sys.stderr
+    out.write('HIL startup profile (%.3fs total):\n' % total)
+    out.write('  phases:\n')
+    for _, depth, name, seconds in sorted(_phases):
+        out.write('    %8.3fs  %s%s\n' % (seconds, '  ' * depth, name))
+    untimed = total - sum(seconds for _, depth, _, seconds in _phases
+                          if depth == 0)
+    out.write('    %8.3fs  (outside of any phase)\n' % untimed)
+    out.write('  imports (by top-level package, slowest first):\n')
+    for name, seconds in sorted(_imports.items(),
+                                key=lambda item: -item[1])[:15]:
+        out.write('    %8.3fs  %s\n' % (seconds, name))
+
+
+def _install_import_timer():
+    """Wrap ``__import__``, recording the time taken by each import.
+
+    Time is charged to the top-level package of the module being imported,
+    less the time spent importing other packages along the way, so nothing
+    is counted twice.
+    """
+    import __builtin__
+    real_import = __builtin__.__import__
+    # [package, time spent importing other packages] for each import in
+    # progress:
+    stack = []
+
+    def timed_import(name, globals=None, locals=None, fromlist=None,
+                     level=-1):
+        package = name.split('.')[0]
+        if not package or (stack and stack[-1][0] == package):
+            return real_import(name, globals, locals, fromlist, level)
+        start = time.time()
+        stack.append([package, 0])
+        try:
+            return real_import(name, globals, locals, fromlist, level)
+        finally:
+            _, nested = stack.pop()
+            elapsed = time.time() - start
+            if level != 0 and globals:
+                # This may have been an implicit relative import, of a
+                # module in the importer's package:
+                importer = globals.get('__name__', '')
+                if '__path__' not in globals:
+                    importer = importer.rpartition('.')[0]
+                if sys.modules.get(importer + '.' + package) is not None:
+                    package = importer.split('.')[0]
+            _imports[package] = _imports.get(package, 0) + elapsed - nested
+            if stack:
+                stack[-1][1] += elapsed
+
+    __builtin__.__import__ = timed_import
+
+
+if enabled:
+    _install_import_timer()
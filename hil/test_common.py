@@ -17,9 +17,11 @@ from hil.migrations import create_db
 from hil.network_allocator import get_network_allocator
 from hil.config import cfg
 from hil.rest import app, init_auth
-from hil import api, config
+from hil import api, cache, config
 from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
 import json
+import sqlalchemy
 import subprocess
 import sys
 import os.path
@@ -123,6 +125,9 @@ def newDB():
     with app.app_context():
         init_db()
         create_db()
+    # Generations start over in a new database, so responses cached against
+    # the old one could otherwise look valid:
+    cache.responses.clear()
 
 
 def releaseDB():
@@ -188,6 +193,29 @@ class LoggedWarningError(Exception):
         return 'LoggedWarningError(%r)' % self.record
 
 
+@contextmanager
+def count_queries():
+    """Record the SQL statements executed in the body of a ``with`` statement.
+
+    Yields a list, to which the statements are appended as they run; e.g.::
+
+        with count_queries() as statements:
+            api.show_node('node-99')
+        assert len(statements) <= 6
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.engine
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        sqlalchemy.event.remove(engine, 'before_cursor_execute', record)
+
+
 class ModelTest:
     """Superclass with tests common to all models.
 
@@ -340,14 +368,15 @@ def additional_db():
     runway = db.session.query(Project).filter_by(label="runway").one()
 
     with app.app_context():
-        for node_label in ['runway_node_0', 'runway_node_1',
-                           'manhattan_node_0', 'manhattan_node_1']:
+        for i, node_label in enumerate(['runway_node_0', 'runway_node_1',
+                                        'manhattan_node_0',
+                                        'manhattan_node_1']):
 
             node = db.session.query(Node).filter_by(label=node_label).one()
             nic = db.session.query(Nic).filter_by(owner=node,
                                                   label='boot-nic').one()
 
-            port = Port('connected_port_0', switch)
+            port = Port('connected_port_%d' % i, switch)
             port.nic = nic
             nic.port = port
 
@@ -550,3 +579,194 @@ def initial_db():
         db.session.add(Node(label='no_nic_node', obm=obm))
 
         db.session.commit()
+
+
+class SwitchTranscript(object):
+    """Builder for synthetic switch console transcripts.
+
+    ``events`` is a list in the format returned by
+    ``hil.ext.switches._transcript.load``, suitable for passing to
+    ``replay_session``. Output is split into one chunk per line, which is
+    roughly how it arrives over telnet.
+
+    If ``page_prompt`` is given, ``paged`` inserts it every ``page_length``
+    lines, and expects the driver to answer it with a space.
+    """
+
+    def __init__(self, page_prompt=None, page_length=20):
+        self.events = []
+        self.page_prompt = page_prompt
+        self.page_length = page_length
+
+    def recv(self, data):
+        self.events.append(('recv', data))
+
+    def send(self, data):
+        self.events.append(('send', data))
+
+    def sendline(self, line):
+        self.send(line)
+        self.send('\n')
+
+    def paged(self, lines):
+        """Receive ``lines`` (the output of one command), paging as a switch
+        with a terminal length of ``page_length`` would.
+        """
+        for i, line in enumerate(lines):
+            if self.page_prompt is not None and \
+                    i != 0 and i % self.page_length == 0:
+                self.recv(self.page_prompt)
+                self.send(' ')
+            self.recv(line + '\r\n')
+
+
+def dell_transcript(ports, page_length=20):
+    """Build a transcript of a PowerConnect 55xx session.
+
+    The session logs in, and then runs ``show int sw`` on each of ``ports``,
+    a list of ``(label, native, enabled)`` triples. ``native`` and
+    ``enabled`` are inserted verbatim as the values of the "Trunking Native
+    Mode VLAN" and "Trunking VLANs Enabled" fields, so they may contain
+    tokens like "(Inactive)" and continuation lines.
+    """
+    t = SwitchTranscript(
+        page_prompt='More: <space>,  Quit: q or CTRL+Z, One line: <return> ',
+        page_length=page_length)
+    t.recv('User Name:')
+    t.sendline('admin')
+    t.recv('Password:')
+    t.sendline('secret')
+    t.recv('\r\nconsole#')
+    for label, native, enabled in ports:
+        t.sendline('show int sw %s' % label)
+        t.recv('show int sw %s\r\n' % label)
+        t.paged(['Name: %s' % label,
+                 'Switchport: enable',
+                 'Administrative Mode: trunk',
+                 'Operational Mode: up',
+                 'Access Mode VLAN: 1',
+                 'Access Multicast TV VLAN: none',
+                 'Trunking Native Mode VLAN: %s' % native,
+                 'Trunking VLANs Enabled: %s' % enabled,
+                 'General PVID: 1',
+                 'General VLANs Enabled: none',
+                 'General Egress Tagged VLANs Enabled: none',
+                 'General Forbidden VLANS: none',
+                 'General Ingress Filtering: enabled',
+                 'General Acceptable Frame Type: all',
+                 'General GVRP status: disabled',
+                 'Customer Mode VLAN: none',
+                 'Private-vlan promiscuous-association primary VLAN: none',
+                 'Private-vlan promiscuous-association secondary VLANs: none',
+                 'Private-vlan host-association primary VLAN: none',
+                 'Private-vlan host-association secondary VLAN: none',
+                 '',
+                 'Classification rules:'])
+        t.recv('\r\nconsole#')
+    return t.events
+
+
+def n3000_transcript(ports, dummy_vlan):
+    """Build a transcript of a Dell N3000 session.
+
+    Like ``dell_transcript``, except that the values of ``ports`` are used
+    for the "Trunking Mode Native VLAN" and "Trunking Mode VLANs Enabled"
+    fields. The N3000 driver expects each interface's configuration to
+    arrive in one chunk, so it isn't split or paged.
+    """
+    t = SwitchTranscript()
+    t.recv('User:')
+    t.sendline('admin')
+    t.recv('Password:')
+    t.sendline('secret')
+    t.recv('\r\nconsole>')
+    t.sendline('en')
+    t.recv('en\r\n\r\nconsole#')
+    t.sendline('config')
+    t.recv('config\r\n\r\nconsole(config)#')
+    t.sendline('vlan ' + dummy_vlan)
+    t.recv('vlan %s\r\n\r\nconsole(config-vlan%s)#' % (dummy_vlan, dummy_vlan))
+    t.sendline('exit')
+    t.recv('exit\r\n\r\nconsole(config)#')
+    t.sendline('exit')
+    t.recv('exit\r\n\r\nconsole#')
+    for label, native, enabled in ports:
+        t.sendline('show int sw %s' % label)
+        t.recv('\r\n'.join([
+            'show int sw %s' % label,
+            '',
+            'Port: %s' % label.capitalize(),
+            'VLAN Membership Mode: Trunk Mode',
+            'Access Mode VLAN: 1 (default)',
+            'General Mode PVID: 1 (default)',
+            'General Mode Ingress Filtering: Enabled',
+            'General Mode Acceptable Frame Type: Admit All',
+            'General Mode Dynamically Added VLANs:',
+            'General Mode Untagged VLANs: 1',
+            'General Mode Tagged VLANs:',
+            'General Mode Forbidden VLANs:',
+            'Trunking Mode Native VLAN: %s' % native,
+            'Trunking Mode Native VLAN Tagging: Disabled',
+            'Trunking Mode VLANs Enabled: %s' % enabled,
+            'Protected Port: False',
+            '',
+            'console#',
+        ]))
+        t.sendline('\n')
+        t.recv('\r\nconsole#')
+        t.recv('\r\nconsole#')
+    return t.events
+
+
+def nexus_transcript(ports, page_length=20):
+    """Build a transcript of a Nexus session.
+
+    The session logs in and runs ``show int sw``, which lists all of
+    ``ports`` in a single paged dump. The values of ``ports`` are used for
+    the "Trunking Native Mode VLAN" and "Trunking VLANs Allowed" fields.
+    """
+    t = SwitchTranscript(page_prompt=' --More-- ', page_length=page_length)
+    t.recv('login: ')
+    t.sendline('admin')
+    t.recv('Password: ')
+    t.sendline('secret')
+    t.recv('\r\nswitch# ')
+    t.sendline('show int sw')
+    t.recv('show int sw\r\n')
+    lines = []
+    for label, native, allowed in ports:
+        lines.extend(['Name: %s' % label,
+                      '  Switchport: Enabled',
+                      '  Switchport Monitor: Not enabled',
+                      '  Operational Mode: trunk',
+                      '  Access Mode VLAN: 1 (default)',
+                      '  Trunking Native Mode VLAN: %s' % native,
+                      '  Trunking VLANs Allowed: %s' % allowed,
+                      '  Pruning VLANs Enabled: 2-1001',
+                      '  Voice VLAN: none',
+                      '  Extended Trust State : not trusted [COS = 0]',
+                      '  Administrative private-vlan primary '
+                      'host-association: none',
+                      '  Administrative private-vlan trunk native VLAN: none',
+                      '  Operational private-vlan: none',
+                      ''])
+    t.paged(lines)
+    t.recv('\r\nswitch# ')
+    return t.events
+
+
+def replay_session(switch, events, strict=False):
+    """Open a session on ``switch``, whose console replays ``events``.
+
+    ``switch`` must be one of the telnet-based switches, which connect via
+    ``hil.ext.switches._console.spawn``. Returns the session; the console
+    (a ``ReplayConsole``) is available as its ``console`` attribute.
+    """
+    from hil.ext.switches import _console, _transcript
+    console = _transcript.ReplayConsole(events, strict=strict)
+    spawn = _console.spawn
+    _console.spawn = lambda switch, command: console
+    try:
+        return switch.session()
+    finally:
+        _console.spawn = spawn
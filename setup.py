@@ -57,9 +57,13 @@ setup(name='hil',
               'migrations/alembic.ini',
               'migrations/script.py.mako',
               'migrations/versions/*.py',
+              'migrations/versions/heads.json',
           ],
-          'hil.ext.obm': ['migrations/*/*.py'],
-          'hil.ext.switches': ['migrations/*/*.py'],
+          'hil.ext.network_allocators': ['migrations/*/*.py',
+                                         'migrations/*/heads.json'],
+          'hil.ext.obm': ['migrations/*/*.py', 'migrations/*/heads.json'],
+          'hil.ext.switches': ['migrations/*/*.py',
+                               'migrations/*/heads.json'],
       },
       zip_safe=False,  # migrations folder needs to be extracted to work.
 
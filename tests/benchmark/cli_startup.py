@@ -0,0 +1,130 @@
+# Copyright 2017 Massachusetts Open Cloud Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS
+# IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+"""Benchmark for the startup time of the ``hil`` command line tool.
+
+Client commands (e.g. ``hil list_nodes all``) should only import the client
+library; see ``hil.cli``. This runs a client command, and for comparison
+imports the server side of HIL, each in a fresh interpreter, and reports
+the time taken and which of the server's modules were imported. Run it
+directly for a report:
+
+    python tests/benchmark/cli_startup.py
+
+or via py.test, which checks that the client command imports none of the
+server's modules, and takes well under the time needed to import them.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Modules which client commands mustn't import:
+SERVER_MODULES = [
+    'alembic',
+    'flask',
+    'flask_sqlalchemy',
+    'sqlalchemy',
+    'werkzeug',
+    'hil.api',
+    'hil.migrations',
+    'hil.model',
+    'hil.server',
+]
+
+# Runs a client command against an endpoint which refuses connections, so
+# that nothing but startup takes any time. The command runs as root when
+# this is run as root, so the check for that is skipped:
+CLIENT_SCRIPT = """
+from hil import cli
+cli.ensure_not_root = lambda: None
+sys.argv = ['hil', 'list_nodes', 'all']
+try:
+    cli.main()
+except SystemExit:
+    pass
+"""
+
+SERVER_SCRIPT = """
+from hil import api, migrations, server
+"""
+
+_RUN = """
+import json, sys, time
+start = time.time()
+%s
+elapsed = time.time() - start
+json.dump({'seconds': elapsed,
+           'modules': [name for name in %r if name in sys.modules]},
+          sys.__stdout__)
+"""
+
+
+def _run(script):
+    """Run `script` in a fresh interpreter, and report on its startup.
+
+    Returns a dict with the keys ``seconds`` (the time taken to run the
+    script) and ``modules`` (those of `SERVER_MODULES` it imported).
+
+    The script runs in an empty directory, so that no ``hil.cfg`` is found.
+    """
+    env = dict(os.environ, HIL_ENDPOINT='http://127.0.0.1:1')
+    env.pop('HIL_USERNAME', None)
+    env.pop('HIL_PASSWORD', None)
+    path = [os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))]
+    if 'PYTHONPATH' in env:
+        path.append(env['PYTHONPATH'])
+    env['PYTHONPATH'] = os.pathsep.join(path)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        output = subprocess.check_output(
+            [sys.executable, '-c', _RUN % (script, SERVER_MODULES)],
+            cwd=tmpdir, env=env, stderr=open(os.devnull, 'w'))
+    finally:
+        os.rmdir(tmpdir)
+    return json.loads(output.splitlines()[-1])
+
+
+def benchmark(repeat=3):
+    """Benchmark a client command, and importing the server.
+
+    Returns a dictionary with the keys ``client`` and ``server``, whose
+    values are as for `_run`, with the best time over `repeat` runs.
+    """
+    results = {}
+    for name, script in ('client', CLIENT_SCRIPT), ('server', SERVER_SCRIPT):
+        runs = [_run(script) for _ in range(repeat)]
+        results[name] = min(runs, key=lambda run: run['seconds'])
+    return results
+
+
+def test_client_startup():
+    results = benchmark(repeat=1)
+    assert results['client']['modules'] == []
+    assert results['client']['seconds'] < results['server']['seconds'] / 2
+
+
+def main():
+    results = benchmark()
+    print '%-8s %10s  %s' % ('', 'seconds', 'server modules imported')
+    for name in 'client', 'server':
+        print '%-8s %10.3f  %s' % (name,
+                                   results[name]['seconds'],
+                                   ', '.join(results[name]['modules']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+# Copyright 2017 Massachusetts Open Cloud Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS
+# IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+"""Benchmark for looking objects up by label, as the API does.
+
+Builds an in-memory sqlite database of nodes with two nics each, twice: once
+with HIL's schema, and once with its unique constraints and indexes
+stripped (the schema before they were added). It then times looking up
+nodes by label (as ``hil.api._must_find`` does) and nics by node and label
+(as ``hil.api._must_find_n`` does) in each. Run it directly for a report:
+
+    python tests/benchmark/label_lookups.py [num_nodes]
+
+``num_nodes`` defaults to 100,000. Via py.test, the benchmark runs on a
+small database, and we check that the lookups actually use the indexes.
+"""
+
+import random
+import sys
+import time
+
+import sqlalchemy as sa
+
+from hil import model
+
+DEFAULT_NUM_NODES = 100000
+NICS_PER_NODE = 2
+
+# The maximum number of rows to insert with each statement:
+_CHUNK = 10000
+
+
+def _schema(indexed):
+    """Return a copy of HIL's schema.
+
+    If `indexed` is false, the copy has no unique constraints or indexes.
+    """
+    metadata = sa.MetaData()
+    for table in model.db.metadata.sorted_tables:
+        table = table.tometadata(metadata)
+        if not indexed:
+            for column in table.columns:
+                column.unique = column.index = None
+            table.indexes.clear()
+            table.constraints = set(
+                constraint for constraint in table.constraints
+                if not isinstance(constraint, sa.UniqueConstraint))
+    return metadata
+
+
+def _insert(engine, table, rows):
+    for i in range(0, len(rows), _CHUNK):
+        engine.execute(table.insert(), rows[i:i + _CHUNK])
+
+
+def _database(num_nodes, indexed):
+    """Create and populate a database; return ``(engine, metadata)``."""
+    engine = sa.create_engine('sqlite://')
+    metadata = _schema(indexed)
+    metadata.create_all(engine)
+    _insert(engine, metadata.tables['node'],
+            [{'id': i, 'label': 'node-%d' % i, 'obm_id': i}
+             for i in range(num_nodes)])
+    _insert(engine, metadata.tables['nic'],
+            [{'id': i * NICS_PER_NODE + j,
+              'owner_id': i,
+              'label': 'eth%d' % j,
+              'mac_addr': '%012x' % (i * NICS_PER_NODE + j)}
+             for i in range(num_nodes)
+             for j in range(NICS_PER_NODE)])
+    return engine, metadata
+
+
+def _queries(metadata):
+    """Return the lookup queries to benchmark.
+
+    The result is a dictionary mapping names to ``(query, make_params)``
+    pairs, where ``make_params(i)`` returns the parameters for looking up
+    the ``i``th node (or one of its nics).
+    """
+    node = metadata.tables['node']
+    nic = metadata.tables['nic']
+    return {
+        'node': (sa.select([node]).where(node.c.label == sa.bindparam('n')),
+                 lambda i: {'n': 'node-%d' % i}),
+        'nic': (sa.select([nic]).where(sa.and_(
+            nic.c.owner_id == sa.bindparam('o'),
+            nic.c.label == sa.bindparam('n'))),
+            lambda i: {'o': i, 'n': 'eth%d' % (i % NICS_PER_NODE)}),
+    }
+
+
+def query_plans(num_nodes=100):
+    """Return sqlite's plans for the lookup queries, with HIL's schema.
+
+    The result maps the names of the queries to their plans (strings).
+    """
+    engine, metadata = _database(num_nodes, indexed=True)
+    result = {}
+    for name, (query, make_params) in _queries(metadata).items():
+        compiled = query.compile(engine)
+        params = compiled.construct_params(make_params(0))
+        rows = engine.execute('EXPLAIN QUERY PLAN ' + str(compiled),
+                              *[params[key] for key in compiled.positiontup])
+        result[name] = '\n'.join(row[-1] for row in rows)
+    return result
+
+
+def benchmark(num_nodes=DEFAULT_NUM_NODES, lookups=200, indexed=True):
+    """Benchmark label lookups in a database of `num_nodes` nodes.
+
+    Returns a dictionary mapping the names of the lookups ('node' and
+    'nic') to the mean time per lookup, in seconds, over `lookups` lookups
+    of random objects.
+    """
+    engine, metadata = _database(num_nodes, indexed)
+    rand = random.Random(0)
+    targets = [rand.randrange(num_nodes) for _ in range(lookups)]
+    result = {}
+    conn = engine.connect()
+    try:
+        for name, (query, make_params) in _queries(metadata).items():
+            start = time.time()
+            for i in targets:
+                assert conn.execute(query, make_params(i)).fetchone()
+            result[name] = (time.time() - start) / lookups
+    finally:
+        conn.close()
+    return result
+
+
+def test_benchmark():
+    benchmark(num_nodes=1000, lookups=10, indexed=False)
+    benchmark(num_nodes=1000, lookups=10)
+
+
+def test_lookups_use_indexes():
+    for name, plan in query_plans().items():
+        assert 'USING INDEX' in plan, (name, plan)
+
+
+def main():
+    if len(sys.argv) > 1:
+        num_nodes = int(sys.argv[1])
+    else:
+        num_nodes = DEFAULT_NUM_NODES
+    print '%d nodes, %d nics per node' % (num_nodes, NICS_PER_NODE)
+    print '%-8s %16s %16s %10s' % ('lookup', 'unindexed usec', 'indexed usec',
+                                   'speedup')
+    before = benchmark(num_nodes, indexed=False)
+    after = benchmark(num_nodes)
+    for name in sorted(before):
+        print '%-8s %16.1f %16.1f %9.0fx' % (
+            name,
+            before[name] * 1e6,
+            after[name] * 1e6,
+            before[name] / after[name],
+        )
+
+
+if __name__ == '__main__':
+    main()
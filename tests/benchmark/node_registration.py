@@ -0,0 +1,128 @@
+# Copyright 2017 Massachusetts Open Cloud Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS
+# IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+"""Benchmark for registering a delivery of nodes, with their nics.
+
+Registers the same nodes (each with an obm, ``NICS_PER_NODE`` nics and a
+metadata entry) in a fresh in-memory sqlite database, twice: one API call
+at a time (``node_register``, then ``node_register_nic`` for each nic), and
+with a single call to ``node_register_many``. The calls are made directly,
+so this leaves out the cost of the HTTP requests, which only widens the gap
+between the two. Run it directly for a report:
+
+    python tests/benchmark/node_registration.py [num_nodes]
+
+``num_nodes`` defaults to 500. Via py.test, the benchmark runs on a few
+nodes, and we check that both ways register the same things.
+"""
+
+import json
+import sys
+import time
+
+from hil import api, config, model, server
+from hil.flaskapp import app
+from hil.rest import init_auth
+from hil.test_common import config_testsuite, config_merge, newDB, releaseDB
+
+DEFAULT_NUM_NODES = 500
+NICS_PER_NODE = 4
+OBM_TYPE_MOCK = 'http://schema.massopencloud.org/haas/v0/obm/mock'
+
+
+def _configure():
+    config_testsuite()
+    config_merge({'extensions': {'hil.ext.obm.mock': ''}})
+    config.load_extensions()
+    server.register_drivers()
+
+
+def _nodes(num_nodes):
+    """Return the nodes to register, as `node_register_many` takes them."""
+    return [{
+        'name': 'node-%d' % i,
+        'obm': {'type': OBM_TYPE_MOCK,
+                'host': 'ipmi-%d' % i,
+                'user': 'root',
+                'password': 'secret'},
+        'nics': [{'label': 'eth%d' % j,
+                  'macaddr': '%010x%02x' % (i, j)}
+                 for j in range(NICS_PER_NODE)],
+        'metadata': {'rack': i // 40},
+    } for i in range(num_nodes)]
+
+
+def one_at_a_time(nodes):
+    for node in nodes:
+        api.node_register(node['name'], obm=node['obm'],
+                          metadata=node['metadata'])
+        for nic in node['nics']:
+            api.node_register_nic(node['name'], nic['label'], nic['macaddr'])
+
+
+def bulk(nodes):
+    api.node_register_many(nodes)
+
+
+def _registered():
+    """Return the nodes in the database, in the format of `show_node`."""
+    return [json.loads(api.show_node(label)) for (label,) in
+            model.db.session.query(model.Node.label)
+            .order_by(model.Node.label)]
+
+
+def benchmark(num_nodes=DEFAULT_NUM_NODES):
+    """Benchmark registering `num_nodes` nodes, each way.
+
+    Returns a dictionary mapping the names of the ways ('one_at_a_time' and
+    'bulk') to pairs ``(seconds, nodes)``, where `nodes` is what ended up in
+    the database (see `_registered`).
+    """
+    result = {}
+    for register in one_at_a_time, bulk:
+        nodes = _nodes(num_nodes)
+        newDB()
+        try:
+            with app.test_request_context():
+                init_auth()
+                start = time.time()
+                register(nodes)
+                seconds = time.time() - start
+                result[register.__name__] = (seconds, _registered())
+        finally:
+            releaseDB()
+    return result
+
+
+def test_benchmark():
+    _configure()
+    result = benchmark(num_nodes=5)
+    assert result['bulk'][1] == result['one_at_a_time'][1]
+
+
+def main():
+    if len(sys.argv) > 1:
+        num_nodes = int(sys.argv[1])
+    else:
+        num_nodes = DEFAULT_NUM_NODES
+    _configure()
+    result = benchmark(num_nodes)
+    print '%d nodes, %d nics per node' % (num_nodes, NICS_PER_NODE)
+    for name in 'one_at_a_time', 'bulk':
+        print '%-14s %8.3fs' % (name, result[name][0])
+    print 'speedup        %8.0fx' % (result['one_at_a_time'][0] /
+                                     result['bulk'][0])
+
+
+if __name__ == '__main__':
+    main()
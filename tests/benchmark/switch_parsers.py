@@ -0,0 +1,203 @@
+# Copyright 2017 Massachusetts Open Cloud Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS
+# IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+"""Benchmarks for the telnet switch drivers' output parsers.
+
+Each benchmark replays a synthetic transcript of a 52 port switch (see
+``hil.test_common``) into a driver's ``get_port_networks``, and reports the
+time and memory allocated per port. Run it directly for a report:
+
+    python tests/benchmark/switch_parsers.py
+
+or via py.test, which runs each benchmark briefly and checks the results
+(use ``-s`` to see the numbers).
+
+The peak memory allocated while parsing is measured with ``tracemalloc``
+where it is available (it is part of the standard library as of Python
+3.4, and available for 2.7 as ``pytracemalloc``). We also count the objects
+left behind by the parser, which works anywhere and catches leaks.
+"""
+
+import gc
+import pexpect
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from hil import model
+from hil.test_common import dell_transcript, n3000_transcript, \
+    nexus_transcript, replay_session
+
+NUM_PORTS = 52
+
+
+class _NoSleep(object):
+    """Stands in for the ``time`` module inside pexpect.
+
+    pexpect's expect loop sleeps briefly between reads, which is sensible
+    for a real console, but would dominate the measurements here.
+    """
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+    def sleep(self, secs):
+        pass
+
+
+def _dell(page_length):
+    from hil.ext.switches.dell import PowerConnect55xx
+    switch = PowerConnect55xx(label='sw0',
+                              hostname='sw0.example.com',
+                              username='admin',
+                              password='secret')
+    labels = ['gi1/0/%d' % i for i in range(1, NUM_PORTS + 1)]
+    events = dell_transcript([(label,
+                               '%d (Inactive)' % i,
+                               '1,%d,\r\n    %d (Inactive)' % (i, i + 1000))
+                              for i, label in enumerate(labels, 100)],
+                             page_length=page_length)
+    return switch, labels, events
+
+
+def _n3000(page_length):
+    from hil.ext.switches.n3000 import DellN3000
+    switch = DellN3000(label='sw0',
+                       hostname='sw0.example.com',
+                       username='admin',
+                       password='secret',
+                       dummy_vlan='2222')
+    labels = ['gi1/0/%d' % i for i in range(1, NUM_PORTS + 1)]
+    events = n3000_transcript([(label,
+                                '%d (Inactive)' % i,
+                                '1,%d,%d (Inactive)' % (i, i + 1000))
+                               for i, label in enumerate(labels, 100)],
+                              dummy_vlan='2222')
+    return switch, labels, events
+
+
+def _nexus(page_length):
+    from hil.ext.switches.nexus import Nexus
+    switch = Nexus(label='sw0',
+                   hostname='sw0.example.com',
+                   username='admin',
+                   password='secret',
+                   dummy_vlan='2222')
+    labels = ['Ethernet1/%d' % i for i in range(1, NUM_PORTS + 1)]
+    events = nexus_transcript([(label,
+                                '%d (Inactive)' % i,
+                                '1,%d,%d (Inactive)' % (i, i + 1000))
+                               for i, label in enumerate(labels, 100)],
+                              page_length=page_length)
+    return switch, labels, events
+
+
+DRIVERS = {
+    'dell': _dell,
+    'n3000': _n3000,
+    'nexus': _nexus,
+}
+
+
+def _expected(ports):
+    return dict((port, [('vlan/1', 1),
+                        ('vlan/%d' % i, i),
+                        ('vlan/%d' % (i + 1000), i + 1000),
+                        ('vlan/native', i)])
+                for i, port in enumerate(ports, 100))
+
+
+def benchmark(driver, repeat=10, page_length=24):
+    """Benchmark ``get_port_networks`` for ``driver`` (a key in DRIVERS).
+
+    Returns a dictionary with the keys:
+
+    * ``seconds_per_port`` - the best time over ``repeat`` runs.
+    * ``peak_bytes_per_port`` - peak memory allocated while parsing, or None
+      if tracemalloc isn't available.
+    * ``retained_objects_per_port`` - objects (tracked by the garbage
+      collector) still alive after parsing and discarding the results.
+    """
+    switch, labels, events = DRIVERS[driver](page_length)
+    ports = [model.Port(label=label, switch=switch) for label in labels]
+    expected = _expected(ports)
+
+    real_time = pexpect.time
+    pexpect.time = _NoSleep()
+    try:
+        best = None
+        for i in range(repeat):
+            session = replay_session(switch, events)
+            start = time.time()
+            result = session.get_port_networks(ports)
+            elapsed = time.time() - start
+            assert result == expected
+            if best is None or elapsed < best:
+                best = elapsed
+
+        session = replay_session(switch, events)
+        gc.collect()
+        before = len(gc.get_objects())
+        if tracemalloc is not None:
+            tracemalloc.start()
+        session.get_port_networks(ports)
+        if tracemalloc is not None:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        else:
+            peak = None
+        gc.collect()
+        retained = len(gc.get_objects()) - before
+    finally:
+        pexpect.time = real_time
+
+    return {
+        'seconds_per_port': best / len(ports),
+        'peak_bytes_per_port': None if peak is None
+        else float(peak) / len(ports),
+        'retained_objects_per_port': float(retained) / len(ports),
+    }
+
+
+def test_dell():
+    benchmark('dell', repeat=1)
+
+
+def test_n3000():
+    benchmark('n3000', repeat=1)
+
+
+def test_nexus():
+    benchmark('nexus', repeat=1)
+
+
+def main():
+    print '%d ports per switch' % NUM_PORTS
+    print '%-8s %12s %16s %18s' % ('driver', 'usec/port', 'peak bytes/port',
+                                   'retained objs/port')
+    for driver in sorted(DRIVERS):
+        result = benchmark(driver)
+        peak = result['peak_bytes_per_port']
+        print '%-8s %12.1f %16s %18.1f' % (
+            driver,
+            result['seconds_per_port'] * 1e6,
+            '-' if peak is None else '%.1f' % peak,
+            result['retained_objects_per_port'],
+        )
+
+
+if __name__ == '__main__':
+    main()
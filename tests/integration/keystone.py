@@ -4,6 +4,10 @@ Note that these require a keystone instance to be installed and running, with
 a specific configuration and database contents. The script
 "ci/keystone/keystone.sh" at the root of the repository can be used to set
 this up. This is done automatically in our travis config.
+
+Keystonemiddleware's token cache is pointed at `FakeMemcached`, a minimal
+stand-in for memcached, so that the cache is exercised too; this requires
+the python-memcached library.
 """
 from hil import test_common as tc
 from hil.test_common import fail_on_log_warnings
@@ -11,9 +15,10 @@ from hil import server, config, model, rest, auth
 from hil.flaskapp import app
 import pytest
 import requests
+import SocketServer
 import time
 from schema import Schema
-from threading import Thread
+from threading import Lock, Thread
 
 from keystoneauth1.identity import v3
 from keystoneauth1 import session
@@ -68,8 +73,87 @@ def _get_keystone_session(username, password, project_name):
     return session.Session(auth=auth)
 
 
+class FakeMemcached(SocketServer.ThreadingTCPServer):
+    """A minimal, in-memory stand-in for memcached.
+
+    This speaks enough of memcached's text protocol for keystonemiddleware's
+    token cache (``get``, ``set``, ``add``, ``replace`` and ``delete``), and
+    counts cache hits and misses so tests can check the cache is used.
+    Expiry times are ignored.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        SocketServer.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0),
+                                                 _FakeMemcachedHandler)
+        self.items = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    @property
+    def address(self):
+        return '%s:%d' % self.server_address
+
+
+class _FakeMemcachedHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        server = self.server
+        for line in iter(self.rfile.readline, ''):
+            args = line.split()
+            if not args:
+                continue
+            command = args[0]
+            if command in ('get', 'gets'):
+                with server.lock:
+                    for key in args[1:]:
+                        if key not in server.items:
+                            server.misses += 1
+                            continue
+                        server.hits += 1
+                        flags, data = server.items[key]
+                        self.wfile.write('VALUE %s %s %d\r\n%s\r\n' %
+                                         (key, flags, len(data), data))
+                self.wfile.write('END\r\n')
+            elif command in ('set', 'add', 'replace'):
+                key, flags, _, size = args[1:5]
+                data = self.rfile.read(int(size) + 2)[:-2]
+                with server.lock:
+                    exists = key in server.items
+                    if (command == 'add' and exists) or \
+                            (command == 'replace' and not exists):
+                        self.wfile.write('NOT_STORED\r\n')
+                        continue
+                    server.items[key] = (flags, data)
+                self.wfile.write('STORED\r\n')
+            elif command == 'delete':
+                with server.lock:
+                    found = server.items.pop(args[1], None) is not None
+                self.wfile.write('DELETED\r\n' if found
+                                 else 'NOT_FOUND\r\n')
+            elif command == 'version':
+                self.wfile.write('VERSION 1.4.0-fake\r\n')
+            elif command == 'quit':
+                return
+            else:
+                self.wfile.write('ERROR\r\n')
+
+
+@pytest.yield_fixture
+def memcached():
+    """Run a `FakeMemcached` in the background, for the duration of a test."""
+    server = FakeMemcached()
+    Thread(target=server.serve_forever).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
 @pytest.fixture
-def configure():
+def configure(memcached):
     """Fixture which setups up hil.cfg, and loads extensions and such."""
     tc.config_testsuite()
     tc.config_merge({
@@ -85,6 +169,7 @@ def configure():
             'project_name': 'admin',
             'admin_user': 'admin',
             'admin_password': 's3cr3t',
+            'memcached_servers': memcached.address,
         },
     })
     # the keystone client library actually bombs out if we don't configure
@@ -309,3 +394,20 @@ def test_unregistered_admin():
         "Status code for admin-only call by non-registered admin project "
         "should still succeed."
     )
+
+
+def test_token_cache(keystone_projects, memcached):
+    # Tokens validated by keystonemiddleware should be cached in memcached,
+    # so that repeated requests with the same token don't go to keystone:
+    sess = _get_keystone_session(username='nova',
+                                 password='nova',
+                                 project_name='service')
+    resp = _do_get(sess, 'anyone')
+    assert 200 <= resp.status_code < 300
+    assert memcached.items, "The validated token should have been cached."
+    hits = memcached.hits
+    resp = _do_get(sess, 'anyone')
+    assert 200 <= resp.status_code < 300
+    assert memcached.hits > hits, (
+        "The second request should have been served from the token cache."
+    )
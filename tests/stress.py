@@ -85,8 +85,15 @@ def test_many_http_queries():
             # At least make sure the body parses:
             json.loads(resp.get_data())
 
+    def _show_nodes_bulk(path):
+        """Like _show_nodes, but fetches the details in one request."""
+        resp = client.get(path + '/details')
+        assert resp.status_code == 200
+        json.loads(resp.get_data())
+
     for i in range(100):
         _show_nodes('/nodes/free')
+        _show_nodes_bulk('/nodes/free')
         resp = client.get('/projects')
         assert resp.status_code == 200
         for project in json.loads(resp.get_data()):
@@ -8,6 +8,7 @@ these cases before actually adding authentication and authorization to
 the mix. They are still tested here, since they are important for security.
 """
 
+import json
 import pytest
 import unittest
 from hil import api, config, model, server, deferred
@@ -555,6 +556,56 @@ auth_call_params += [
          project='runway',
          args=['manhattan']),
 
+    #
+    # list_nodes
+    #
+
+    # Legal Cases
+    # Project lists the details of free nodes.
+    dict(fn=api.list_nodes,
+         error=None,
+         admin=False,
+         project='runway',
+         args=['free'],
+         kwargs={'fields': 'name,metadata'}),
+
+    # Project lists just the names of all nodes.
+    dict(fn=api.list_nodes,
+         error=None,
+         admin=False,
+         project='runway',
+         args=['all'],
+         kwargs={'fields': 'name'}),
+
+    #
+    # show_nodes
+    #
+
+    # Legal Cases
+    # Project shows free nodes.
+    dict(fn=api.show_nodes,
+         error=None,
+         admin=False,
+         project='runway',
+         args=['free']),
+
+    # Project shows its own and free nodes by name.
+    dict(fn=api.show_nodes,
+         error=None,
+         admin=False,
+         project='runway',
+         args=['all'],
+         kwargs={'nodes': 'runway_node_0,free_node_0'}),
+
+    # Illegal Cases
+    # Project shows another project's node by name.
+    dict(fn=api.show_nodes,
+         error=AuthorizationError,
+         admin=False,
+         project='runway',
+         args=['all'],
+         kwargs={'nodes': 'runway_node_0,manhattan_node_0'}),
+
     #
     # show_node
     #
@@ -643,6 +694,12 @@ admin_calls = [
     (api.node_set_metadata, ['free_node_0', 'EK', 'pk'], {}),
     (api.node_delete_metadata, ['runway_node_0', 'EK'], {}),
     (api.port_revert, ['stock_switch_0', 'free_node_0_port'], {}),
+
+    # Listing nodes by switch, or with details of nodes in any project:
+    (api.list_nodes, ['all'], {'switch': 'stock_switch_0'}),
+    (api.list_nodes, ['all'], {'fields': 'name,project'}),
+    (api.show_nodes, ['all'], {}),
+    (api.show_nodes, ['allocated'], {}),
 ]
 
 
@@ -674,6 +731,11 @@ project_calls = [
 
     (api.list_project_headnodes, ['runway'], {}),
     (api.show_headnode, ['runway_headnode_on'], {}),
+
+    (api.list_nodes, ['all'], {'project': 'runway',
+                               'fields': 'name,metadata'}),
+    (api.list_project_nodes, ['runway'], {'fields': 'name,metadata'}),
+    (api.show_nodes, ['all'], {'project': 'runway'}),
 ]
 
 
@@ -741,3 +803,21 @@ class Test_node_detach_network(unittest.TestCase):
             api.node_detach_network('manhattan_node_0',
                                     'boot-nic',
                                     'stock_int_pub')
+
+
+class TestBatch:
+    """Each operation in a batch is authorized separately."""
+
+    def test_batch_unauthorized(self):
+        auth_backend = get_auth_backend()
+        auth_backend.set_project(
+            model.Project.query.filter_by(label='runway').one())
+        body, status = api.batch([
+            {'method': 'PUT',
+             'path': '/network/runway_new',
+             'body': {'owner': 'runway', 'access': 'runway', 'net_id': ''}},
+            {'method': 'PUT', 'path': '/project/runway_new'},
+        ])
+        assert status == 401
+        assert json.loads(body)['operation'] == 1
+        assert model.Network.query.filter_by(label='runway_new').count() == 0
@@ -19,6 +19,7 @@ from hil.test_common import *
 from hil.network_allocator import get_network_allocator
 import pytest
 import json
+import sqlalchemy
 import uuid
 
 MOCK_SWITCH_TYPE = 'http://schema.massopencloud.org/haas/v0/switches/mock'
@@ -506,6 +507,80 @@ class TestNodeRegisterDelete:
             api.node_delete('node-99')
 
 
+class TestNodeRegisterMany:
+    """Tests for hil.api.node_register_many."""
+
+    @staticmethod
+    def _node(name, nics=(), **metadata):
+        return {
+            'name': name,
+            'obm': {'type': OBM_TYPE_MOCK,
+                    'host': name + '-ipmi',
+                    'user': 'root',
+                    'password': 'tapeworm'},
+            'nics': [{'label': nic, 'macaddr': 'aa:bb:cc:dd:ee:%02x' % i}
+                     for i, nic in enumerate(nics)],
+            'metadata': metadata,
+        }
+
+    def test_register_many(self):
+        api.node_register_many([
+            self._node('node-1', ['eth0', 'eth1'], EK='pk', rack=4),
+            self._node('node-2'),
+        ])
+        node = json.loads(api.show_node('node-1'))
+        assert sorted((nic['label'], nic['macaddr'])
+                      for nic in node['nics']) == [
+            ('eth0', 'aa:bb:cc:dd:ee:00'),
+            ('eth1', 'aa:bb:cc:dd:ee:01'),
+        ]
+        assert node['metadata'] == {'EK': '"pk"', 'rack': '4'}
+        node = api._must_find(model.Node, 'node-2')
+        assert node.obm.host == 'node-2-ipmi'
+        assert node.nics == [] and node.metadata == []
+
+    def test_register_many_bulk_inserts(self):
+        generation = model.Generation.query.get('nic')
+        generation = 0 if generation is None else generation.generation
+        with count_queries() as statements:
+            api.node_register_many([
+                self._node('node-%d' % i, ['eth0', 'eth1'], EK='pk')
+                for i in range(10)])
+        # The nics and metadata are inserted with one statement each:
+        for table in 'nic', 'metadata':
+            assert len([s for s in statements
+                        if s.startswith('INSERT INTO %s ' % table)]) == 1
+        # ...and still invalidate cached responses:
+        assert model.Generation.query.get('nic').generation > generation
+        assert model.Nic.query.count() == 20
+
+    def test_register_many_errors(self):
+        api.node_register('node-1', obm=self._node('node-1')['obm'])
+        bad_type = self._node('node-4')
+        bad_type['obm']['type'] = 'http://example.com/no-such-obm'
+        bad_args = self._node('node-5')
+        del bad_args['obm']['password']
+        with pytest.raises(api.BulkError) as e:
+            api.node_register_many([
+                self._node('node-1'),
+                self._node('node-2'),
+                self._node('node-3', ['eth0', 'eth0']),
+                bad_type,
+                bad_args,
+                self._node('node-2'),
+            ])
+        assert [(name, error.__class__) for name, error in
+                e.value.errors] == [
+            ('node-1', api.DuplicateError),
+            ('node-3', api.DuplicateError),
+            ('node-4', api.BadArgumentError),
+            ('node-5', api.BadArgumentError),
+            ('node-2', api.DuplicateError),
+        ]
+        # Nothing was registered:
+        assert [node.label for node in model.Node.query] == ['node-1']
+
+
 class TestNodeRegisterDeleteNic:
 
     def test_node_register_nic(self):
@@ -1703,7 +1778,7 @@ class TestQuery_populated_db:
         deferred.apply_networking()
 
         actual = json.loads(
-            api.list_network_attachments('manhattan_runway_pxe'))
+            api.list_network_attachments('manhattan_runway_pxe').get_data())
         expected = {
             'manhattan_node_0':
                 {
@@ -1732,7 +1807,8 @@ class TestQuery_populated_db:
         deferred.apply_networking()
 
         actual = json.loads(
-            api.list_network_attachments('manhattan_runway_pxe', 'runway'))
+            api.list_network_attachments('manhattan_runway_pxe',
+                                         'runway').get_data())
         expected = {
             'runway_node_0':
                 {
@@ -2224,6 +2300,440 @@ class TestFancyNetworkCreate:
             assert network.network_id == '35'
 
 
+class TestObmJobs:
+    """Tests for queueing bulk obm operations."""
+
+    def _register_nodes(self):
+        api.project_create('anvil-nextgen')
+        for node in 'node-98', 'node-99', 'node-100':
+            api.node_register(node, obm={
+                "type": OBM_TYPE_MOCK,
+                "host": "host-" + node,
+                "user": "root",
+                "password": "tapeworm"})
+        api.project_connect_node('anvil-nextgen', 'node-99')
+        api.project_connect_node('anvil-nextgen', 'node-100')
+
+    def test_project(self):
+        self._register_nodes()
+        body, status = api.obm_jobs_create('power_cycle',
+                                           project='anvil-nextgen')
+        assert status == 202
+        jobs = json.loads(body)
+        assert [(job['node'], job['type'], job['status'])
+                for job in jobs] == [
+            ('node-100', 'power_cycle', 'pending'),
+            ('node-99', 'power_cycle', 'pending'),
+        ]
+        assert json.loads(api.show_obm_job(jobs[0]['id'])) == {
+            'id': jobs[0]['id'],
+            'node': 'node-100',
+            'type': 'power_cycle',
+            'bootdev': None,
+            'status': 'pending',
+            'error': None,
+        }
+
+    def test_nodes(self):
+        self._register_nodes()
+        body, status = api.obm_jobs_create('set_bootdev',
+                                           bootdev='pxe',
+                                           nodes=['node-99', 'node-98'])
+        jobs = json.loads(body)
+        assert [(job['node'], job['bootdev']) for job in jobs] == [
+            ('node-99', 'pxe'),
+            ('node-98', 'pxe'),
+        ]
+        assert model.ObmJob.query.count() == 2
+
+    @pytest.mark.parametrize('kwargs', [
+        {'type': 'reticulate_splines', 'project': 'anvil-nextgen'},
+        {'type': 'power_cycle', 'bootdev': 'pxe', 'project': 'anvil-nextgen'},
+        {'type': 'set_bootdev', 'project': 'anvil-nextgen'},
+        {'type': 'power_off'},
+        {'type': 'power_off', 'project': 'anvil-nextgen', 'nodes': []},
+    ])
+    def test_bad_arguments(self, kwargs):
+        self._register_nodes()
+        with pytest.raises(api.BadArgumentError):
+            api.obm_jobs_create(**kwargs)
+        assert model.ObmJob.query.count() == 0
+
+    def test_missing_node(self):
+        self._register_nodes()
+        with pytest.raises(api.NotFoundError) as e:
+            api.obm_jobs_create('power_off',
+                                nodes=['node-99', 'node-2', 'node-1'])
+        # All of the missing nodes are reported:
+        assert e.value.message == 'Node(s) node-1, node-2 do not exist.'
+        assert model.ObmJob.query.count() == 0
+
+    def test_missing_job(self):
+        with pytest.raises(api.NotFoundError):
+            api.show_obm_job(42)
+
+    def test_node_delete(self):
+        """Deleting a node deletes its jobs."""
+        self._register_nodes()
+        api.obm_jobs_create('power_off', nodes=['node-98'])
+        api.node_delete('node-98')
+        assert model.ObmJob.query.count() == 0
+
+
+class TestPowerStatus:
+    """Tests for reading (cached) power states."""
+
+    def _register_nodes(self):
+        api.project_create('anvil-nextgen')
+        for node in 'node-98', 'node-99':
+            api.node_register(node, obm={
+                "type": OBM_TYPE_MOCK,
+                "host": "host-" + node,
+                "user": "root",
+                "password": "tapeworm"})
+        api.project_connect_node('anvil-nextgen', 'node-99')
+
+    @staticmethod
+    def _refresh_jobs():
+        return [(job.node.label, job.status) for job in
+                model.ObmJob.query.filter_by(type='refresh_power_state')]
+
+    def test_node_power_status(self):
+        self._register_nodes()
+        # The state has never been read; we get a job to read it:
+        assert json.loads(api.node_power_status('node-99')) == {
+            'state': None,
+            'updated': None,
+            'error': None,
+        }
+        assert self._refresh_jobs() == [('node-99', 'pending')]
+        # Asking again doesn't queue another:
+        api.node_power_status('node-99')
+        assert self._refresh_jobs() == [('node-99', 'pending')]
+
+        # What the obm daemon would do:
+        node = api._must_find(model.Node, 'node-99')
+        node.refresh_power_state()
+        model.ObmJob.query.delete()
+        db.session.commit()
+        status = json.loads(api.node_power_status('node-99'))
+        assert status['state'] == 'off'
+        assert status['error'] is None
+        assert status['updated'] is not None
+        assert self._refresh_jobs() == []
+
+        # Once the cached state expires, it's still served, along with its
+        # timestamp, but it gets refreshed:
+        config_merge({'power-state': {'ttl': '0'}})
+        assert json.loads(api.node_power_status('node-99')) == status
+        assert self._refresh_jobs() == [('node-99', 'pending')]
+
+    def test_node_power_status_no_obm_calls(self, monkeypatch):
+        """The API server never reads the state from the obm itself."""
+        from hil.ext.obm.mock import MockObm
+
+        def power_status(self):
+            assert False, 'The API server read a power state'
+        monkeypatch.setattr(MockObm, 'power_status', power_status)
+        self._register_nodes()
+        config_merge({'power-state': {'ttl': '0'}})
+        api.node_power_status('node-99')
+        api.node_power_status('node-99')
+
+    def test_mock_power_state(self):
+        """The mock obm keeps its simulated power state in the database, so
+        the obm daemon sees what the API server did.
+        """
+        config_merge({'devel': {'dry_run': None}})
+        self._register_nodes()
+        api.node_power_cycle('node-99')
+        db.session.remove()
+        node = api._must_find(model.Node, 'node-99')
+        assert node.refresh_power_state().state == 'on'
+        api.node_power_off('node-99')
+        db.session.remove()
+        node = api._must_find(model.Node, 'node-99')
+        assert node.refresh_power_state().state == 'off'
+        # Other nodes are unaffected:
+        node = api._must_find(model.Node, 'node-98')
+        assert node.refresh_power_state().state == 'off'
+
+    def test_list_power_status(self):
+        self._register_nodes()
+        api._must_find(model.Node, 'node-99').refresh_power_state()
+        db.session.commit()
+        states = json.loads(api.list_power_status().get_data())
+        assert sorted(states.keys()) == ['node-98', 'node-99']
+        assert states['node-98'] == {
+            'state': None,
+            'updated': None,
+            'error': None,
+        }
+        assert states['node-99']['state'] == 'off'
+
+        states = json.loads(api.list_power_status(project='anvil-nextgen')
+                            .get_data())
+        assert states.keys() == ['node-99']
+
+    def test_list_power_status_no_project(self):
+        with pytest.raises(api.NotFoundError):
+            api.list_power_status(project='anvil-nextgen')
+
+    def test_node_delete(self):
+        """Deleting a node deletes its cached power state."""
+        self._register_nodes()
+        api._must_find(model.Node, 'node-98').refresh_power_state()
+        db.session.commit()
+        api.node_delete('node-98')
+        assert model.PowerState.query.count() == 0
+
+
+class TestListPagination:
+    """Tests for the pagination, filtering and fields of the list calls."""
+
+    def _register_nodes(self, *nodes):
+        for node in nodes:
+            api.node_register(node, obm={
+                "type": OBM_TYPE_MOCK,
+                "host": "host-" + node,
+                "user": "root",
+                "password": "tapeworm"})
+
+    def _pages(self, call, *args, **kwargs):
+        """Return the list of pages returned by `call`, following cursors."""
+        pages = []
+        while True:
+            response = call(*args, **kwargs)
+            if not isinstance(response, tuple):
+                pages.append(json.loads(response))
+                return pages
+            body, status, headers = response
+            assert status == 200
+            pages.append(json.loads(body))
+            kwargs['cursor'] = headers['X-Next-Cursor']
+
+    def test_list_nodes_pages(self):
+        self._register_nodes('node-3', 'node-1', 'node-4', 'node-0', 'node-2')
+        assert self._pages(api.list_nodes, 'all', limit=2) == [
+            ['node-0', 'node-1'],
+            ['node-2', 'node-3'],
+            ['node-4'],
+        ]
+        assert self._pages(api.list_nodes, 'all', limit=5) == [
+            ['node-0', 'node-1', 'node-2', 'node-3', 'node-4'],
+        ]
+
+    def test_cursor_after_delete(self):
+        """Cursors stay valid when the nodes around them are deleted."""
+        self._register_nodes('node-0', 'node-1', 'node-2', 'node-3')
+        _, _, headers = api.list_nodes('all', limit=2)
+        api.node_delete('node-1')
+        api.node_delete('node-2')
+        assert json.loads(api.list_nodes('all', limit=2,
+                                         cursor=headers['X-Next-Cursor'])) \
+            == ['node-3']
+
+    @pytest.mark.parametrize('cursor', ['bogus', 'MQ==', 'bm9kZQ=='])
+    def test_invalid_cursor(self, cursor):
+        with pytest.raises(api.BadArgumentError):
+            api.list_nodes('all', cursor=cursor)
+
+    def test_list_nodes_filters(self, switchinit):
+        self._register_nodes('node-0', 'node-1', 'node-2', 'node-3')
+        api.project_create('anvil-nextgen')
+        api.project_connect_node('anvil-nextgen', 'node-1')
+        api.project_connect_node('anvil-nextgen', 'node-2')
+        api.node_set_metadata('node-2', 'EK', 'pk')
+        api.node_set_metadata('node-3', 'EK', 'pk')
+        api.node_register_nic('node-3', 'eth0', 'DE:AD:BE:EF:20:14')
+        api.port_connect_nic('sw0', '3', 'node-3', 'eth0')
+
+        def list_nodes(*args, **kwargs):
+            return json.loads(api.list_nodes(*args, **kwargs))
+
+        assert list_nodes('allocated') == ['node-1', 'node-2']
+        assert list_nodes('all', project='anvil-nextgen') == \
+            ['node-1', 'node-2']
+        assert list_nodes('free', project='anvil-nextgen') == []
+        assert list_nodes('all', metadata='EK') == ['node-2', 'node-3']
+        assert list_nodes('free', metadata='EK') == ['node-3']
+        assert list_nodes('all', metadata='SN') == []
+        assert list_nodes('all', switch='sw0') == ['node-3']
+        assert json.loads(api.list_project_nodes('anvil-nextgen',
+                                                 metadata='EK')) == ['node-2']
+
+    def test_list_nodes_missing_filter(self):
+        with pytest.raises(api.NotFoundError):
+            api.list_nodes('all', project='anvil-nextgen')
+        with pytest.raises(api.NotFoundError):
+            api.list_nodes('all', switch='sw0')
+
+    def test_list_nodes_fields(self):
+        self._register_nodes('node-0', 'node-1')
+        api.project_create('anvil-nextgen')
+        api.project_connect_node('anvil-nextgen', 'node-1')
+        api.node_set_metadata('node-1', 'EK', 'pk')
+        assert json.loads(api.list_nodes('all',
+                                         fields='name,project,metadata')) == [
+            {'name': 'node-0', 'project': None, 'metadata': {}},
+            {'name': 'node-1', 'project': 'anvil-nextgen',
+             'metadata': {'EK': '"pk"'}},
+        ]
+        assert json.loads(api.list_project_nodes('anvil-nextgen',
+                                                 fields='metadata')) == [
+            {'metadata': {'EK': '"pk"'}},
+        ]
+
+    @pytest.mark.parametrize('fields', ['nics', 'name,', ''])
+    def test_unknown_field(self, fields):
+        with pytest.raises(api.BadArgumentError):
+            api.list_nodes('all', fields=fields)
+
+    def test_list_networks(self):
+        api.project_create('anvil-nextgen')
+        api.project_create('runway')
+        network_create_simple('net-0', 'anvil-nextgen')
+        network_create_simple('net-1', 'runway')
+        api.network_create('net-2', 'admin', '', '')
+
+        pages = self._pages(api.list_networks, limit=2)
+        assert [sorted(page.keys()) for page in pages] == [
+            ['net-0', 'net-1'],
+            ['net-2'],
+        ]
+        assert pages[0]['net-1']['projects'] == ['runway']
+        assert pages[1]['net-2']['projects'] is None
+        assert json.loads(api.list_networks(project='runway',
+                                            fields='name,owner')) == [
+            {'name': 'net-1', 'owner': 'runway'},
+        ]
+        assert json.loads(api.list_networks(fields='owner')) == [
+            {'owner': 'anvil-nextgen'},
+            {'owner': 'runway'},
+            {'owner': None},
+        ]
+
+    def test_list_projects(self):
+        for project in 'runway', 'anvil-nextgen', 'manhattan':
+            api.project_create(project)
+        assert self._pages(api.list_projects, limit=2, fields='name') == [
+            [{'name': 'anvil-nextgen'}, {'name': 'manhattan'}],
+            [{'name': 'runway'}],
+        ]
+
+    def test_list_switches(self, switchinit):
+        assert json.loads(api.list_switches(fields='name,type')) == [
+            {'name': 'sw0', 'type': MOCK_SWITCH_TYPE},
+        ]
+
+    def test_http(self):
+        self._register_nodes('node-0', 'node-1', 'node-2')
+        client = hil.rest.app.test_client()
+        resp = client.get('/nodes/all?limit=2')
+        assert resp.status_code == 200
+        assert json.loads(resp.data) == ['node-0', 'node-1']
+        resp = client.get('/nodes/all?limit=2&cursor=' +
+                          resp.headers['X-Next-Cursor'])
+        assert json.loads(resp.data) == ['node-2']
+        assert 'X-Next-Cursor' not in resp.headers
+        assert client.get('/nodes/all?limit=0').status_code == 400
+        assert client.get('/nodes/all?limit=ten').status_code == 400
+
+
+class TestShowNodes:
+    """Tests for showing the details of many nodes at once."""
+
+    def _register_nodes(self, count):
+        """Register `count` nodes in a project, with nics and networks."""
+        api.project_create('anvil-nextgen')
+        network_create_simple('hammernet', 'anvil-nextgen')
+        api.switch_register('sw0',
+                            type=MOCK_SWITCH_TYPE,
+                            username="switch_user",
+                            password="switch_pass",
+                            hostname="switchname")
+        nodes = []
+        for i in range(count):
+            node = 'node-%d' % i
+            api.node_register(node, obm={
+                "type": OBM_TYPE_MOCK,
+                "host": "host-" + node,
+                "user": "root",
+                "password": "tapeworm"})
+            api.node_set_metadata(node, 'EK', 'pk-%d' % i)
+            api.project_connect_node('anvil-nextgen', node)
+            for j, nic in enumerate(['eth0', 'eth1']):
+                api.node_register_nic(node, nic,
+                                      'DE:AD:BE:EF:%02d:%02d' % (i, j))
+                api.switch_register_port('sw0', node + nic)
+                api.port_connect_nic('sw0', node + nic, node, nic)
+            api.node_connect_network(node, 'eth0', 'hammernet')
+            deferred.apply_networking()
+            nodes.append(node)
+        return nodes
+
+    def _show_nodes(self, *args, **kwargs):
+        return json.loads(api.show_nodes(*args, **kwargs).get_data())
+
+    def test_show_nodes(self):
+        nodes = self._register_nodes(3)
+        api.node_register('free-node', obm={
+            "type": OBM_TYPE_MOCK,
+            "host": "ipmihost",
+            "user": "root",
+            "password": "tapeworm"})
+        expected = [json.loads(api.show_node(node)) for node in nodes]
+        assert self._show_nodes('allocated') == expected
+        assert self._show_nodes('all', project='anvil-nextgen') == expected
+        assert self._show_nodes('all', nodes='node-2,node-0') == \
+            [expected[0], expected[2]]
+        assert self._show_nodes('free') == \
+            [json.loads(api.show_node('free-node'))]
+
+    def test_query_count(self):
+        """The number of queries doesn't depend on the number of nodes."""
+        nodes = self._register_nodes(6)
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        sqlalchemy.event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            self._show_nodes('all', nodes='node-0')
+            small = len(statements)
+            del statements[:]
+            self._show_nodes('all', nodes=','.join(nodes))
+            assert len(statements) == small
+        finally:
+            sqlalchemy.event.remove(db.engine, 'before_cursor_execute',
+                                    count)
+
+    def test_pages(self, monkeypatch):
+        monkeypatch.setattr(api, '_NODE_DETAILS_CHUNK_SIZE', 2)
+        nodes = self._register_nodes(5)
+        response = api.show_nodes('all', limit=3)
+        assert [node['name'] for node in json.loads(response.get_data())] \
+            == nodes[:3]
+        response = api.show_nodes('all', limit=3,
+                                  cursor=response.headers['X-Next-Cursor'])
+        assert [node['name'] for node in json.loads(response.get_data())] \
+            == nodes[3:]
+        assert 'X-Next-Cursor' not in response.headers
+
+    def test_missing_node(self):
+        self._register_nodes(1)
+        with pytest.raises(api.NotFoundError):
+            api.show_nodes('all', nodes='node-0,node-1')
+
+    def test_http(self):
+        self._register_nodes(2)
+        resp = hil.rest.app.test_client().get('/nodes/all/details')
+        assert resp.status_code == 200
+        assert [node['name'] for node in json.loads(resp.data)] == \
+            ['node-0', 'node-1']
+
+
 class TestDryRun:
     """
     Test that api calls using functions with @no_dry_run behave reasonably.
@@ -2239,3 +2749,106 @@ class TestDryRun:
                   "password": "tapeworm"})
         api.project_connect_node('anvil-nextgen', 'node-99')
         api.node_power_cycle('node-99')
+
+
+class TestBatch:
+    """Tests for running api calls in a batch."""
+
+    def _register_node_ops(self, node):
+        return [
+            {'method': 'PUT',
+             'path': '/node/' + node,
+             'body': {'obm': {'type': OBM_TYPE_MOCK,
+                              'host': 'ipmihost',
+                              'user': 'root',
+                              'password': 'tapeworm'}}},
+            {'method': 'PUT',
+             'path': '/node/%s/nic/eth0' % node,
+             'body': {'macaddr': 'DE:AD:BE:EF:20:14'}},
+        ]
+
+    def test_batch(self):
+        api.project_create('anvil-nextgen')
+        results = json.loads(api.batch(self._register_node_ops('node-99') + [
+            {'method': 'POST',
+             'path': '/project/anvil-nextgen/connect_node',
+             'body': {'node': 'node-99'}},
+        ]))
+        assert results == [{'status': 200, 'body': ''}] * 3
+        node = api._must_find(model.Node, 'node-99')
+        assert node.project.label == 'anvil-nextgen'
+        assert [nic.label for nic in node.nics] == ['eth0']
+
+    def test_one_commit(self):
+        from sqlalchemy import event
+        from flask.ext.sqlalchemy import SignallingSession
+        commits = []
+
+        def count(session):
+            commits.append(session)
+        event.listen(SignallingSession, 'after_commit', count)
+        api.batch(self._register_node_ops('node-98') +
+                  self._register_node_ops('node-99'))
+        event.remove(SignallingSession, 'after_commit', count)
+        assert len(commits) == 1
+
+    def test_results(self):
+        api.project_create('anvil-nextgen')
+        api.node_register('node-99', obm={'type': OBM_TYPE_MOCK,
+                                          'host': 'ipmihost',
+                                          'user': 'root',
+                                          'password': 'tapeworm'})
+        api.project_connect_node('anvil-nextgen', 'node-99')
+        results = json.loads(api.batch([
+            {'method': 'POST',
+             'path': '/obm_jobs',
+             'body': {'type': 'power_off', 'project': 'anvil-nextgen'}},
+        ]))
+        assert len(results) == 1
+        jobs = json.loads(results[0]['body'])
+        assert [job['node'] for job in jobs] == ['node-99']
+
+    def test_rollback(self):
+        body, status = api.batch(self._register_node_ops('node-99') + [
+            {'method': 'POST',
+             'path': '/project/anvil-nextgen/connect_node',
+             'body': {'node': 'node-99'}},
+        ])
+        assert status == 404
+        error = json.loads(body)
+        assert (error['type'], error['operation']) == ('NotFoundError', 2)
+        assert model.Node.query.count() == 0
+        assert model.Nic.query.count() == 0
+
+    @pytest.mark.parametrize('operation', [
+        # Not allowed in a batch:
+        {'method': 'GET', 'path': '/nodes/all'},
+        {'method': 'POST', 'path': '/node/node-99/power_cycle'},
+        # No such call:
+        {'method': 'PUT', 'path': '/no/such/call'},
+        {'method': 'PATCH', 'path': '/project/anvil-oldgen'},
+        # Bad arguments:
+        {'method': 'PUT', 'path': '/project/anvil-oldgen',
+         'body': {'project': 'anvil-newgen'}},
+        {'method': 'PUT', 'path': '/node/node-99/nic/eth0', 'body': {}},
+    ])
+    def test_invalid(self, operation):
+        body, status = api.batch([
+            {'method': 'PUT', 'path': '/project/anvil-nextgen'},
+            operation,
+        ])
+        assert status == 400
+        assert json.loads(body)['operation'] == 1
+        assert model.Project.query.count() == 0
+
+    def test_http(self):
+        resp = hil.rest.app.test_client().post('/batch', data=json.dumps({
+            'operations': [
+                {'method': 'PUT', 'path': '/project/anvil-nextgen'},
+                {'method': 'put', 'path': '/project/anvil-oldgen'},
+            ],
+        }))
+        assert resp.status_code == 200
+        assert json.loads(resp.data) == [{'status': 200, 'body': ''}] * 2
+        assert json.loads(api.list_projects()) == \
+            ['anvil-nextgen', 'anvil-oldgen']
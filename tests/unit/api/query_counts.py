@@ -0,0 +1,194 @@
+"""Query-count budgets for the API calls.
+
+Each call in `BUDGETS` is run against a small inventory and a larger one,
+counting the SQL statements it executes. The count must not depend on the
+size of the inventory (the number of nodes, nics, attachments...), and
+must be within the call's budget. A call which walks a relationship lazily
+in a loop fails the first check; load the relationship up front (see
+``hil.api._node_details_options``) or check it with a single query (see
+``hil.api._any``) instead.
+
+If you change a call so that it needs more queries, raise its budget, but
+only after making sure the extra queries are a constant number.
+"""
+
+import flask
+import pytest
+
+from hil import api, config, model, server
+from hil.model import db
+from hil.test_common import config_testsuite, config_merge, \
+    fail_on_log_warnings, fresh_database, with_request_context, \
+    newDB, releaseDB, count_queries
+
+MOCK_SWITCH_TYPE = 'http://schema.massopencloud.org/haas/v0/switches/mock'
+MOCK_OBM_TYPE = 'http://schema.massopencloud.org/haas/v0/obm/mock'
+
+# The inventory sizes to compare. At each scale, the project has `scale`
+# nodes, each of which has `scale` nics and metadata entries:
+SMALL = 2
+LARGE = 6
+
+# The maximum number of statements each call may execute, and the call:
+BUDGETS = {
+    'list_projects': (2, lambda: api.list_projects()),
+    'list_networks': (3, lambda: api.list_networks()),
+    'show_network': (3, lambda: api.show_network('net')),
+    'list_network_attachments': (
+        3, lambda: api.list_network_attachments('net')),
+    'list_project_networks': (
+        3, lambda: api.list_project_networks('proj')),
+    'list_nodes': (3, lambda: api.list_nodes('all',
+                                             fields='name,project,metadata')),
+    'list_project_nodes': (
+        4, lambda: api.list_project_nodes('proj', switch='sw0')),
+    'show_node': (5, lambda: api.show_node('node-0')),
+    'show_nodes': (4, lambda: api.show_nodes('all')),
+    'list_power_status': (
+        2, lambda: api.list_power_status(project='proj')),
+    'show_switch': (2, lambda: api.show_switch('sw0')),
+    'show_port': (3, lambda: api.show_port('sw0', 'port-0-0')),
+    'project_connect_node': (
+        5, lambda: api.project_connect_node('proj', 'free-node')),
+    'project_detach_node': (
+        6, lambda: api.project_detach_node('proj', 'spare')),
+    'network_revoke_project_access': (
+        8, lambda: api.network_revoke_project_access('other', 'net')),
+    'node_connect_network': (
+        12, lambda: api.node_connect_network('spare', 'nic-0', 'net')),
+    'node_detach_network': (
+        9, lambda: api.node_detach_network('node-0', 'nic-0', 'net')),
+    'port_revert': (7, lambda: api.port_revert('sw0', 'port-0-0')),
+}
+
+
+@pytest.fixture
+def configure():
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.switches.mock': '',
+            'hil.ext.obm.mock': '',
+        },
+        # A cached response would cost a single query, hiding the cost
+        # of computing it:
+        'response-cache': {'max_entries': '0'},
+    })
+    config.load_extensions()
+
+
+fail_on_log_warnings = pytest.fixture(fail_on_log_warnings)
+fresh_database = pytest.fixture(fresh_database)
+with_request_context = pytest.yield_fixture(with_request_context)
+
+
+@pytest.fixture
+def server_init():
+    server.register_drivers()
+    server.validate_state()
+
+
+pytestmark = pytest.mark.usefixtures('fail_on_log_warnings',
+                                     'configure',
+                                     'fresh_database',
+                                     'server_init',
+                                     'with_request_context')
+
+
+def _register_node(label, nics, switch='sw0'):
+    api.node_register(label, obm={
+        'type': MOCK_OBM_TYPE,
+        'host': 'host',
+        'user': 'user',
+        'password': 'pass',
+    })
+    for i in range(nics):
+        nic = 'nic-%d' % i
+        port = 'port-%s-%d' % (label.split('-')[-1], i)
+        api.node_register_nic(label, nic, '00:00:00:00:00:%02x' % i)
+        api.switch_register_port(switch, port)
+        api.port_connect_nic(switch, port, label, nic)
+
+
+def populate(scale):
+    """Populate the database with an inventory of size `scale`.
+
+    The project 'proj' has `scale` nodes ('node-0'...) with `scale` nics
+    ('nic-0'...) and metadata entries each. Every nic is connected to a
+    port on 'sw0', and attached to the network 'net', which 'proj' owns
+    and 'other' can access. 'proj' also has a node 'spare', like the
+    others but with no attachments, and there is a free node 'free-node'.
+    """
+    api.project_create('proj')
+    api.project_create('other')
+    api.switch_register('sw0', type=MOCK_SWITCH_TYPE, username='user',
+                        password='pass', hostname='host')
+    api.network_create('net', 'proj', 'proj', '')
+    api.network_grant_project_access('other', 'net')
+    network = model.Network.query.filter_by(label='net').one()
+    for i in range(scale):
+        label = 'node-%d' % i
+        _register_node(label, scale)
+        api.project_connect_node('proj', label)
+        for j in range(scale):
+            api.node_set_metadata(label, 'key-%d' % j, j)
+        node = model.Node.query.filter_by(label=label).one()
+        for nic in node.nics:
+            db.session.add(model.NetworkAttachment(
+                nic=nic, network=network, channel='null'))
+    _register_node('spare', scale)
+    api.project_connect_node('proj', 'spare')
+    api.node_register('free-node', obm={
+        'type': MOCK_OBM_TYPE,
+        'host': 'host',
+        'user': 'user',
+        'password': 'pass',
+    })
+    db.session.commit()
+
+
+def statements(call, scale):
+    """Return the statements `call` executes, in an inventory of `scale`."""
+    db.session.remove()
+    releaseDB()
+    newDB()
+    populate(scale)
+    # Start from a clean session, as a request would:
+    db.session.remove()
+    with count_queries() as result:
+        response = call()
+        if isinstance(response, flask.Response):
+            # Streamed responses run their queries as they are sent:
+            response.get_data()
+    db.session.remove()
+    return result
+
+
+@pytest.mark.parametrize('name', sorted(BUDGETS))
+def test_query_budget(name):
+    budget, call = BUDGETS[name]
+    small = statements(call, SMALL)
+    large = statements(call, LARGE)
+    assert len(large) == len(small), \
+        "%s's queries grow with the inventory:\n%s" % (
+            name, '\n\n'.join(large))
+    assert len(large) <= budget, \
+        "%s is over its budget of %d queries:\n%s" % (
+            name, budget, '\n\n'.join(large))
+
+
+def test_obm_jobs_create_lookups():
+    """Queuing jobs on a list of nodes looks them up all at once.
+
+    The list grows with the inventory here, so only the queries count:
+    each job is still inserted by a statement of its own.
+    """
+    def selects(scale):
+        names = ['node-%d' % i for i in range(scale)] + ['spare']
+        return [statement for statement in statements(
+            lambda: api.obm_jobs_create('power_off', nodes=names), scale)
+            if statement.lstrip().upper().startswith('SELECT')]
+    small = selects(SMALL)
+    large = selects(LARGE)
+    assert len(large) == len(small), '\n\n'.join(large)
+    assert len(large) <= 2, '\n\n'.join(large)
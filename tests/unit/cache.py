@@ -0,0 +1,240 @@
+# Copyright 2017 Massachusetts Open Cloud Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the
+# License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS
+# IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.  See the License for the specific language
+# governing permissions and limitations under the License.
+
+"""Unit tests for cache.py"""
+import json
+
+import pytest
+import sqlalchemy
+
+from hil import api, cache, config, model, rest, server
+from hil.auth import get_auth_backend
+from hil.model import db
+from hil.test_common import config_testsuite, config_merge, \
+    fresh_database, with_request_context, fail_on_log_warnings
+
+MOCK_OBM_API_NAME = 'http://schema.massopencloud.org/haas/v0/obm/mock'
+
+
+@pytest.fixture
+def configure():
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.auth.mock': '',
+            'hil.ext.auth.null': None,
+            'hil.ext.obm.mock': '',
+        },
+    })
+    config.load_extensions()
+
+
+fail_on_log_warnings = pytest.fixture(fail_on_log_warnings)
+
+
+@pytest.fixture
+def server_init():
+    server.register_drivers()
+    server.validate_state()
+
+
+fresh_database = pytest.fixture(fresh_database)
+with_request_context = pytest.yield_fixture(with_request_context)
+
+pytestmark = pytest.mark.usefixtures('fail_on_log_warnings',
+                                     'configure',
+                                     'fresh_database',
+                                     'server_init',
+                                     'with_request_context')
+
+
+class Counter(list):
+    """A cached "API call", which records each time it actually runs."""
+
+    def __init__(self):
+        list.__init__(self)
+
+        @cache.cached(model.Node)
+        def node_count(prefix):
+            self.append(prefix)
+            return str(model.Node.query
+                       .filter(model.Node.label.startswith(prefix))
+                       .count())
+
+        self.call = node_count
+
+
+@pytest.fixture
+def calls():
+    return Counter()
+
+
+def _register_node(label):
+    api.node_register(label, obm={'type': MOCK_OBM_API_NAME,
+                                  'host': 'ipmihost',
+                                  'user': 'root',
+                                  'password': 'tapeworm'})
+
+
+class TestCached:
+
+    def test_hit(self, calls):
+        assert calls.call('node') == '0'
+        assert calls.call('node') == '0'
+        assert calls.call(prefix='node') == '0'
+        assert calls == ['node']
+
+    def test_arguments(self, calls):
+        calls.call('node')
+        calls.call('other')
+        assert calls == ['node', 'other']
+
+    def test_invalidated_by_commit(self, calls):
+        get_auth_backend().set_admin(True)
+        calls.call('node')
+        _register_node('node-99')
+        assert calls.call('node') == '1'
+        assert calls == ['node', 'node']
+
+    def test_unrelated_change(self, calls):
+        get_auth_backend().set_admin(True)
+        calls.call('node')
+        api.project_create('anvil-nextgen')
+        calls.call('node')
+        assert calls == ['node']
+
+    def test_scope(self, calls):
+        calls.call('node')
+        get_auth_backend().set_admin(True)
+        calls.call('node')
+        assert calls == ['node', 'node']
+
+    def test_uncommitted_changes(self, calls):
+        """Responses reflecting uncommitted changes aren't shared."""
+        calls.call('node')
+        db.session.add(model.Project('anvil-nextgen'))
+        db.session.flush()
+        calls.call('node')
+        calls.call('node')
+        assert calls == ['node', 'node', 'node']
+        db.session.rollback()
+        calls.call('node')
+        assert calls == ['node', 'node', 'node']
+
+    def test_max_entries(self, calls):
+        config_merge({'response-cache': {'max_entries': '2'}})
+        calls.call('a')
+        calls.call('b')
+        calls.call('a')
+        calls.call('c')
+        # 'b' was the least recently used:
+        calls.call('a')
+        calls.call('b')
+        assert calls == ['a', 'b', 'c', 'b']
+
+    def test_disabled(self, calls):
+        config_merge({'response-cache': {'max_entries': '0'}})
+        calls.call('node')
+        calls.call('node')
+        assert calls == ['node', 'node']
+
+    def test_show_node(self):
+        """show_node's admin-only fields aren't leaked through the cache."""
+        get_auth_backend().set_admin(True)
+        _register_node('node-99')
+        api.node_register_nic('node-99', 'eth0', 'DE:AD:BE:EF:20:14')
+        assert 'port' in json.loads(api.show_node('node-99'))['nics'][0]
+        get_auth_backend().set_admin(False)
+        assert 'port' not in json.loads(api.show_node('node-99'))['nics'][0]
+
+
+class TestConditionalGet:
+
+    @pytest.fixture
+    def client(self):
+        return rest.app.test_client()
+
+    def test_not_modified(self, client):
+        resp = client.get('/nodes/all')
+        assert resp.status_code == 200
+        etag = resp.headers['ETag']
+
+        resp = client.get('/nodes/all', headers={'If-None-Match': etag})
+        assert resp.status_code == 304
+        assert resp.data == ''
+        assert resp.headers['ETag'] == etag
+
+    def test_modified(self, client):
+        etag = client.get('/nodes/all').headers['ETag']
+        # (after the request, which resets the mock auth backend)
+        get_auth_backend().set_admin(True)
+        _register_node('node-99')
+        resp = client.get('/nodes/all', headers={'If-None-Match': etag})
+        assert resp.status_code == 200
+        assert json.loads(resp.data) == ['node-99']
+        assert resp.headers['ETag'] != etag
+
+    def test_no_etag_on_error(self, client):
+        resp = client.get('/node/node-99')
+        assert resp.status_code == 404
+        assert 'ETag' not in resp.headers
+
+
+class TestLabelSet:
+
+    @pytest.yield_fixture
+    def statements(self):
+        """Record the SQL statements run from here on."""
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        sqlalchemy.event.listen(db.engine, 'before_cursor_execute', record)
+        yield statements
+        sqlalchemy.event.remove(db.engine, 'before_cursor_execute', record)
+
+    def test_contains(self):
+        get_auth_backend().set_admin(True)
+        api.project_create('anvil-nextgen')
+        labels = cache.LabelSet(model.Project)
+        assert 'anvil-nextgen' in labels
+        assert 'runway' not in labels
+
+    def test_reloaded_on_change(self):
+        get_auth_backend().set_admin(True)
+        labels = cache.LabelSet(model.Project)
+        assert 'anvil-nextgen' not in labels
+        api.project_create('anvil-nextgen')
+        assert 'anvil-nextgen' in labels
+        api.project_delete('anvil-nextgen')
+        assert 'anvil-nextgen' not in labels
+
+    def test_one_query(self, statements):
+        labels = cache.LabelSet(model.Project)
+        'anvil-nextgen' in labels
+        del statements[:]
+        'anvil-nextgen' in labels
+        'runway' in labels
+        assert len(statements) == 2
+        assert all('generation' in s for s in statements)
+
+    def test_uncommitted_changes(self):
+        labels = cache.LabelSet(model.Project)
+        assert 'anvil-nextgen' not in labels
+        db.session.add(model.Project('anvil-nextgen'))
+        db.session.flush()
+        assert 'anvil-nextgen' in labels
+        db.session.rollback()
+        assert 'anvil-nextgen' not in labels
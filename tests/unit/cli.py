@@ -6,9 +6,12 @@ import pytest
 import tempfile
 import os
 import signal
-from subprocess import check_call, check_output, Popen, CalledProcessError, \
-    STDOUT
+import sys
+from subprocess import call, check_call, check_output, Popen, PIPE, \
+    CalledProcessError, STDOUT
 from time import sleep
+from hil import cli
+from hil.client.base import FailedAPICallException
 from hil.test_common import fail_on_log_warnings
 
 
@@ -32,12 +35,14 @@ def make_config(request):
             '[extensions]',
             'hil.ext.auth.null =',
             'hil.ext.network_allocators.null =',
+            'hil.ext.obm.mock =',
         ])
         f.write(config)
 
     def cleanup():
         os.remove('hil.cfg')
-        os.remove('hil.db')
+        if os.path.exists('hil.db'):
+            os.remove('hil.db')
         os.chdir(cwd)
         os.rmdir(tmpdir)
 
@@ -82,9 +87,15 @@ def test_serve_networks():
     assert runs_for_seconds(['hil', 'serve_networks'], seconds=1)
 
 
+def test_serve_consoles():
+    check_call(['hil-admin', 'db', 'create'])
+    assert runs_for_seconds(['hil', 'serve_consoles'], seconds=1)
+
+
 @pytest.mark.parametrize('command', [
     ['hil', 'serve', '5000'],
     ['hil', 'serve_networks'],
+    ['hil', 'serve_consoles'],
 ])
 def test_db_init_error(command):
     try:
@@ -95,3 +106,150 @@ def test_db_init_error(command):
             'Should have printed an error re: database initialization, '
             'but printed %r' % e.output
         )
+
+
+@pytest.fixture
+def api_server():
+    """Run ``hil serve`` on a fresh database, and point the CLI at it.
+
+    Yields the environment with which to run ``hil``.
+    """
+    check_call(['hil-admin', 'db', 'create'])
+    env = dict(os.environ, HIL_ENDPOINT='http://127.0.0.1:5001')
+    proc = Popen(['hil', 'serve', '5001'])
+    try:
+        # Wait for the server to come up:
+        for _ in range(50):
+            if call(['hil', 'list_projects'], env=env, stdout=PIPE,
+                    stderr=PIPE) == 0:
+                break
+            sleep(0.2)
+        yield env
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def run_with_input(cmd, text, env):
+    """Run ``cmd`` with ``text`` as its input.
+
+    Returns a tuple of its exit status, stdout and stderr.
+    """
+    proc = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE, env=env)
+    out, err = proc.communicate(text)
+    return proc.returncode, out, err
+
+
+BATCH = '\n'.join([
+    '# Make some projects:',
+    'project_create p1',
+    'project_create "p2"  # quoted',
+    '',
+    'project_create p1',
+    'no_such_command',
+    'project_create',
+    'list_projects',
+]) + '\n'
+
+
+def test_batch(api_server):
+    status, out, err = run_with_input(['hil', 'batch', '-'], BATCH,
+                                      api_server)
+    assert status != 0
+    # The commands run in order, with failures reported by line number:
+    assert out.splitlines()[-1].startswith('2 Projects')
+    assert 'Error on line 5: ' in err
+    assert "Error on line 6: Unknown command 'no_such_command'" in err
+    assert 'Error on line 7: Invalid arguments to project_create' in err
+    assert '3 command(s) failed, on line(s) 5, 6, 7' in err
+
+
+def test_batch_workers(api_server):
+    projects = ['p%d' % i for i in range(20)]
+    status, _, err = run_with_input(
+        ['hil', 'batch', '-', 'workers=4'],
+        ''.join('project_create %s\n' % p for p in projects),
+        api_server)
+    assert (status, err) == (0, '')
+    status, out, err = run_with_input(
+        ['hil', 'batch', '-', 'workers=4'],
+        ''.join('list_project_nodes %s\n' % p for p in projects),
+        api_server)
+    assert (status, err) == (0, '')
+    # The output is in the order of the commands:
+    assert [line.split(':')[0] for line in out.splitlines()] == \
+        ['Nodes allocated to %s' % p for p in projects]
+
+
+def test_batch_file(api_server, tmpdir):
+    commands = tmpdir.join('commands')
+    commands.write('project_create p1\nlist_projects\n')
+    out = check_output(['hil', 'batch', str(commands)], env=api_server)
+    assert out.startswith('1 Projects')
+
+
+def test_batch_rejects_server_commands(api_server):
+    status, _, err = run_with_input(['hil', 'batch', '-'],
+                                    'serve_networks\nbatch -\n', api_server)
+    assert status != 0
+    assert 'serve_networks cannot be run from a batch or shell' in err
+    assert 'batch cannot be run from a batch or shell' in err
+
+
+@pytest.mark.parametrize('workers', ['workers=1', 'workers=4'])
+def test_batch_survives_sys_exit(monkeypatch, capsys, tmpdir, workers):
+    """A command which calls sys.exit fails its line, not the batch."""
+
+    def give_up(message):
+        sys.exit(message)
+    ran = []
+    monkeypatch.setitem(cli.command_dict, 'give_up', give_up)
+    monkeypatch.setitem(cli.command_dict, 'keep_going', ran.append)
+    commands = tmpdir.join('commands')
+    commands.write('give_up "Error: no good"\nkeep_going yes\n')
+    with pytest.raises(FailedAPICallException) as e:
+        cli.batch(str(commands), workers)
+    assert e.value.message == '1 command(s) failed, on line(s) 1'
+    assert ran == ['yes']
+    assert 'Error on line 1: Error: no good\n' in capsys.readouterr()[1]
+
+
+def test_shell(api_server):
+    status, out, err = run_with_input(
+        ['hil', 'shell'],
+        'project_create p1\nproject_create p1\nlist_projects\nexit\n'
+        'list_projects\n',
+        api_server)
+    # Errors don't end the session, and don't make it fail:
+    assert status == 0
+    assert err.startswith('Error: ')
+    assert out.count('1 Projects') == 1
+
+
+NODES_CSV = '\n'.join([
+    'name,obm.type,obm.host,obm.user,obm.password,nic.eth0,metadata.rack',
+    'node-1,mock,host-1,root,secret,aa:bb:cc:dd:ee:01,4',
+    'node-2,mock,host-2,root,secret,aa:bb:cc:dd:ee:02,',
+]) + '\n'
+
+
+def test_node_register_many(api_server, tmpdir):
+    nodes = tmpdir.join('nodes.csv')
+    nodes.write(NODES_CSV)
+    out = check_output(['hil', 'node_register_many', str(nodes)],
+                       env=api_server)
+    assert out == 'Registered 2 nodes\n'
+    out = check_output(['hil', 'list_nodes', 'all'], env=api_server)
+    assert out.split()[-2:] == ['node-1', 'node-2']
+    status, _, _ = run_with_input(['hil', 'node_register_many', '-'],
+                                  '[{"name": "node-3", "obm": {}}]',
+                                  api_server)
+    assert status != 0
+    # Each invalid node is reported, on a line of its own:
+    status, _, err = run_with_input(
+        ['hil', 'node_register_many', str(nodes)], '', api_server)
+    assert status != 0
+    assert err.splitlines()[:2] == [
+        'node-1: Node node-1 already exists.',
+        'node-2: Node node-2 already exists.',
+    ]
@@ -16,8 +16,9 @@
 from flask.ext.sqlalchemy import SQLAlchemy
 from hil.flaskapp import app
 from hil.model import NetworkingAction
-from hil.client.base import ClientBase, FailedAPICallException
-from hil.client.client import Client, RequestsHTTPClient
+from hil.client.base import ClientBase, FailedAPICallException, BulkResult
+from hil.client.client import Client, RequestsHTTPClient, TokenHTTPClient
+from hil.client.node import read_nodes_csv, read_nodes_json
 
 import json
 import os
@@ -27,6 +28,9 @@ import sys
 import tempfile
 import time
 
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
+
 from subprocess import check_call, Popen
 
 ep = "http://127.0.0.1:8000" or os.environ.get('HIL_ENDPOINT')
@@ -53,6 +57,140 @@ class Test_ClientBase:
         y = x.object_url('abc', '123', 'xy23z')
         assert y == 'http://127.0.0.1:8000/abc/123/xy23z'
 
+
+class FakeResponse(object):
+    """Stands in for requests.Response, in `FakeHTTPClient`."""
+
+    def __init__(self, method, status_code, body=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.request = type('FakeRequest', (), {'method': method})
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class FakeHTTPClient(object):
+    """An HTTPClient for testing bulk calls without a server.
+
+    Records each request's method and path. Objects exist if their names
+    are in `existing`. There is only a batch endpoint if `batch` is True,
+    and batches fail if any operation names a missing object.
+    """
+
+    def __init__(self, existing, batch=True):
+        self.existing = existing
+        self.batch = batch
+        self.requests = []
+
+    def request(self, method, url, data=None, params=None):
+        path = url[len(ep):]
+        self.requests.append((method, path))
+        if path == '/batch':
+            if not self.batch:
+                return FakeResponse(method, 404, {'msg': 'Not found'})
+            paths = [op['path'] for op in json.loads(data)['operations']]
+            if all(path.split('/')[2] in self.existing for path in paths):
+                return FakeResponse(method, 200, [])
+            return FakeResponse(method, 404, {'msg': 'No such project'})
+        name = path.split('/')[2]
+        if name not in self.existing:
+            return FakeResponse(method, 404, {'msg': 'No such ' + name})
+        return FakeResponse(method, 200, {'name': name})
+
+
+class Test_bulk:
+    """Tests bulk calls (ClientBase.each etc.), without a server."""
+
+    def test_each(self):
+        client = Client(ep, FakeHTTPClient(['p%d' % i for i in range(50)]),
+                        max_workers=4)
+        names = ['p%d' % i for i in range(60)]
+        results = client.switch.show_many(names)
+        # The results are in order:
+        assert [r.value for r in results[:50]] == \
+            [{'name': name} for name in names[:50]]
+        assert all(r.ok for r in results[:50])
+        # The failures are reported per item:
+        assert all(not r.ok and r.value is None for r in results[50:])
+        assert isinstance(results[50].error, FailedAPICallException)
+        assert results[50].error.message == 'No such p50'
+
+    def test_batched(self):
+        http_client = FakeHTTPClient(['p1', 'p2', 'p3'])
+        client = Client(ep, http_client)
+        client.project.batch_size = 2
+        results = client.project.connect_many('p1', ['n1', 'n2', 'n3'])
+        assert results == [BulkResult(None, None)] * 3
+        # A "batch" of one is just the call itself:
+        assert http_client.requests == [('POST', '/batch'),
+                                        ('POST', '/project/p1/connect_node')]
+
+    def test_batch_failure(self):
+        """A failed batch is retried one call at a time."""
+        http_client = FakeHTTPClient(['p1', 'p2', 'p3'])
+        client = Client(ep, http_client)
+        results = client.port.register_many(
+            [('p1', 'gi1/0/1'), ('p4', 'gi1/0/1'), ('p3', 'gi1/0/1')])
+        assert [r.ok for r in results] == [True, False, True]
+        assert http_client.requests[0] == ('POST', '/batch')
+        assert sorted(http_client.requests[1:]) == [
+            ('PUT', '/switch/p%d/port/gi1/0/1' % i) for i in (1, 3, 4)]
+
+    def test_no_batch_endpoint(self):
+        """Without a batch endpoint, the calls are made one at a time."""
+        http_client = FakeHTTPClient(['p1', 'p2'], batch=False)
+        client = Client(ep, http_client)
+        for _ in range(2):
+            results = client.port.register_many([('p1', 'gi1/0/1'),
+                                                 ('p2', 'gi1/0/1')])
+            assert all(r.ok for r in results)
+        # The batch endpoint is only tried once:
+        assert [method for method, path in http_client.requests] == \
+            ['POST', 'PUT', 'PUT', 'PUT', 'PUT']
+
+
+class Test_read_nodes:
+    """Tests reading nodes to register from files, without a server."""
+
+    def test_csv(self):
+        nodes = read_nodes_csv(StringIO(
+            'name,obm.type,obm.host,nic.eth0,nic.eth1,metadata.rack\n'
+            'node-1,ipmi,10.0.0.1,aa:bb:cc:dd:ee:01,aa:bb:cc:dd:ee:11,4\n'
+            '\n'
+            'node-2,%s,10.0.0.2,aa:bb:cc:dd:ee:02,,\n' % OBM_TYPE_MOCK))
+        assert nodes == [
+            {'name': 'node-1',
+             'obm': {'type': OBM_TYPE_IPMI, 'host': '10.0.0.1'},
+             'nics': [{'label': 'eth0', 'macaddr': 'aa:bb:cc:dd:ee:01'},
+                      {'label': 'eth1', 'macaddr': 'aa:bb:cc:dd:ee:11'}],
+             'metadata': {'rack': '4'}},
+            {'name': 'node-2',
+             'obm': {'type': OBM_TYPE_MOCK, 'host': '10.0.0.2'},
+             'nics': [{'label': 'eth0', 'macaddr': 'aa:bb:cc:dd:ee:02'}],
+             'metadata': {}},
+        ]
+
+    def test_csv_errors(self):
+        with pytest.raises(ValueError):
+            read_nodes_csv(StringIO('name,obm.type,colour\n'))
+        with pytest.raises(ValueError):
+            read_nodes_csv(StringIO('name,obm.type\n,ipmi\n'))
+        with pytest.raises(ValueError):
+            read_nodes_csv(StringIO(''))
+
+    def test_json(self):
+        nodes = read_nodes_json(StringIO(json.dumps([
+            {'name': 'node-1', 'obm': {'type': 'ipmi'}, 'metadata': {'x': 1}},
+            {'name': 'node-2', 'obm': {'type': OBM_TYPE_MOCK}},
+        ])))
+        assert [node['obm']['type'] for node in nodes] == \
+            [OBM_TYPE_IPMI, OBM_TYPE_MOCK]
+        assert nodes[0]['metadata'] == {'x': 1}
+        with pytest.raises(ValueError):
+            read_nodes_json(StringIO('{"name": "node-1"}'))
+
 # For testing the client library we need a running HIL server, with dummy
 # objects populated. Following classes accomplish that end.
 # It shall:
@@ -333,6 +471,21 @@ class Test_node:
                 u'node-06', u'node-07', u'node-08', u'node-09'
                 ]
 
+    def test_show_many(self):
+        assert C.node.show_many(nodes=['node-07']) == [C.node.show('node-07')]
+        assert C.node.show_many('all', page_size=2) == \
+            [C.node.show(node) for node in C.node.list('all')]
+
+    def test_list_nodes_pages(self):
+        assert C.node.list('all', page_size=2) == C.node.list('all')
+
+    def test_list_nodes_fields(self):
+        assert C.node.list('allocated', project='proj-02',
+                           fields=['name', 'project']) == [
+                {u'name': u'node-02', u'project': u'proj-02'},
+                {u'name': u'node-04', u'project': u'proj-02'},
+                ]
+
     def test_show_node(self):
         assert C.node.show('node-07') == {
                 u'metadata': {},
@@ -354,6 +507,44 @@ class Test_node:
     def test_power_off(self):
         assert C.node.power_off('node-07') is None
 
+    def test_queue_obm_jobs(self):
+        jobs = C.node.queue_obm_jobs('set_bootdev',
+                                     nodes=['node-07', 'node-08'],
+                                     bootdev='pxe')
+        assert [(job['node'], job['type'], job['bootdev'])
+                for job in jobs] == [
+                    (u'node-07', u'set_bootdev', u'pxe'),
+                    (u'node-08', u'set_bootdev', u'pxe'),
+                ]
+        job = C.node.show_obm_job(jobs[1]['id'])
+        assert job['id'] == jobs[1]['id']
+        assert job['node'] == u'node-08'
+
+    def test_register_many(self):
+        obm = {'type': OBM_TYPE_IPMI, 'host': 'ipmihost', 'user': 'root',
+               'password': 'tapeworm'}
+        assert C.node.register_many([
+            {'name': 'node-20', 'obm': obm,
+             'nics': [{'label': 'eth0', 'macaddr': 'aa:bb:cc:dd:ee:20'}]},
+            {'name': 'node-21', 'obm': obm},
+        ]) is None
+        node = C.node.show('node-20')
+        assert [nic['label'] for nic in node['nics']] == ['eth0']
+        with pytest.raises(FailedAPICallException) as e:
+            C.node.register_many([
+                {'name': 'node-21', 'obm': obm},
+                {'name': 'node-22', 'obm': obm},
+                {'name': 'node-23', 'obm': dict(obm, type='no-such-obm')},
+            ])
+        assert [node for node, msg in e.value.errors] == \
+            ['node-21', 'node-23']
+        with pytest.raises(FailedAPICallException):
+            C.node.show('node-22')
+        # Other tests expect the nodes we started with:
+        C.node.remove_nic('node-20', 'eth0')
+        C.node.delete('node-20')
+        C.node.delete('node-21')
+
     def test_node_add_nic(self):
         C.node.remove_nic('node-08', 'eth0')
         assert C.node.add_nic('node-08', 'eth0', 'aa:bb:cc:dd:ee:ff') is None
@@ -382,6 +573,11 @@ class Test_node:
     def test_node_stop_console(self):
         assert C.node.stop_console('node-01') is None
 
+    def test_node_show_console(self):
+        # The mock obm driver doesn't keep a log:
+        with pytest.raises(FailedAPICallException):
+            C.node.show_console('node-01')
+
     # Network note: it is the responsibility of the calling test to
     # ensure that no net operations are pending when it is done.
     def test_node_connect_network(self):
@@ -471,6 +667,14 @@ class Test_project:
         with pytest.raises(FailedAPICallException):
             C.project.connect('no-such-project', 'node-06')
 
+    def test_project_connect_many(self):
+        C.project.create('proj-many')
+        results = C.project.connect_many('proj-many',
+                                         ['node-09', 'no-such-node'])
+        assert results[0].ok
+        assert isinstance(results[1].error, FailedAPICallException)
+        assert C.project.nodes_in('proj-many') == ['node-09']
+
     def test_project_detach_node(self):
         """ Test for correctly detaching node from project."""
         C.project.create('proj-07')
@@ -498,6 +702,11 @@ class Test_switch:
     def test_show_switch(self):
         assert C.switch.show('dell-01') == {u'name': u'dell-01', u'ports': []}
 
+    def test_show_many(self):
+        results = C.switch.show_many(['dell-01', 'no-such-switch'])
+        assert results[0] == BulkResult(C.switch.show('dell-01'), None)
+        assert isinstance(results[1].error, FailedAPICallException)
+
     def test_delete_switch(self):
         assert C.switch.delete('nexus-01') is None
 
@@ -509,6 +718,17 @@ class Test_port:
     def test_port_register(self):
         assert C.port.register('mock-01', 'gi1/1/1') is None
 
+    def test_port_register_many(self):
+        ports = [('mock-01', 'gi1/2/%d' % i) for i in range(5)]
+        assert all(result.ok for result in C.port.register_many(ports))
+        # One already exists, so the batch fails, and the others are
+        # registered one at a time:
+        results = C.port.register_many([('mock-01', 'gi1/2/5'),
+                                        ('mock-01', 'gi1/2/0'),
+                                        ('mock-01', 'gi1/2/6')])
+        assert [result.ok for result in results] == [True, False, True]
+        assert C.port.show('mock-01', 'gi1/2/6') == {}
+
     def test_port_dupregister(self):
         C.port.register('mock-01', 'gi1/1/2')
         with pytest.raises(FailedAPICallException):
@@ -650,6 +870,105 @@ class Test_user:
             C.user.set_admin('hugo', True)
 
 
+@pytest.mark.usefixtures("create_setup")
+class Test_token:
+    """Tests the client's use of bearer tokens."""
+
+    def test_token(self):
+        client = TokenHTTPClient(ep, username, password)
+        tc = Client(ep, client)
+        assert tc.project.list() == C.project.list()
+        assert client.token is None  # The first request uses basic auth.
+        assert tc.project.list() == C.project.list()
+        assert client.token is not None
+        token = client.token
+        assert tc.project.list() == C.project.list()
+        assert client.token == token
+
+    def test_revoked(self):
+        client = TokenHTTPClient(ep, username, password)
+        client.BASIC_REQUESTS = 0
+        tc = Client(ep, client)
+        tc.project.list()
+        client.token = client.token[::-1]
+        assert tc.project.list() == C.project.list()
+
+    def test_rejected_tokens(self):
+        """If the server rejects the tokens it issues (e.g. another server
+        process signed them, with a different key), the client falls back
+        to basic auth.
+        """
+        client = TokenHTTPClient(ep, username, password)
+        client.BASIC_REQUESTS = 0
+
+        def obtain_bad_token():
+            client.token, client.expires = 'bad', time.time() + 3600
+            return client.token
+        client._obtain_token = obtain_bad_token
+        tc = Client(ep, client)
+        assert tc.project.list() == C.project.list()
+        assert not client.use_tokens
+
+    def test_unauthorized(self, monkeypatch):
+        """Calls the user may not make don't stop the client using tokens.
+        """
+        C.user.create('tokenuser', 'pass1234', 'regular')
+        client = TokenHTTPClient(ep, 'tokenuser', 'pass1234')
+        client.BASIC_REQUESTS = 0
+        sent = []
+        request = requests.Session.request
+
+        def counting_request(*args, **kwargs):
+            sent.append(None)
+            return request(*args, **kwargs)
+        monkeypatch.setattr(requests.Session, 'request', counting_request)
+        with pytest.raises(FailedAPICallException):
+            Client(ep, client).project.list()
+        # One request for the token, and one refused call:
+        assert len(sent) == 2
+        assert client.use_tokens
+
+    def test_endpoint_path(self, monkeypatch):
+        """Tokens are obtained from below the endpoint's path."""
+        urls = []
+
+        def request(self, method, url, **kwargs):
+            urls.append(url)
+            raise requests.ConnectionError()
+        monkeypatch.setattr(requests.Session, 'request', request)
+        client = TokenHTTPClient('https://example.com/hil/', username,
+                                 password)
+        with pytest.raises(requests.ConnectionError):
+            client.refresh_token()
+        assert urls == ['https://example.com/hil/auth/token']
+
+    def test_threads(self):
+        """Threads sharing a client obtain a single token between them."""
+        client = TokenHTTPClient(ep, username, password)
+        client.BASIC_REQUESTS = 0
+        obtained = []
+        obtain_token = client._obtain_token
+
+        def counting_obtain_token():
+            obtained.append(None)
+            return obtain_token()
+        client._obtain_token = counting_obtain_token
+        tc = Client(ep, client)
+        pool = ThreadPool(8)
+        try:
+            results = pool.map(lambda _: tc.project.list(), range(16))
+        finally:
+            pool.close()
+        assert results == [C.project.list()] * 16
+        assert len(obtained) == 1
+
+    def test_bad_credentials(self):
+        client = TokenHTTPClient(ep, username, 'wrong')
+        client.BASIC_REQUESTS = 0
+        with pytest.raises(FailedAPICallException):
+            Client(ep, client).project.list()
+
+
 @pytest.mark.usefixtures("create_setup")
 class Test_network:
     """ Tests network related client calls. """
@@ -664,6 +983,10 @@ class Test_network:
                 u'net-05': {u'network_id': u'1005', u'projects': [u'proj-02']}
                 }
 
+    def test_network_list_pages(self):
+        """ Test list of networks, fetched in pages. """
+        assert C.network.list(page_size=2) == C.network.list()
+
     def test_network_show(self):
         """ Test show network. """
         assert C.network.show('net-01') == {
@@ -673,6 +996,12 @@ class Test_network:
                 u'owner': u'proj-01'
                 }
 
+    def test_network_show_many(self):
+        results = C.network.show_many(['net-01', 'no-such-net', 'net-02'])
+        assert [result.value for result in results] == \
+            [C.network.show('net-01'), None, C.network.show('net-02')]
+        assert isinstance(results[1].error, FailedAPICallException)
+
     def test_network_create(self):
         """ Test create network. """
         assert C.network.create('net-abcd', 'proj-01', 'proj-01', '') is None
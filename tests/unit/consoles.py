@@ -0,0 +1,301 @@
+# Copyright 2017 Massachusetts Open Cloud Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the
+# License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS
+# IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.  See the License for the specific language
+# governing permissions and limitations under the License.
+
+"""Unit tests for consoles.py"""
+import json
+import os
+import sys
+import time
+from subprocess import Popen, PIPE
+
+import pytest
+
+from hil import consoles
+from hil.consoles import ConsoleManager, RingBuffer
+from hil.test_common import fail_on_log_warnings
+
+fail_on_log_warnings = pytest.fixture(fail_on_log_warnings)
+
+pytestmark = pytest.mark.usefixtures('fail_on_log_warnings')
+
+
+@pytest.fixture
+def path(tmpdir):
+    """The path of a new, empty buffer with a capacity of 16 bytes."""
+    path = str(tmpdir.join('node.log'))
+    RingBuffer.create(path, 16)
+    return path
+
+
+class TestRingBuffer:
+
+    def test_empty(self, path):
+        buf = RingBuffer(path)
+        assert buf.read() == ('', 0)
+        assert buf.active
+
+    def test_write_read(self, path):
+        buf = RingBuffer(path)
+        buf.write('hello, ')
+        buf.write('world')
+        assert buf.read() == ('hello, world', 12)
+        assert buf.read(7) == ('world', 12)
+        assert buf.read(12) == ('', 12)
+        # Offsets past the end are clamped:
+        assert buf.read(100) == ('', 12)
+
+    def test_wrap_around(self, path):
+        buf = RingBuffer(path)
+        buf.write('0123456789')
+        buf.write('abcdefghij')
+        # Only the last 16 bytes are kept:
+        assert buf.read() == ('456789abcdefghij', 20)
+        assert buf.read(0) == ('456789abcdefghij', 20)
+        assert buf.read(15) == ('fghij', 20)
+
+    def test_oversized_write(self, path):
+        buf = RingBuffer(path)
+        buf.write('x')
+        buf.write('0123456789abcdefghij')
+        assert buf.read() == ('456789abcdefghij', 21)
+
+    def test_shared_between_openers(self, path):
+        """Writes through one mapping are visible through another."""
+        writer = RingBuffer(path)
+        reader = RingBuffer(path)
+        writer.write('hello')
+        assert reader.read() == ('hello', 5)
+        reader.active = False
+        assert not writer.active
+
+    def test_read_chunks(self, path):
+        buf = RingBuffer(path)
+        buf.write('0123456789')
+        buf.write('abcdefghij')
+        start, end, chunks = buf.read_chunks(chunk_size=5)
+        # Chunks also stop where the buffer wraps around:
+        assert (start, end, list(chunks)) == \
+            (4, 20, ['45678', '9abcd', 'ef', 'ghij'])
+        start, end, chunks = buf.read_chunks(tail=3)
+        assert (start, end, list(chunks)) == (17, 20, ['hij'])
+        start, end, chunks = buf.read_chunks(offset=10, tail=100)
+        assert (start, end, list(chunks)) == (10, 20, ['abcdef', 'ghij'])
+
+    def test_read_chunks_lapped(self, path):
+        """Output overwritten during a read is skipped."""
+        buf = RingBuffer(path)
+        buf.write('0123456789abcdef')
+        start, end, chunks = buf.read_chunks(chunk_size=4)
+        assert next(chunks) == '0123'
+        buf.write('ABCDEF')
+        # '45' was overwritten before we got to it:
+        assert list(chunks) == ['67', '89ab', 'cdef']
+
+    def test_strip_non_ascii(self):
+        assert consoles.strip_non_ascii('\x1b[0mok\xff\x80\n') == \
+            '\x1b[0mok\n'
+
+    def test_not_a_buffer(self, tmpdir):
+        path = str(tmpdir.join('junk.log'))
+        with open(path, 'w') as f:
+            f.write('This is an old-style console log.\n' * 10)
+        with pytest.raises(ValueError):
+            RingBuffer(path)
+
+    def test_helpers(self, tmpdir):
+        path = str(tmpdir.join('node.log'))
+        assert consoles.read_log(path) is None
+        consoles.stop_logging(path)
+        assert not os.path.exists(path)
+
+        consoles.start_logging(path)
+        buf = RingBuffer(path)
+        assert buf.capacity == consoles.DEFAULT_BUFFER_SIZE
+        buf.write('hello')
+        consoles.stop_logging(path)
+        assert not buf.active
+        # Starting again keeps the existing log:
+        consoles.start_logging(path)
+        assert buf.active
+        assert consoles.read_log(path) == 'hello'
+
+        consoles.delete_log(path)
+        consoles.delete_log(path)
+        assert consoles.read_log(path) is None
+
+
+def _python(code):
+    return [sys.executable, '-c', code]
+
+
+# Writes its argument to stdout, and then waits to be killed:
+ECHO_AND_WAIT = _python('import sys, time\n'
+                        'sys.stdout.write(sys.argv[1])\n'
+                        'sys.stdout.flush()\n'
+                        'time.sleep(60)\n')
+
+
+def _pump_until(manager, condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'Timed out waiting for console output'
+        manager.pump(0.1)
+
+
+def _wait_for_cleanups(manager, timeout=10):
+    deadline = time.time() + timeout
+    while manager.cleaning():
+        assert time.time() < deadline, 'Timed out waiting for cleanup'
+        time.sleep(0.01)
+
+
+class TestConsoleManager:
+
+    def test_logs_output(self, path):
+        manager = ConsoleManager()
+        manager.reconcile({path: (ECHO_AND_WAIT + ['hello'], None)})
+        buf = RingBuffer(path)
+        _pump_until(manager, lambda: buf.read()[0] == 'hello')
+        manager.stop_all()
+
+    def test_stop(self, path, tmpdir):
+        marker = str(tmpdir.join('cleaned-up'))
+        manager = ConsoleManager()
+        manager.reconcile({path: (ECHO_AND_WAIT + ['hello'],
+                                  _python('open(%r, "w")' % marker))})
+        assert len(manager.pids()) == 1
+        session = manager.sessions[path]
+
+        manager.reconcile({})
+        assert manager.pids() == {}
+        assert session.proc.poll() is not None
+        # The cleanup command runs in the background:
+        _wait_for_cleanups(manager)
+        assert os.path.exists(marker)
+        # ...and we didn't touch the log:
+        assert os.path.exists(path)
+        manager.stop_all()
+
+    def test_no_restart_during_cleanup(self, path, tmpdir):
+        """A session isn't restarted until its cleanup has finished."""
+        go = str(tmpdir.join('go'))
+        wanted = {path: (ECHO_AND_WAIT + ['hello'],
+                         _python('import os, time\n'
+                                 'while not os.path.exists(%r):\n'
+                                 '    time.sleep(0.01)\n' % go))}
+        manager = ConsoleManager()
+        manager.reconcile(wanted)
+        session = manager.sessions[path]
+        session.proc.kill()
+        session.proc.wait()
+
+        manager.reconcile(wanted)
+        assert manager.cleaning() == set([path])
+        assert path not in manager.sessions
+
+        open(go, 'w').close()
+        _wait_for_cleanups(manager)
+        manager.reconcile(wanted)
+        assert path in manager.sessions
+        manager.stop_all()
+
+    def test_restarts_dead_sessions(self, path):
+        wanted = {path: (_python('import sys; sys.stdout.write("boot ")'),
+                         None)}
+        manager = ConsoleManager()
+        buf = RingBuffer(path)
+
+        manager.reconcile(wanted)
+        session = manager.sessions[path]
+        _pump_until(manager, lambda: not session.alive())
+
+        manager.reconcile(wanted)
+        assert manager.sessions[path] is not session
+        _pump_until(manager, lambda: buf.read()[0] == 'boot boot ')
+        manager.stop_all()
+
+    def test_recreated_buffer(self, path):
+        """A session whose buffer is replaced moves to the new buffer."""
+        wanted = {path: (ECHO_AND_WAIT + ['hello'], None)}
+        manager = ConsoleManager()
+        manager.reconcile(wanted)
+        session = manager.sessions[path]
+
+        consoles.delete_log(path)
+        RingBuffer.create(path, 16)
+        manager.reconcile(wanted)
+        assert manager.sessions[path] is not session
+        assert session.proc.poll() is not None
+
+        buf = RingBuffer(path)
+        _pump_until(manager, lambda: buf.read()[0] == 'hello')
+        manager.stop_all()
+
+    def test_missing_buffer(self, tmpdir, monkeypatch):
+        """A session whose buffer has gone away isn't started."""
+        errors = []
+        monkeypatch.setattr(consoles.logger, 'exception',
+                            lambda *args: errors.append(args))
+        manager = ConsoleManager()
+        manager.reconcile({str(tmpdir.join('gone.log')):
+                           (ECHO_AND_WAIT + ['hello'], None)})
+        assert manager.sessions == {}
+        assert len(errors) == 1
+
+
+class TestRegistry:
+    """Test recovering from a daemon which died uncleanly."""
+
+    def test_registry(self, path, tmpdir):
+        registry = str(tmpdir.join('sessions.json'))
+        manager = ConsoleManager(registry=registry)
+        manager.reconcile({path: (ECHO_AND_WAIT + ['hello'], None)})
+        with open(registry) as f:
+            assert json.load(f) == {path: {
+                'pid': manager.pids()[path],
+                'program': sys.executable,
+            }}
+        manager.stop_all()
+        with open(registry) as f:
+            assert json.load(f) == {}
+
+    def test_recover(self, path, tmpdir):
+        registry = str(tmpdir.join('sessions.json'))
+        old_manager = ConsoleManager(registry=registry)
+        old_manager.reconcile({path: (ECHO_AND_WAIT + ['hello'], None)})
+        orphan = old_manager.sessions[path].proc
+        # ...and then the old daemon dies, without cleaning up.
+
+        manager = ConsoleManager(registry=registry)
+        assert manager.recover() == [path]
+        assert orphan.wait() != 0
+        with open(registry) as f:
+            assert json.load(f) == {}
+
+    def test_recover_checks_program(self, tmpdir):
+        """We don't kill a process which has reused a registered pid."""
+        registry = str(tmpdir.join('sessions.json'))
+        proc = Popen(ECHO_AND_WAIT + ['hello'], stdout=PIPE)
+        with open(registry, 'w') as f:
+            json.dump({'/some/node.log': {'pid': proc.pid,
+                                          'program': 'ipmitool'}}, f)
+        manager = ConsoleManager(registry=registry)
+        assert manager.recover() == ['/some/node.log']
+        assert proc.poll() is None
+        proc.kill()
+        proc.wait()
+
+    def test_recover_no_registry(self, tmpdir):
+        manager = ConsoleManager(registry=str(tmpdir.join('sessions.json')))
+        assert manager.recover() == []
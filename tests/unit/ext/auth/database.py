@@ -5,8 +5,13 @@ from hil.flaskapp import app
 from hil.model import db
 from hil.errors import AuthorizationError, IllegalStateError
 from hil.rest import init_auth, local
+from hil.auth import get_auth_backend
+import base64
 import flask
+import json
 import pytest
+import sqlalchemy
+import time
 import unittest
 
 fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
@@ -84,6 +89,8 @@ class FakeAuthRequest(object):
     database auth plugin to work.
     """
 
+    headers = {}
+
     def __init__(self, username, password):
         self.username = username
         self.password = password
@@ -100,6 +107,16 @@ class FakeNoAuthRequest(object):
     unauthenticated.
     """
     authorization = None
+    headers = {}
+
+
+class FakeTokenRequest(object):
+    """Fake request object, authenticated with a bearer token."""
+
+    authorization = None
+
+    def __init__(self, token):
+        self.headers = {'Authorization': 'Bearer ' + token}
 
 
 @pytest.fixture
@@ -293,6 +310,247 @@ class TestUserAddRemoveProject(DBAuthTestCase):
 
 
 @pytest.mark.usefixtures('configure', 'initial_db')
+@pytest.fixture
+def verify_calls(monkeypatch, dbauth):
+    """Count the (slow) password verifications done by the auth backend."""
+    calls = []
+    real_sha512_crypt = dbauth.sha512_crypt
+
+    class CountingSha512Crypt(object):
+
+        @staticmethod
+        def verify(password, hashed_password):
+            calls.append(password)
+            return real_sha512_crypt.verify(password, hashed_password)
+
+        @staticmethod
+        def encrypt(password):
+            return real_sha512_crypt.encrypt(password)
+
+    monkeypatch.setattr(dbauth, 'sha512_crypt', CountingSha512Crypt)
+    return calls
+
+
+@use_fixtures('admin_auth')
+class TestCredentialCache(object):
+    """Tests for the cache of verified passwords."""
+
+    def _authenticate(self, username, password):
+        flask.request = FakeAuthRequest(username, password)
+        return get_auth_backend().authenticate()
+
+    def test_cached(self, verify_calls):
+        del verify_calls[:]
+        assert self._authenticate('bob', 'password')
+        assert self._authenticate('bob', 'password')
+        assert verify_calls == ['password']
+
+    def test_wrong_password(self, verify_calls):
+        self._authenticate('bob', 'password')
+        del verify_calls[:]
+        assert not self._authenticate('bob', 'wrong')
+        assert not self._authenticate('bob', 'wrong')
+        assert verify_calls == ['wrong', 'wrong']
+
+    def test_set_password(self, dbauth):
+        self._authenticate('bob', 'password')
+        bob = dbauth.User.query.filter_by(label='bob').one()
+        bob.set_password('hunter2')
+        db.session.commit()
+        assert not self._authenticate('bob', 'password')
+        assert self._authenticate('bob', 'hunter2')
+
+    def test_changed_elsewhere(self, dbauth):
+        """A password change made by another process is also noticed."""
+        self._authenticate('bob', 'password')
+        dbauth.User.query.filter_by(label='bob') \
+            .update({'hashed_password': dbauth.sha512_crypt.encrypt('x')})
+        assert not self._authenticate('bob', 'password')
+
+    @pytest.mark.parametrize('call,args', [
+        ('user_delete', ['bob']),
+        ('user_set_admin', ['bob', True]),
+    ])
+    def test_invalidated(self, dbauth, call, args):
+        self._authenticate('bob', 'password')
+        bob = dbauth.User.query.filter_by(label='bob').one()
+        assert dbauth.credentials.check(bob, 'password')
+        self._authenticate('alice', 'secret')
+        getattr(dbauth, call)(*args)
+        assert not dbauth.credentials.check(bob, 'password')
+
+    def test_ttl(self, verify_calls):
+        config_merge({'hil.ext.auth.database': {
+            'credential_cache_ttl': '0',
+        }})
+        del verify_calls[:]
+        self._authenticate('bob', 'password')
+        self._authenticate('bob', 'password')
+        assert verify_calls == ['password', 'password']
+
+    def test_size(self, verify_calls):
+        config_merge({'hil.ext.auth.database': {
+            'credential_cache_size': '1',
+        }})
+        del verify_calls[:]
+        self._authenticate('bob', 'password')
+        self._authenticate('alice', 'secret')
+        self._authenticate('bob', 'password')
+        assert verify_calls == ['password', 'secret', 'password']
+
+
+@use_fixtures('admin_auth')
+class TestTokens(object):
+    """Tests for bearer tokens."""
+
+    def _token(self, username, password):
+        flask.request = FakeAuthRequest(username, password)
+        assert get_auth_backend().authenticate()
+        return json.loads(dbauth().auth_token())['token']
+
+    def _authenticate(self, token):
+        flask.request = FakeTokenRequest(token)
+        return get_auth_backend().authenticate()
+
+    def test_token(self, verify_calls):
+        token = self._token('bob', 'password')
+        del verify_calls[:]
+        assert self._authenticate(token)
+        assert local.auth.label == 'bob'
+        assert verify_calls == []
+
+    def test_expires(self):
+        token = json.loads(dbauth().auth_token())
+        assert token['expires'] > time.time() + 3500
+        config_merge({'hil.ext.auth.database': {'token_ttl': '-1'}})
+        assert not self._authenticate(self._token('bob', 'password'))
+
+    def test_anonymous(self):
+        flask.request = FakeNoAuthRequest()
+        get_auth_backend().authenticate()
+        with pytest.raises(AuthorizationError):
+            dbauth().auth_token()
+
+    @pytest.mark.parametrize('token', [
+        '',
+        'garbage',
+        'garbage.garbage',
+        u'\u2603',
+    ])
+    def test_invalid(self, token):
+        assert not self._authenticate(token)
+
+    def test_tampered(self):
+        payload, signature = str(self._token('bob', 'password')).split('.')
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        claims['admin'] = True
+        payload = base64.urlsafe_b64encode(json.dumps(claims))
+        assert not self._authenticate(payload + '.' + signature)
+
+    def test_secret(self):
+        config_merge({'hil.ext.auth.database': {'token_secret': 'one'}})
+        token = self._token('bob', 'password')
+        assert self._authenticate(token)
+        config_merge({'hil.ext.auth.database': {'token_secret': 'two'}})
+        assert not self._authenticate(token)
+
+    def test_set_password(self):
+        token = self._token('bob', 'password')
+        bob = dbauth().User.query.filter_by(label='bob').one()
+        bob.set_password('hunter2')
+        db.session.commit()
+        assert not self._authenticate(token)
+
+    @pytest.mark.parametrize('call,args', [
+        ('user_delete', ['bob']),
+        ('user_set_admin', ['bob', True]),
+    ])
+    def test_revoked(self, call, args):
+        token = self._token('bob', 'password')
+        self._token('alice', 'secret')
+        getattr(dbauth(), call)(*args)
+        assert not self._authenticate(token)
+
+
+@pytest.mark.usefixtures('configure', 'initial_db', 'server_init')
+def test_token_rest():
+    """Tokens can be obtained and used over HTTP."""
+    client = app.test_client()
+    basic = 'Basic ' + base64.b64encode('bob:password')
+    resp = client.post('/auth/token', headers={'Authorization': basic})
+    assert resp.status_code == 200
+    token = json.loads(resp.get_data())['token']
+
+    bearer = 'Bearer ' + token
+    resp = client.get('/projects', headers={'Authorization': bearer})
+    assert resp.status_code == 401  # bob is not an admin.
+    # ...which is not the token's fault:
+    assert 'WWW-Authenticate' not in resp.headers
+    resp = client.post('/auth/token', headers={'Authorization': bearer})
+    assert resp.status_code == 200
+
+    basic = 'Basic ' + base64.b64encode('alice:secret')
+    token = json.loads(client.post('/auth/token',
+                                   headers={'Authorization': basic})
+                       .get_data())['token']
+    resp = client.get('/projects',
+                      headers={'Authorization': 'Bearer ' + token})
+    assert resp.status_code == 200
+    resp = client.get('/projects', headers={'Authorization': 'Bearer bad'})
+    assert resp.status_code == 401
+    assert resp.headers['WWW-Authenticate'] == 'Bearer error="invalid_token"'
+
+
+@use_fixtures('admin_auth')
+class TestAuthContext(object):
+    """Tests for the database backend's authorization context."""
+
+    def test_context(self, dbauth):
+        runway = model.Project.query.filter_by(label='runway').one()
+        context = get_auth_backend().context()
+        assert context.admin
+        assert context.project_ids == frozenset([runway.id])
+
+        flask.request = FakeAuthRequest('bob', 'password')
+        get_auth_backend().authenticate()
+        context = get_auth_backend().context()
+        assert not context.admin
+        assert context.project_ids == frozenset()
+
+    def test_no_queries(self, dbauth):
+        """Once built, the context answers access checks by itself."""
+        projects = [model.Project('project-%d' % i) for i in range(10)]
+        db.session.add_all(projects)
+        bob = dbauth.User.query.filter_by(label='bob').one()
+        bob.projects.extend(projects[:5])
+        db.session.commit()
+        db.session.expunge_all()
+
+        flask.request = FakeAuthRequest('bob', 'password')
+        backend = get_auth_backend()
+        backend.authenticate()
+        projects = model.Project.query \
+            .filter(model.Project.label.like('project-%')) \
+            .order_by(model.Project.label).all()
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        backend.context()
+        sqlalchemy.event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            access = [backend.have_project_access(p) for p in projects]
+        finally:
+            sqlalchemy.event.remove(db.engine, 'before_cursor_execute',
+                                    record)
+        assert access == [True] * 5 + [False] * 5
+        assert statements == []
+        # ...and the user's projects were never loaded:
+        assert 'projects' in sqlalchemy.inspect(local.auth).unloaded
+
+
 class TestUserModel(ModelTest):
     """Basic sanity check for the User model.
 
@@ -92,3 +92,15 @@ def test_admin_implies_project_access(auth_backend):
     auth_backend.set_admin(True)
     auth_backend.require_project_access(runway)
     auth_backend.require_project_access(manhattan)
+
+
+def test_context(auth_backend):
+    """The context reflects changes made with set_admin and set_project."""
+    runway = Project.query.filter_by(label="runway").one()
+    assert not auth_backend.context().admin
+    auth_backend.set_admin(True)
+    assert auth_backend.context().admin
+    auth_backend.set_admin(False)
+    auth_backend.set_project(runway)
+    assert not auth_backend.context().admin
+    assert auth_backend.have_project_access(runway)
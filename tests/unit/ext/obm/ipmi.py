@@ -13,8 +13,11 @@
 # governing permissions and limitations under the License.
 
 """Unit tests for ipmi.py"""
+import json
+import os
 import pytest
-from hil import server, api
+import sys
+from hil import server, api, model
 from hil.test_common import config, config_testsuite, fresh_database, \
     fail_on_log_warnings, with_request_context, config_merge
 
@@ -52,6 +55,62 @@ default_fixtures = ['fail_on_log_warnings',
 pytestmark = pytest.mark.usefixtures(*default_fixtures)
 
 
+FAKE_IPMITOOL = """#!%(python)s
+# A stand-in for ipmitool, which records its invocations to a log, and
+# prints $FAKE_IPMITOOL_OUTPUT.
+import json
+import os
+import sys
+import time
+
+args = sys.argv[1:]
+start = time.time()
+stdin = sys.stdin.read() if args[-2:] == ['exec', '/dev/stdin'] else None
+fail = os.environ.get('FAKE_IPMITOOL_FAIL')
+status = 0
+for line in (stdin or ' '.join(args)).splitlines():
+    if fail and fail in line:
+        status = 1
+    else:
+        status = 0
+sys.stdout.write(os.environ.get('FAKE_IPMITOOL_OUTPUT', ''))
+with open(%(log)r, 'a') as log:
+    log.write(json.dumps({'args': args,
+                          'stdin': stdin,
+                          'start': start,
+                          'end': time.time()}) + '\\n')
+sys.exit(status)
+"""
+
+
+@pytest.fixture
+def ipmitool(tmpdir, monkeypatch):
+    """Put a fake ipmitool on $PATH.
+
+    Returns a function which returns the list of invocations so far.
+    """
+    log = str(tmpdir.join('ipmitool.log'))
+    script = tmpdir.join('ipmitool')
+    script.write(FAKE_IPMITOOL % {'python': sys.executable, 'log': log})
+    script.chmod(0755)
+    monkeypatch.setenv('PATH', str(tmpdir) + os.pathsep + os.environ['PATH'])
+
+    def invocations():
+        if not os.path.exists(log):
+            return []
+        with open(log) as f:
+            return [json.loads(line) for line in f]
+    return invocations
+
+
+def _register_node():
+    api.node_register('node-99', obm={
+              "type": "http://schema.massopencloud.org/haas/v0/obm/ipmi",
+              "host": "ipmihost",
+              "user": "root",
+              "password": "tapeworm"})
+
+
 class TestIpmi:
     """Test IPMI functions."""
 
@@ -78,3 +137,116 @@ class TestIpmi:
 
         with pytest.raises(api.BadArgumentError):
             instance.require_legal_bootdev("not_valid_bootdev")
+
+    def test_power_cycle_one_session(self, ipmitool):
+        """power_cycle sets the bootdev and cycles in one invocation."""
+        _register_node()
+        api.node_power_cycle('node-99')
+
+        calls = ipmitool()
+        assert len(calls) == 1
+        assert calls[0]['args'] == ['-I', 'lanplus',
+                                    '-U', 'root',
+                                    '-P', 'tapeworm',
+                                    '-H', 'ipmihost',
+                                    'exec', '/dev/stdin']
+        assert calls[0]['stdin'] == \
+            'chassis bootdev pxe\nchassis power cycle\n'
+
+    def test_power_cycle_off_node(self, ipmitool, monkeypatch):
+        """If the node is off, power cycle fails, so we power it on."""
+        monkeypatch.setenv('FAKE_IPMITOOL_FAIL', 'power cycle')
+        _register_node()
+        api.node_power_cycle('node-99')
+
+        calls = ipmitool()
+        assert len(calls) == 2
+        assert calls[1]['args'][-3:] == ['chassis', 'power', 'on']
+        assert calls[1]['stdin'] is None
+
+    def test_power_cycle_failure(self, ipmitool, monkeypatch):
+        monkeypatch.setenv('FAKE_IPMITOOL_FAIL', 'power')
+        _register_node()
+        with pytest.raises(api.OBMError):
+            api.node_power_cycle('node-99')
+        assert len(ipmitool()) == 2
+
+    @pytest.mark.parametrize('output,state', [
+        ('Chassis Power is on\n', 'on'),
+        ('Chassis Power is off\n', 'off'),
+        ('Error: Unable to establish IPMI v2 / RMCP+ session\n', None),
+    ])
+    def test_power_status(self, ipmitool, monkeypatch, output, state):
+        monkeypatch.setenv('FAKE_IPMITOOL_OUTPUT', output)
+        _register_node()
+        # node_power_status leaves reading the state to the obm daemon,
+        # which does this:
+        api._must_find(model.Node, 'node-99').refresh_power_state()
+        model.db.session.commit()
+        status = json.loads(api.node_power_status('node-99'))
+        assert status['state'] == state
+        assert (status['error'] is None) == (state is not None)
+        assert ipmitool()[0]['args'][-3:] == ['chassis', 'power', 'status']
+
+
+@pytest.fixture
+def console_dir(tmpdir):
+    """Keep console logs in a temporary directory."""
+    config_merge({'console': {'log_dir': str(tmpdir)}})
+    return tmpdir
+
+
+class TestConsole:
+    """Test the IPMI driver's use of the console daemon's buffers."""
+
+    def test_start_stop_console(self, console_dir):
+        from hil import consoles
+        _register_node()
+        api.start_console('node-99')
+        path = str(console_dir.join('ipmihost.log'))
+
+        # The console daemon would now start logging:
+        assert consoles.wanted_sessions() == {path: (
+            ['ipmitool', '-I', 'lanplus', '-U', 'root', '-P', 'tapeworm',
+             '-H', 'ipmihost', 'sol', 'activate'],
+            ['ipmitool', '-I', 'lanplus', '-U', 'root', '-P', 'tapeworm',
+             '-H', 'ipmihost', 'sol', 'deactivate'],
+        )}
+        consoles.RingBuffer(path).write('Booting...\xff\n')
+        assert api.show_console('node-99').get_data() == 'Booting...\n'
+
+        api.stop_console('node-99')
+        assert consoles.wanted_sessions() == {}
+        assert not os.path.exists(path)
+        with pytest.raises(api.NotFoundError):
+            api.show_console('node-99')
+
+    def test_show_console_range(self, console_dir):
+        from hil import consoles
+        _register_node()
+        api.start_console('node-99')
+        buf = consoles.RingBuffer(str(console_dir.join('ipmihost.log')))
+        buf.write('Booting...\n')
+
+        response = api.show_console('node-99', tail=4)
+        assert response.get_data() == '...\n'
+        assert response.headers['X-Console-Start'] == '7'
+        assert response.headers['X-Console-Offset'] == '11'
+
+        # Following the log, we see only the new output:
+        buf.write('\xffLogin: ')
+        response = api.show_console('node-99', offset=11)
+        assert response.get_data() == 'Login: '
+        assert response.headers['X-Console-Offset'] == '19'
+
+        with pytest.raises(api.BadArgumentError):
+            api.show_console('node-99', offset=0, tail=0)
+
+    def test_cleanup_commands(self, console_dir):
+        from hil import consoles
+        _register_node()
+        path = str(console_dir.join('ipmihost.log'))
+        assert consoles.cleanup_commands([path, '/no/such/node.log']) == {
+            path: ['ipmitool', '-I', 'lanplus', '-U', 'root',
+                   '-P', 'tapeworm', '-H', 'ipmihost', 'sol', 'deactivate'],
+        }
@@ -0,0 +1,146 @@
+# Copyright 2017 Massachusetts Open Cloud Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS
+# IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+"""Unit tests for the PowerConnect 55xx driver's output parsing.
+
+These replay synthetic console transcripts (see ``hil.test_common``) into
+the driver; no switch is involved.
+"""
+
+import pytest
+from StringIO import StringIO
+
+from hil import model
+from hil.test_common import fail_on_log_warnings, dell_transcript, \
+    replay_session
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+
+
+@pytest.fixture()
+def switch():
+    from hil.ext.switches.dell import PowerConnect55xx
+    return PowerConnect55xx(label='sw0',
+                            hostname='sw0.example.com',
+                            username='admin',
+                            password='secret')
+
+
+def test_get_port_networks(switch):
+    ports = [model.Port(label='gi1/0/%d' % i, switch=switch)
+             for i in range(1, 4)]
+    session = replay_session(switch, dell_transcript([
+        ('gi1/0/1', '1', '1'),
+        ('gi1/0/2', '100 (Inactive)', '100,200 (Inactive),300'),
+        ('gi1/0/3', 'none', 'none'),
+    ]), strict=True)
+    assert session.get_port_networks(ports) == {
+        ports[0]: [('vlan/1', 1), ('vlan/native', 1)],
+        ports[1]: [('vlan/100', 100),
+                   ('vlan/200', 200),
+                   ('vlan/300', 300),
+                   ('vlan/native', 100)],
+        ports[2]: [],
+    }
+    assert session.console.remaining() == 0
+
+
+def test_continuation_lines(switch):
+    """Long vlan lists wrap onto indented continuation lines."""
+    port = model.Port(label='gi1/0/1', switch=switch)
+    session = replay_session(switch, dell_transcript([
+        ('gi1/0/1', '5', '5,100,101,102,\r\n    103,104 (Inactive),\r\n'
+         '    105'),
+    ]), strict=True)
+    assert session.get_port_networks([port]) == {
+        port: [('vlan/%d' % i, i) for i in [5, 100, 101, 102, 103, 104, 105]]
+        + [('vlan/native', 5)],
+    }
+
+
+@pytest.mark.parametrize('page_length', [3, 7, 20, 100])
+def test_paging_52_ports(switch, page_length):
+    """A full 52 port switch parses the same regardless of paging."""
+    labels = ['gi1/0/%d' % i for i in range(1, 53)]
+    ports = [model.Port(label=label, switch=switch) for label in labels]
+    session = replay_session(switch, dell_transcript(
+        [(label, '%d (Inactive)' % i, '1,%d' % i)
+         for i, label in enumerate(labels, 100)],
+        page_length=page_length,
+    ), strict=True)
+    assert session.get_port_networks(ports) == dict(
+        (port, [('vlan/1', 1), ('vlan/%d' % i, i), ('vlan/native', i)])
+        for i, port in enumerate(ports, 100)
+    )
+
+
+def test_strict_replay_catches_divergence(switch):
+    """A strict replay fails if the driver sends something unexpected."""
+    from hil.ext.switches._transcript import TranscriptMismatch
+    port = model.Port(label='gi1/0/2', switch=switch)
+    session = replay_session(switch, dell_transcript([
+        ('gi1/0/1', '1', '1'),
+    ]), strict=True)
+    with pytest.raises(TranscriptMismatch):
+        session.get_port_networks([port])
+
+
+def test_record_and_replay(switch):
+    """A recorded session replays identically."""
+    from hil.ext.switches import _transcript
+    port = model.Port(label='gi1/0/1', switch=switch)
+    transcript = StringIO()
+    session = replay_session(switch, dell_transcript([
+        ('gi1/0/1', '7 (Inactive)', '7,8'),
+    ], page_length=5))
+    _transcript.record(session.console, transcript)
+    expected = session.get_port_networks([port])
+
+    transcript.seek(0)
+    events = _transcript.load(transcript)
+    assert events[0] == ('send', 'show int sw gi1/0/1')
+
+    # The login happened before we started recording, so replay the
+    # recording on an already open session:
+    session.console = _transcript.ReplayConsole(events, strict=True)
+    assert session.get_port_networks([port]) == expected
+
+
+def test_spawn_closes_transcript(switch, tmpdir):
+    """The transcript of a spawned console is closed along with it."""
+    from hil.ext.switches import _console
+    from hil.test_common import config_testsuite, config_merge
+    config_testsuite()
+    config_merge({'devel': {'switch_transcripts': str(tmpdir)}})
+    console = _console.spawn(switch, 'cat')
+    console.sendline('hello')
+    console.expect('hello')
+    transcript = console.transcript
+    assert not transcript.closed
+    console.close()
+    assert transcript.closed
+    [filename] = tmpdir.listdir()
+    assert filename.basename.startswith('sw0-')
+    assert 'hello' in filename.read()
+
+
+def test_spawn_transcripts_distinct(switch, tmpdir):
+    """Sessions started in the same second get a transcript each."""
+    from hil.ext.switches import _console
+    from hil.test_common import config_testsuite, config_merge
+    config_testsuite()
+    config_merge({'devel': {'switch_transcripts': str(tmpdir)}})
+    consoles = [_console.spawn(switch, 'cat') for _ in range(2)]
+    for console in consoles:
+        console.close()
+    assert len(tmpdir.listdir()) == 2
@@ -0,0 +1,72 @@
+# Copyright 2017 Massachusetts Open Cloud Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS
+# IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+"""Unit tests for the Dell N3000 driver's output parsing.
+
+These replay synthetic console transcripts (see ``hil.test_common``) into
+the driver; no switch is involved.
+"""
+
+import pytest
+
+from hil import model
+from hil.test_common import fail_on_log_warnings, n3000_transcript, \
+    replay_session
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+
+
+@pytest.fixture()
+def switch():
+    from hil.ext.switches.n3000 import DellN3000
+    return DellN3000(label='sw0',
+                     hostname='sw0.example.com',
+                     username='admin',
+                     password='secret',
+                     dummy_vlan='2222')
+
+
+def test_get_port_networks(switch):
+    ports = [model.Port(label='gi1/0/%d' % i, switch=switch)
+             for i in range(1, 4)]
+    session = replay_session(switch, n3000_transcript([
+        ('gi1/0/1', '1 (default)', '1'),
+        ('gi1/0/2', '100 (Inactive)', '100,200 (Inactive),300'),
+        # The dummy vlan stands in for "no native vlan":
+        ('gi1/0/3', '2222', '2222'),
+    ], dummy_vlan='2222'), strict=True)
+    assert session.get_port_networks(ports) == {
+        ports[0]: [('vlan/1', 1), ('vlan/native', 1)],
+        ports[1]: [('vlan/100', 100),
+                   ('vlan/200', 200),
+                   ('vlan/300', 300),
+                   ('vlan/native', 100)],
+        ports[2]: [('vlan/2222', 2222)],
+    }
+    # The prompt echoed for the second newline after the last port is still
+    # unread:
+    assert session.console.remaining() == 1
+
+
+def test_52_ports(switch):
+    labels = ['gi1/0/%d' % i for i in range(1, 53)]
+    ports = [model.Port(label=label, switch=switch) for label in labels]
+    session = replay_session(switch, n3000_transcript(
+        [(label, '%d (Inactive)' % i, '1,%d' % i)
+         for i, label in enumerate(labels, 100)],
+        dummy_vlan='2222',
+    ), strict=True)
+    assert session.get_port_networks(ports) == dict(
+        (port, [('vlan/1', 1), ('vlan/%d' % i, i), ('vlan/native', i)])
+        for i, port in enumerate(ports, 100)
+    )
@@ -0,0 +1,73 @@
+# Copyright 2017 Massachusetts Open Cloud Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS
+# IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+"""Unit tests for the Nexus driver's output parsing.
+
+These replay synthetic console transcripts (see ``hil.test_common``) into
+the driver; no switch is involved.
+"""
+
+import pytest
+
+from hil import model
+from hil.test_common import fail_on_log_warnings, nexus_transcript, \
+    replay_session
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+
+
+@pytest.fixture()
+def switch():
+    from hil.ext.switches.nexus import Nexus
+    return Nexus(label='sw0',
+                 hostname='sw0.example.com',
+                 username='admin',
+                 password='secret',
+                 dummy_vlan='2222')
+
+
+def test_get_port_networks(switch):
+    ports = [model.Port(label='Ethernet1/%d' % i, switch=switch)
+             for i in range(1, 4)]
+    session = replay_session(switch, nexus_transcript([
+        ('Ethernet1/1', '1 (default)', '1'),
+        ('Ethernet1/2', '100 (Inactive)', '100,200 (Inactive),300'),
+        ('Ethernet1/3', '2222', 'none'),
+        # Not asked about:
+        ('Ethernet1/4', '1 (default)', '1'),
+    ]), strict=True)
+    assert session.get_port_networks(ports) == {
+        ports[0]: [('vlan/1', 1), ('vlan/native', 1)],
+        ports[1]: [('vlan/100', 100),
+                   ('vlan/200', 200),
+                   ('vlan/300', 300),
+                   ('vlan/native', 100)],
+        ports[2]: [],
+    }
+    assert session.console.remaining() == 0
+
+
+@pytest.mark.parametrize('page_length', [3, 7, 40, 1000])
+def test_paging_52_ports(switch, page_length):
+    """A full 52 port switch parses the same regardless of paging."""
+    labels = ['Ethernet1/%d' % i for i in range(1, 53)]
+    ports = [model.Port(label=label, switch=switch) for label in labels]
+    session = replay_session(switch, nexus_transcript(
+        [(label, '%d (Inactive)' % i, '1,%d' % i)
+         for i, label in enumerate(labels, 100)],
+        page_length=page_length,
+    ), strict=True)
+    assert session.get_port_networks(ports) == dict(
+        (port, [('vlan/1', 1), ('vlan/%d' % i, i), ('vlan/native', i)])
+        for i, port in enumerate(ports, 100)
+    )
@@ -23,9 +23,10 @@
 
 from hil.model import *
 from hil import config
+from datetime import datetime
 
 from hil.test_common import fresh_database, config_testsuite, ModelTest, \
-    fail_on_log_warnings
+    fail_on_log_warnings, count_queries
 import pytest
 
 fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
@@ -121,3 +122,167 @@ class TestNetworkingAction(ModelTest):
         return NetworkingAction(nic=nic,
                                 new_network=network,
                                 channel='null')
+
+
+class TestObmJob(ModelTest):
+
+    def sample_obj(self):
+        from hil.ext.obm.ipmi import Ipmi
+        node = Node(label='node-99',
+                    obm=Ipmi(type=Ipmi.api_name,
+                             host="ipmihost",
+                             user="root",
+                             password="tapeworm"))
+        return ObmJob(node=node, type='set_bootdev', bootdev='pxe')
+
+
+class TestPowerState(ModelTest):
+
+    def sample_obj(self):
+        from hil.ext.obm.ipmi import Ipmi
+        node = Node(label='node-99',
+                    obm=Ipmi(type=Ipmi.api_name,
+                             host="ipmihost",
+                             user="root",
+                             password="tapeworm"))
+        return PowerState(node=node, state='on', updated=datetime.utcnow())
+
+
+class TestGeneration:
+    """Test that commits bump the generations of the tables they change."""
+
+    def generations(self):
+        return dict((g.table_name, g.generation)
+                    for g in Generation.query.all())
+
+    def test_insert(self):
+        db.session.add(Project('anvil-nextgen'))
+        db.session.commit()
+        assert self.generations()['project'] == 1
+
+    def test_update_and_delete(self):
+        project = Project('anvil-nextgen')
+        db.session.add(project)
+        db.session.commit()
+        before = self.generations()
+
+        project.label = 'anvil-oldgen'
+        db.session.commit()
+        db.session.delete(project)
+        db.session.commit()
+        assert self.generations()['project'] == before['project'] + 2
+
+    def test_unchanged(self):
+        project = Project('anvil-nextgen')
+        db.session.add(project)
+        db.session.commit()
+        before = self.generations()
+
+        # Setting an attribute to its current value isn't a change:
+        project.label = project.label
+        db.session.commit()
+        assert self.generations() == before
+
+    def test_many_to_many(self):
+        project = Project('anvil-nextgen')
+        network = Network(project, [], True, '102', 'hammernet')
+        db.session.add(network)
+        db.session.commit()
+        before = self.generations()
+
+        network.access.append(project)
+        db.session.commit()
+        after = self.generations()
+        assert after['network_projects'] == before['network_projects'] + 1
+        assert after['project'] == before['project']
+
+    def test_bulk_delete(self):
+        db.session.add(Project('anvil-nextgen'))
+        db.session.commit()
+        before = self.generations()
+
+        Project.query.filter_by(label='anvil-nextgen').delete()
+        db.session.commit()
+        assert self.generations()['project'] == before['project'] + 1
+
+    def test_rollback(self):
+        db.session.add(Project('anvil-nextgen'))
+        db.session.flush()
+        db.session.rollback()
+        assert self.generations()['project'] == 0
+
+    def test_once_per_transaction(self):
+        project = Project('anvil-nextgen')
+        db.session.add(project)
+        db.session.flush()
+        project.label = 'anvil-oldgen'
+        db.session.flush()
+        # The counters are only bumped on commit:
+        assert self.generations()['project'] == 0
+        db.session.commit()
+        assert self.generations()['project'] == 1
+
+    def test_subtransaction(self):
+        db.session.begin(subtransactions=True)
+        db.session.add(Project('anvil-nextgen'))
+        db.session.commit()
+        assert self.generations()['project'] == 0
+        db.session.commit()
+        assert self.generations()['project'] == 1
+
+    def test_every_table_has_a_counter(self):
+        assert set(db.metadata.tables) <= set(self.generations())
+
+
+class TestPolymorphicLoading:
+    """Test that loading many switches or obms via `polymorphic` costs a
+    single query, driver columns and all.
+    """
+
+    def test_switches(self):
+        from hil.ext.switches.mock import MockSwitch
+        from hil.ext.switches.nexus import Nexus
+        db.create_all()
+        for i in range(5):
+            db.session.add(MockSwitch(label='mock-%d' % i,
+                                      type=MockSwitch.api_name,
+                                      hostname='mock-%d' % i,
+                                      username='admin',
+                                      password='secret'))
+            db.session.add(Nexus(label='nexus-%d' % i,
+                                 type=Nexus.api_name,
+                                 hostname='nexus-%d' % i,
+                                 username='admin',
+                                 password='secret',
+                                 dummy_vlan='2222'))
+        db.session.commit()
+        db.session.remove()
+
+        with count_queries() as statements:
+            hostnames = [switch.hostname for switch in
+                         db.session.query(polymorphic(Switch))]
+        assert sorted(hostnames) == sorted(['mock-%d' % i for i in range(5)] +
+                                           ['nexus-%d' % i for i in range(5)])
+        assert len(statements) == 1
+
+    def test_node_obms(self):
+        from hil.ext.obm.ipmi import Ipmi
+        from hil.ext.obm.mock import MockObm
+        db.create_all()
+        for i in range(5):
+            for cls in Ipmi, MockObm:
+                label = '%s-%d' % (cls.__name__, i)
+                db.session.add(Node(label=label,
+                                    obm=cls(type=cls.api_name,
+                                            host=label,
+                                            user='root',
+                                            password='tapeworm')))
+        db.session.commit()
+        db.session.remove()
+
+        with count_queries() as statements:
+            nodes = Node.query.options(db.joinedload(
+                Node.obm.of_type(polymorphic(Obm)))).all()
+            assert all(node.obm.host == node.label for node in nodes)
+        assert len(nodes) == 10
+        assert len(statements) == 1
@@ -0,0 +1,324 @@
+# Copyright 2017 Massachusetts Open Cloud Contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the
+# License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS
+# IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.  See the License for the specific language
+# governing permissions and limitations under the License.
+
+"""Unit tests for obm_jobs.py"""
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+import sqlalchemy
+
+from hil import api, config, model, server
+from hil.errors import OBMError
+from hil.model import db
+from hil.obm_jobs import JobRunner
+from hil.test_common import config_testsuite, config_merge, \
+    fresh_database, fail_on_log_warnings, with_request_context
+
+OBM_TYPE_MOCK = 'http://schema.massopencloud.org/haas/v0/obm/mock'
+
+
+@pytest.fixture
+def configure(tmpdir):
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.obm.mock': '',
+        },
+        # The jobs run in other threads, which need to see the same
+        # database, so we can't use an in-memory one:
+        'database': {
+            'uri': 'sqlite:///' + str(tmpdir.join('hil.db')),
+        },
+    })
+    config.load_extensions()
+
+
+fresh_database = pytest.fixture(fresh_database)
+fail_on_log_warnings = pytest.fixture(fail_on_log_warnings)
+with_request_context = pytest.yield_fixture(with_request_context)
+
+
+@pytest.fixture
+def server_init():
+    server.register_drivers()
+    server.validate_state()
+
+
+pytestmark = pytest.mark.usefixtures('fail_on_log_warnings',
+                                     'configure',
+                                     'fresh_database',
+                                     'server_init',
+                                     'with_request_context')
+
+
+class ConcurrencyMonitor(object):
+    """Records how many calls to an obm operation run at once.
+
+    Monkeypatch the result of ``operation()`` over the operation.
+    """
+
+    def __init__(self, duration=0.05, error=None, result=None):
+        self.duration = duration
+        self.error = error
+        self.result = result
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.calls = []
+
+    def operation(self):
+        return lambda obm, *args: self._call(obm, *args)
+
+    def _call(self, obm, *args):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.calls.append((obm.host,) + args)
+        time.sleep(self.duration)
+        with self.lock:
+            self.running -= 1
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def register_nodes(hosts):
+    """Register a node for each of ``hosts``; return the node names."""
+    nodes = []
+    for i, host in enumerate(hosts):
+        node = 'node-%d' % i
+        api.node_register(node, obm={
+            'type': OBM_TYPE_MOCK,
+            'host': host,
+            'user': 'user',
+            'password': 'password',
+        })
+        nodes.append(node)
+    return nodes
+
+
+def run_all(runner):
+    """Run jobs until there are none left."""
+    while True:
+        runner.run_jobs()
+        if runner.idle() and \
+                model.ObmJob.query.filter_by(status='pending').count() == 0:
+            break
+        time.sleep(0.01)
+    # Make sure we see the workers' changes:
+    db.session.commit()
+
+
+def job_statuses():
+    return [(job.node.label, job.status, job.error)
+            for job in model.ObmJob.query.order_by(model.ObmJob.id)]
+
+
+def test_global_limit(monkeypatch):
+    from hil.ext.obm.mock import MockObm
+    monitor = ConcurrencyMonitor()
+    monkeypatch.setattr(MockObm, 'power_cycle', monitor.operation())
+
+    nodes = register_nodes(['host-%d' % i for i in range(8)])
+    api.obm_jobs_create('power_cycle', nodes=nodes)
+    run_all(JobRunner(max_workers=3))
+
+    assert 1 < monitor.max_running <= 3
+    assert sorted(monitor.calls) == sorted((('host-%d' % i,)
+                                            for i in range(8)))
+    assert job_statuses() == [(node, 'done', None) for node in nodes]
+
+
+def test_per_bmc_limit(monkeypatch):
+    from hil.ext.obm.mock import MockObm
+    monitor = ConcurrencyMonitor()
+    monkeypatch.setattr(MockObm, 'set_bootdev', monitor.operation())
+
+    nodes = register_nodes(['shared-bmc'] * 4)
+    api.obm_jobs_create('set_bootdev', bootdev='pxe', nodes=nodes)
+    run_all(JobRunner(max_workers=4, max_per_bmc=1))
+
+    assert monitor.max_running == 1
+    assert monitor.calls == [('shared-bmc', 'pxe')] * 4
+    assert job_statuses() == [(node, 'done', None) for node in nodes]
+
+
+def test_one_job_per_node(monkeypatch):
+    """Jobs on the same node run one at a time, in the order queued."""
+    from hil.ext.obm.mock import MockObm
+    monitor = ConcurrencyMonitor()
+    monkeypatch.setattr(MockObm, 'power_off', monitor.operation())
+    monkeypatch.setattr(MockObm, 'power_cycle', monitor.operation())
+    monkeypatch.setattr(MockObm, 'set_bootdev', monitor.operation())
+
+    nodes = register_nodes(['host-0'])
+    api.obm_jobs_create('power_off', nodes=nodes)
+    api.obm_jobs_create('set_bootdev', bootdev='pxe', nodes=nodes)
+    api.obm_jobs_create('power_cycle', nodes=nodes)
+    run_all(JobRunner(max_workers=4, max_per_bmc=4))
+
+    assert monitor.max_running == 1
+    assert monitor.calls == [('host-0',), ('host-0', 'pxe'), ('host-0',)]
+
+
+def test_loads_only_free_slots(monkeypatch):
+    """Each poll loads no more pending jobs than it has workers free."""
+    from hil.ext.obm.mock import MockObm
+    monitor = ConcurrencyMonitor(duration=0.2)
+    monkeypatch.setattr(MockObm, 'power_off', monitor.operation())
+
+    nodes = register_nodes(['host-%d' % i for i in range(6)])
+    api.obm_jobs_create('power_off', nodes=nodes)
+    runner = JobRunner(max_workers=2)
+    loaded = []
+    this_thread = threading.current_thread()
+
+    def record_load(job, context):
+        # (The workers load their jobs too.)
+        if threading.current_thread() is this_thread:
+            loaded.append(job.id)
+    sqlalchemy.event.listen(model.ObmJob, 'load', record_load)
+    try:
+        assert runner.run_jobs()
+        assert loaded == [1, 2]
+        # With no workers free, there's nothing to load:
+        assert not runner.run_jobs()
+        assert loaded == [1, 2]
+    finally:
+        sqlalchemy.event.remove(model.ObmJob, 'load', record_load)
+    run_all(runner)
+    assert len(monitor.calls) == 6
+
+
+def test_failure(monkeypatch):
+    from hil.ext.obm.mock import MockObm
+    monitor = ConcurrencyMonitor(error=OBMError('BMC on fire'))
+    monkeypatch.setattr(MockObm, 'power_off', monitor.operation())
+
+    nodes = register_nodes(['host-0', 'host-1'])
+    api.obm_jobs_create('power_off', nodes=nodes)
+    run_all(JobRunner())
+
+    assert job_statuses() == [(node, 'failed', 'BMC on fire')
+                              for node in nodes]
+
+
+def test_recover():
+    """Jobs left running by a previous daemon are marked as failed."""
+    nodes = register_nodes(['host-0', 'host-1'])
+    api.obm_jobs_create('power_off', nodes=nodes)
+    model.ObmJob.query.filter_by(id=1).update({'status': 'running'})
+    db.session.commit()
+
+    JobRunner().recover()
+    assert job_statuses() == [
+        ('node-0', 'failed', 'Interrupted by daemon restart'),
+        ('node-1', 'pending', None),
+    ]
+
+
+def refresh_all(runner, max_age):
+    """Refresh power states until none are older than ``max_age``."""
+    while True:
+        # Check for idleness first; a refresh finishing after the check
+        # will be seen by the next call to refresh_power_states:
+        idle = runner.idle()
+        if not runner.refresh_power_states(max_age) and idle:
+            break
+        time.sleep(0.01)
+    db.session.commit()
+
+
+def test_refresh_power_states(monkeypatch):
+    from hil.ext.obm.mock import MockObm
+    monitor = ConcurrencyMonitor(result='on')
+    monkeypatch.setattr(MockObm, 'power_status', monitor.operation())
+
+    register_nodes(['shared-bmc'] * 3 + ['host-3'])
+    runner = JobRunner(max_workers=4, max_per_bmc=1)
+    refresh_all(runner, timedelta(minutes=1))
+
+    assert monitor.max_running <= 2
+    assert sorted(monitor.calls) == [('host-3',)] + [('shared-bmc',)] * 3
+    assert [(state.node.label, state.state, state.error)
+            for state in model.PowerState.query.order_by('node_id')] == [
+        ('node-%d' % i, 'on', None) for i in range(4)
+    ]
+
+    # Now they're all fresh, so there's nothing to do...
+    assert not runner.refresh_power_states(timedelta(minutes=1))
+    # ...until one goes stale:
+    power_state = model.PowerState.query.first()
+    power_state.updated -= timedelta(minutes=2)
+    db.session.commit()
+    refresh_all(runner, timedelta(minutes=1))
+    assert len(monitor.calls) == 5
+
+
+def test_refresh_loads_only_free_slots(monkeypatch):
+    """Each call loads no more stale nodes than there are workers free."""
+    from hil.ext.obm.mock import MockObm
+    monitor = ConcurrencyMonitor(duration=0.2, result='on')
+    monkeypatch.setattr(MockObm, 'power_status', monitor.operation())
+
+    register_nodes(['host-%d' % i for i in range(6)])
+    db.session.commit()
+    runner = JobRunner(max_workers=2)
+    loaded = []
+    this_thread = threading.current_thread()
+
+    def record_load(node, context):
+        if threading.current_thread() is this_thread:
+            loaded.append(node.label)
+    sqlalchemy.event.listen(model.Node, 'load', record_load)
+    try:
+        assert runner.refresh_power_states(timedelta(minutes=1))
+        assert len(loaded) == 2
+        assert not runner.refresh_power_states(timedelta(minutes=1))
+        assert len(loaded) == 2
+    finally:
+        sqlalchemy.event.remove(model.Node, 'load', record_load)
+    refresh_all(runner, timedelta(minutes=1))
+    assert len(monitor.calls) == 6
+
+
+def test_refresh_failure(monkeypatch):
+    from hil.ext.obm.mock import MockObm
+    monitor = ConcurrencyMonitor(error=OBMError('BMC on fire'))
+    monkeypatch.setattr(MockObm, 'power_status', monitor.operation())
+
+    register_nodes(['host-0'])
+    refresh_all(JobRunner(), timedelta(minutes=1))
+    power_state = model.PowerState.query.one()
+    assert (power_state.state, power_state.error) == (None, 'BMC on fire')
+
+
+def test_power_status_refresh_job(monkeypatch):
+    """Stale states found by the API are refreshed by the daemon."""
+    import json
+    from hil.ext.obm.mock import MockObm
+    monitor = ConcurrencyMonitor(result='on')
+    monkeypatch.setattr(MockObm, 'power_status', monitor.operation())
+
+    register_nodes(['host-0'])
+    assert json.loads(api.node_power_status('node-0'))['state'] is None
+    assert monitor.calls == []
+    run_all(JobRunner())
+
+    assert monitor.calls == [('host-0',)]
+    assert json.loads(api.node_power_status('node-0'))['state'] == 'on'
+    # The job is gone once it's done:
+    assert model.ObmJob.query.count() == 0
@@ -0,0 +1,99 @@
+"""Unit tests for hil.prefork"""
+import os
+import signal
+import threading
+import time
+
+import pytest
+import requests
+
+from hil import prefork
+from hil.test_common import config_testsuite, config_merge
+
+
+def app(environ, start_response):
+    """A WSGI app which reports the pid of the process serving it.
+
+    Requests for /slow take a second.
+    """
+    if environ['PATH_INFO'] == '/slow':
+        time.sleep(1)
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [str(os.getpid())]
+
+
+@pytest.yield_fixture
+def master():
+    """Run a Master serving `app` in a child process.
+
+    Yields ``(url, pid)``, where `pid` is the master's pid.
+    """
+    master = prefork.Master(app, '127.0.0.1', 0, workers=2, threads=2,
+                            graceful_timeout=5)
+    url = 'http://127.0.0.1:%d' % master.server.server_address[1]
+    pid = os.fork()
+    if pid == 0:
+        try:
+            master.run()
+        finally:
+            os._exit(0)
+    master.server.server_close()
+    yield url, pid
+    try:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    except OSError:
+        # The test already shut it down.
+        pass
+
+
+def _wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "Timed out"
+        time.sleep(0.1)
+
+
+def _worker_pids(url, count=20):
+    return set(int(requests.get(url).text) for _ in range(count))
+
+
+def test_options():
+    config_testsuite()
+    options = prefork.options()
+    assert options['host'] == prefork.DEFAULT_HOST
+    assert options['workers'] >= 1
+    assert options['threads'] == prefork.DEFAULT_THREADS
+    config_merge({'server': {'workers': '3', 'threads': '8'}})
+    options = prefork.options()
+    assert (options['workers'], options['threads']) == (3, 8)
+
+
+def test_serve(master):
+    url, pid = master
+    pids = _worker_pids(url)
+    assert pid not in pids
+    assert os.getpid() not in pids
+    assert len(pids) <= 2
+
+
+def test_restart(master):
+    url, pid = master
+    old = _worker_pids(url)
+    os.kill(pid, signal.SIGHUP)
+    _wait_for(lambda: not (_worker_pids(url) & old))
+
+
+def test_graceful_shutdown(master):
+    url, pid = master
+    _worker_pids(url)  # Wait for the workers to start.
+    responses = []
+    thread = threading.Thread(
+        target=lambda: responses.append(requests.get(url + '/slow')))
+    thread.start()
+    time.sleep(0.3)
+    os.kill(pid, signal.SIGTERM)
+    thread.join()
+    assert responses[0].status_code == 200
+    _, status = os.waitpid(pid, 0)
+    assert status == 0
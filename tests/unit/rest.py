@@ -24,6 +24,7 @@ from abc import ABCMeta, abstractmethod
 import unittest
 import json
 import logging
+import zlib
 
 from schema import Schema, Optional, Use
 import pytest
@@ -581,3 +582,97 @@ def test_dont_log(client, caplog):
         }))
         for record in caplog.records():
             assert 'sensitive info' not in record.getMessage()
+
+
+class TestStreaming(HttpTest):
+    """Test returning generators and streamed JSON from API calls."""
+
+    def test_generator(self):
+        @rest.rest_call('GET', '/generated', Schema({}))
+        def generated():
+            return ({'n': i} for i in range(3))
+
+        resp = self.client.get('/generated')
+        assert resp.status_code == 200
+        assert resp.mimetype == 'application/json'
+        assert json.loads(resp.get_data()) == [{'n': 0}, {'n': 1}, {'n': 2}]
+
+    def test_empty_generator(self):
+        @rest.rest_call('GET', '/generated-nothing', Schema({}))
+        def generated_nothing():
+            return (i for i in [])
+
+        assert json.loads(self.client.get('/generated-nothing').get_data()) \
+            == []
+
+    def test_json_object(self):
+        @rest.rest_call('GET', '/object', Schema({}))
+        def object_call():
+            return rest.json_object(('key-%d' % i, [i]) for i in range(3))
+
+        resp = self.client.get('/object')
+        assert json.loads(resp.get_data()) == {
+            'key-0': [0],
+            'key-1': [1],
+            'key-2': [2],
+        }
+
+    def test_chunks(self):
+        """Items are combined into chunks of about STREAM_CHUNK_SIZE bytes."""
+        items = ['x' * 100] * 1000
+        with rest.app.test_request_context():
+            chunks = list(rest.json_array(items).response)
+        assert json.loads(''.join(chunks)) == items
+        assert 1 < len(chunks) < 100
+
+
+@pytest.fixture()
+def compression_setup():
+    @rest.rest_call('GET', '/big', Schema({}))
+    def big():
+        return 'x' * 2048
+
+    @rest.rest_call('GET', '/small', Schema({}))
+    def small():
+        return 'x' * 16
+
+    @rest.rest_call('GET', '/streamed', Schema({}))
+    def streamed():
+        return ('x' for i in range(4))
+
+
+def _gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+@pytest.mark.usefixtures('compression_setup')
+class TestCompression:
+    """Test gzip compression of responses."""
+
+    def test_compressed(self, client):
+        resp = client.get('/big', headers={'Accept-Encoding': 'gzip'})
+        assert resp.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in resp.headers['Vary']
+        assert _gunzip(resp.get_data()) == 'x' * 2048
+        assert int(resp.headers['Content-Length']) == len(resp.get_data())
+
+    def test_streamed(self, client):
+        resp = client.get('/streamed', headers={'Accept-Encoding': 'gzip'})
+        assert resp.headers['Content-Encoding'] == 'gzip'
+        assert json.loads(_gunzip(resp.get_data())) == ['x'] * 4
+
+    @pytest.mark.parametrize('path,headers', [
+        ('/big', {}),
+        ('/big', {'Accept-Encoding': 'deflate'}),
+        ('/big', {'Accept-Encoding': 'gzip;q=0'}),
+        ('/small', {'Accept-Encoding': 'gzip'}),
+    ])
+    def test_uncompressed(self, client, path, headers):
+        resp = client.get(path, headers=headers)
+        assert 'Content-Encoding' not in resp.headers
+
+    def test_disabled(self, client):
+        config.cfg.add_section('compression')
+        config.cfg.set('compression', 'enabled', 'False')
+        resp = client.get('/big', headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in resp.headers
@@ -0,0 +1,89 @@
+"""Unit tests for hil.startup, and the caches which keep startup fast."""
+import importlib
+import json
+
+import pytest
+
+from hil import migrations, startup
+
+# The extensions with migration scripts:
+MIGRATING_EXTENSIONS = [
+    'hil.ext.network_allocators.vlan_pool',
+    'hil.ext.obm.mock',
+    'hil.ext.switches.brocade',
+    'hil.ext.switches.dell',
+    'hil.ext.switches.mock',
+    'hil.ext.switches.n3000',
+]
+
+
+@pytest.fixture
+def profile(monkeypatch):
+    """Enable profiling, with a fresh profile."""
+    monkeypatch.setattr(startup, 'enabled', True)
+    monkeypatch.setattr(startup, '_phases', [])
+    monkeypatch.setattr(startup, '_imports', {'sqlalchemy': 0.25})
+    monkeypatch.setattr(startup, '_reported', [False])
+
+
+def test_report(profile, capsys):
+    with startup.phase('outer'):
+        with startup.phase('inner'):
+            pass
+    startup.report()
+    lines = capsys.readouterr()[1].splitlines()
+    assert lines[0].startswith('HIL startup profile')
+    # Phases are listed in the order they started, nested phases indented:
+    assert lines[2].endswith('  outer')
+    assert lines[3].endswith('    inner')
+    assert '(outside of any phase)' in lines[4]
+    assert lines[6].endswith('0.250s  sqlalchemy')
+
+    # Only the first call reports anything:
+    startup.report()
+    assert capsys.readouterr()[1] == ''
+
+
+def test_disabled(profile, monkeypatch, capsys):
+    monkeypatch.setattr(startup, 'enabled', False)
+    with startup.phase('ignored'):
+        pass
+    startup.report()
+    assert startup._phases == []
+    assert capsys.readouterr()[1] == ''
+
+
+def test_heads_manifests():
+    """The shipped manifests are up to date, and agree with alembic.
+
+    If this fails, run ``hil-admin db cache_heads``.
+    """
+    # Loading the extensions lists their directories in `migrations.paths`:
+    for name in MIGRATING_EXTENSIONS:
+        importlib.import_module(name)
+    assert len(migrations.paths) == len(MIGRATING_EXTENSIONS) + 1
+    for directory in migrations.paths.values():
+        assert migrations._read_heads_manifest(directory) is not None, \
+            directory
+    expected = set(migrations._script_directory().get_heads())
+    assert migrations._expected_heads() == expected
+
+
+def test_stale_heads_manifest(tmpdir):
+    """A manifest which doesn't match its scripts is ignored."""
+    tmpdir.join('0123456789ab_first.py').write('revision = "0123456789ab"\n')
+    manifest = {
+        'scripts': migrations._script_hashes(str(tmpdir)),
+        'revisions': ['0123456789ab'],
+        'down_revisions': [],
+    }
+    tmpdir.join(migrations.HEADS_MANIFEST).write(json.dumps(manifest))
+    assert migrations._read_heads_manifest(str(tmpdir)) == manifest
+
+    # Changing a script, even without changing its size, makes it stale:
+    tmpdir.join('0123456789ab_first.py').write('revision = "0123456789ac"\n')
+    assert migrations._read_heads_manifest(str(tmpdir)) is None
+    tmpdir.join('0123456789ab_first.py').write('revision = "0123456789ab"\n')
+
+    tmpdir.join('ba9876543210_second.py').write('revision = "ba9876543210"\n')
+    assert migrations._read_heads_manifest(str(tmpdir)) is None